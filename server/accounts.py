@@ -0,0 +1,165 @@
+"""
+Multi-Account Pools for Credential Proxy
+
+Lets one ATProto service name front several accounts, each with its own
+session, token refresh, rate budget and circuit breaker, so aggregate
+throughput scales with the number of accounts:
+
+    "bsky": {
+        "accounts": [
+            {"identifier": "alice.bsky.social", "app_password": "..."},
+            {"identifier": "bob.bsky.social", "app_password": "..."}
+        ],
+        "account_selection": "sticky"
+    }
+
+Selection strategies:
+    sticky      Each proxy session is pinned to one account, chosen as the
+                least-used when the session first proxies (default)
+    least_used  Every request goes to the account that has served the fewest
+    budget      Every request goes to the account with the most rate-limit
+                budget left
+
+Sessions can also be pinned explicitly when they are created
+(POST /sessions with "accounts": {"bsky": "alice.bsky.social"}).
+"""
+
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+from breaker import OPEN
+
+if TYPE_CHECKING:
+    from credentials import ServiceCredential
+
+logger = logging.getLogger(__name__)
+
+STICKY = 'sticky'
+LEAST_USED = 'least_used'
+BUDGET = 'budget'
+STRATEGIES = {STICKY, LEAST_USED, BUDGET}
+
+# Session pins remembered per pool (oldest are forgotten first)
+MAX_PINNED_SESSIONS = 10000
+
+
+class UnknownAccount(ValueError):
+    """Raised when pinning a session to an account the pool doesn't have."""
+
+
+def remaining_budget(cred: 'ServiceCredential') -> float:
+    """Get an account's remaining rate-limit budget (infinite when unknown or reset)."""
+    stats = cred.rate_governor.stats()
+    if stats['remaining'] is None or (stats['reset_in'] is not None and stats['reset_in'] <= 0):
+        return math.inf
+    return stats['remaining']
+
+
+class AccountPool:
+    """
+    The accounts behind one service name and the policy for choosing between them.
+    """
+
+    def __init__(self, accounts: list['ServiceCredential'], strategy: str = STICKY):
+        if not accounts:
+            raise ValueError("account pool needs at least one account")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown account_selection '{strategy}'")
+        self.accounts = accounts
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._uses = [0] * len(accounts)
+        self._pins: OrderedDict[str, int] = OrderedDict()  # session_id -> account index
+
+    @property
+    def primary(self) -> 'ServiceCredential':
+        """First configured account (used where one representative is needed)."""
+        return self.accounts[0]
+
+    def _index_of(self, identifier: str) -> Optional[int]:
+        for i, cred in enumerate(self.accounts):
+            if cred.identifier == identifier:
+                return i
+        return None
+
+    def _least_used(self) -> int:
+        """Pick the least-used account, skipping any whose circuit is open (caller holds the lock)."""
+        candidates = [i for i, cred in enumerate(self.accounts) if cred.breaker.state != OPEN]
+        return min(candidates or range(len(self.accounts)), key=lambda i: self._uses[i])
+
+    def _most_budget(self) -> int:
+        """Pick the account with the most rate budget left (caller holds the lock)."""
+        candidates = [i for i, cred in enumerate(self.accounts) if cred.breaker.state != OPEN]
+        return max(
+            candidates or range(len(self.accounts)),
+            key=lambda i: (remaining_budget(self.accounts[i]), -self._uses[i])
+        )
+
+    def pin(self, session_id: str, identifier: str) -> None:
+        """
+        Pin a session to one account.
+
+        Raises:
+            UnknownAccount if no account has that identifier
+        """
+        index = self._index_of(identifier)
+        if index is None:
+            raise UnknownAccount(f"no account '{identifier}'")
+        with self._lock:
+            self._remember(session_id, index)
+
+    def unpin(self, session_id: str) -> None:
+        """Forget a session's account."""
+        with self._lock:
+            self._pins.pop(session_id, None)
+
+    def _remember(self, session_id: str, index: int) -> None:
+        self._pins[session_id] = index
+        self._pins.move_to_end(session_id)
+        while len(self._pins) > MAX_PINNED_SESSIONS:
+            self._pins.popitem(last=False)
+
+    def select(self, session_id: Optional[str] = None) -> 'ServiceCredential':
+        """
+        Choose the account for one request.
+
+        Args:
+            session_id: Proxy session making the request, if known
+
+        Returns:
+            The ServiceCredential to use
+        """
+        with self._lock:
+            index = self._pins.get(session_id) if session_id else None
+            if index is None:
+                if self.strategy == BUDGET:
+                    index = self._most_budget()
+                else:
+                    index = self._least_used()
+                if self.strategy == STICKY and session_id:
+                    self._remember(session_id, index)
+            self._uses[index] += 1
+            return self.accounts[index]
+
+    def stats(self) -> dict:
+        """
+        Get per-account statistics.
+
+        Returns:
+            Dict with the strategy and each account's requests and service stats
+        """
+        with self._lock:
+            uses = list(self._uses)
+            pinned = [0] * len(self.accounts)
+            for index in self._pins.values():
+                pinned[index] += 1
+        return {
+            'strategy': self.strategy,
+            'accounts': {
+                cred.identifier: {'requests': uses[i], 'pinned_sessions': pinned[i], **cred.stats()}
+                for i, cred in enumerate(self.accounts)
+            },
+        }
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Credential Proxy Server (asyncio engine)
+
+Alternative to proxy_server.py for workloads with many concurrent or slow
+upstream streams. /proxy/<service>/<path> is served natively on the asyncio
+event loop with httpx, so thousands of in-flight streams do not need one
+thread each. It also serves /proxy/<service>/_subscribe over WebSocket.
+Every other route (sessions, services, health, git bundles) is delegated
+to the Flask app.
+
+Both engines share the same SessionStore and CredentialStore instances, so
+sessions and credentials behave identically.
+
+Run with:
+    uv run python server/asgi_server.py
+"""
+
+import asyncio
+import json
+import os
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, Union
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+# Local modules (importing proxy_server also configures logging and the stores)
+from proxy_server import SSE_HEADERS, app as flask_app, check_proxy_access, credential_store, open_subscription
+from async_proxy import AsyncStreamingBody, forward_request_async
+from firehose import KEEPALIVE_INTERVAL, SUBSCRIBE_PATH, EventFilter, FilterError, asse_stream
+from pagination import PaginationError, paginated_call, split_pagination
+from resolve import RESOLVE_PATH, ResolveError, parse_resolve_request, resolve_call
+
+logger = logging.getLogger(__name__)
+
+PROXY_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS']
+
+
+def proxy_request_body(request: Request) -> Optional[Union[bytes, AsyncStreamingBody]]:
+    """
+    Wrap the incoming request body for streaming to the upstream.
+
+    Returns:
+        None for methods without a body, b'' for an empty body,
+        otherwise an AsyncStreamingBody over the ASGI receive stream
+    """
+    if request.method not in ['POST', 'PUT', 'PATCH']:
+        return None
+
+    content_length = request.headers.get('Content-Length')
+    chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+    if not content_length and not chunked:
+        return b''
+
+    return AsyncStreamingBody(
+        request.stream(),
+        int(content_length) if content_length else None
+    )
+
+
+async def proxy_request(request: Request) -> Response:
+    """
+    Transparent proxy to upstream service.
+
+    Requires valid X-Session-Id header with access to the service.
+    Forwards request with credentials injected based on service config.
+    """
+    service = request.path_params['service']
+    rest = request.path_params['rest']
+
+    denied = check_proxy_access(service, request.headers.get('X-Session-Id'))
+    if denied:
+        error, status = denied
+        return JSONResponse(error, status_code=status)
+
+    query_string = request.url.query
+
+    # /proxy/<service>/_subscribe: filtered Jetstream events as Server-Sent Events
+    if rest == SUBSCRIBE_PATH and request.method == 'GET':
+        hub, subscription, error = open_subscription(service, query_string, asyncio.get_running_loop())
+        if error:
+            body, status = error
+            return JSONResponse(body, status_code=status)
+        return StreamingResponse(asse_stream(hub, subscription), headers=SSE_HEADERS,
+                                 media_type='text/event-stream')
+
+    # /proxy/<service>/_resolve: lookups are blocking, so run them in the threadpool
+    if rest == RESOLVE_PATH:
+        payload = None
+        if request.method == 'POST':
+            try:
+                payload = await request.json()
+            except ValueError:
+                pass
+        try:
+            handles = parse_resolve_request(query_string, payload)
+        except ResolveError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        result = await run_in_threadpool(
+            resolve_call, service, handles, dict(request.headers), credential_store
+        )
+        return Response(result.body, status_code=result.status,
+                        headers=result.headers, media_type=result.content_type)
+
+    # ?_paginate=all: page fetches are blocking, so run them in the threadpool
+    if request.method == 'GET':
+        try:
+            pagination, query_string = split_pagination(query_string)
+        except PaginationError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        if pagination is not None:
+            result = await run_in_threadpool(
+                paginated_call, service, rest, dict(request.headers),
+                query_string, pagination, credential_store
+            )
+            if isinstance(result.body, bytes):
+                return Response(result.body, status_code=result.status,
+                                headers=result.headers, media_type=result.content_type)
+            return StreamingResponse(result.body, status_code=result.status,
+                                     headers=result.headers, media_type=result.content_type)
+
+    return await forward_request_async(
+        service=service,
+        path=rest,
+        method=request.method,
+        headers=dict(request.headers),
+        body=proxy_request_body(request),
+        query_string=query_string,
+        credential_store=credential_store
+    )
+
+
+async def subscribe_websocket(websocket: WebSocket) -> None:
+    """
+    Stream filtered Jetstream events over a WebSocket, one JSON event per message.
+
+    Filters come from the query string; the client can replace them at any
+    time by sending {"collections": [...], "dids": [...], "keywords": [...]}.
+    """
+    service = websocket.path_params['service']
+    denied = check_proxy_access(service, websocket.headers.get('X-Session-Id'))
+    if denied is None:
+        hub, subscription, denied = open_subscription(service, websocket.url.query, asyncio.get_running_loop())
+    if denied:
+        error, status = denied
+        # Closing before accept() rejects the handshake with HTTP 403
+        await websocket.close(code=1013 if status == 503 else 1008, reason=error['error'])
+        return
+
+    await websocket.accept()
+
+    async def receive_filters() -> None:
+        while True:
+            try:
+                message = await websocket.receive_text()
+            except WebSocketDisconnect:
+                return
+            try:
+                params = json.loads(message)
+                if not isinstance(params, dict):
+                    raise FilterError('filter must be a JSON object')
+                subscription.filter = EventFilter.from_params(params)
+            except ValueError as e:  # Includes FilterError and invalid JSON
+                await websocket.send_json({'error': str(e)})
+
+    receiver = asyncio.create_task(receive_filters())
+    try:
+        while not subscription.closed and not receiver.done():
+            event = await subscription.aget(KEEPALIVE_INTERVAL)
+            if event is not None:
+                await websocket.send_text(event.data)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        hub.unsubscribe(subscription)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """Close async upstream connections on shutdown."""
+    yield
+    for _, cred in credential_store.items():
+        await cred.aclose()
+
+
+app = Starlette(
+    routes=[
+        WebSocketRoute(f'/proxy/{{service}}/{SUBSCRIBE_PATH}', subscribe_websocket),
+        Route('/proxy/{service}/{rest:path}', proxy_request, methods=PROXY_METHODS),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    logger.info("Starting Credential Proxy Server (asyncio engine)")
+    logger.info(f"Services available: {credential_store.list_services() + ['git']}")
+
+    uvicorn.run(
+        app,
+        host='127.0.0.1',
+        port=int(os.environ.get('PORT', 8443)),
+        log_level='debug' if os.environ.get('DEBUG', 'False').lower() == 'true' else 'info'
+    )
@@ -0,0 +1,369 @@
+"""
+Async Transparent Proxy for Credential Proxy
+
+asyncio counterpart of proxy.py used by asgi_server.py. Requests and
+responses are streamed through httpx on the event loop, so an in-flight
+proxy stream costs a coroutine rather than a worker thread.
+
+The routing, caching, retry and replay decisions are proxy.py's
+(plan_request() and UpstreamAttempts); this module only does the I/O.
+Blocking work - ATProto session requests and blob cache disk access -
+runs in the default threadpool.
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+
+import httpx
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from credentials import CredentialStore
+from proxy import (
+    MAX_BODY_BYTES,
+    TOKEN_ERROR_MAX_BYTES,
+    BodyTooLarge,
+    ProxyResult,
+    RequestPlan,
+    UpstreamAttempts,
+    async_coalescer,
+    blob_cache,
+    blob_result,
+    body_too_large_result,
+    buffers_for_replay,
+    error_result,
+    plan_request,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncStreamingBody:
+    """
+    Request body read from the ASGI receive stream chunk by chunk.
+
+    Async counterpart of proxy.StreamingBody: the byte limit is enforced as
+    the upload is forwarded, so it is never held in memory as a whole.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes], content_length: Optional[int], max_bytes: int = MAX_BODY_BYTES):
+        self._stream = stream
+        self.len = content_length or 0
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def declared_too_large(self) -> bool:
+        """Check whether the client's Content-Length already exceeds the limit."""
+        return self.len > self.max_bytes
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_bytes:
+                raise BodyTooLarge(f"request body exceeds {self.max_bytes} bytes")
+            yield chunk
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that frees the upstream however the response ends.
+
+    The body iterator is closed and release awaited even when the client
+    disconnects before iteration starts, which leaves an unstarted async
+    generator's finally block unrun.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], release: Optional[Callable[[], Awaitable]] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if hasattr(self.body_iterator, 'aclose'):
+                await self.body_iterator.aclose()
+            if self._release is not None:
+                await self._release()
+
+
+def to_starlette_response(result: ProxyResult) -> Response:
+    """Convert a ProxyResult into a Starlette response, streaming iterator bodies."""
+    if result.file_path is not None:
+        # Cached blob: FileResponse handles Range requests and reads the
+        # file in the threadpool
+        return FileResponse(result.file_path, media_type=result.content_type, headers=result.headers)
+
+    if isinstance(result.body, bytes):
+        return Response(
+            result.body,
+            status_code=result.status,
+            headers=result.headers,
+            media_type=result.content_type
+        )
+    return ReleasingStreamingResponse(
+        result.body,
+        release=result.release,
+        status_code=result.status,
+        headers=result.headers,
+        media_type=result.content_type
+    )
+
+
+async def peek_body_async(chunks: AsyncIterator[bytes], max_bytes: int) -> tuple[bytes, AsyncIterator[bytes]]:
+    """Async version of peek_body()."""
+    head = []
+    size = 0
+    async for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            break
+    read = b''.join(head)
+
+    async def body() -> AsyncIterator[bytes]:
+        yield read
+        async for chunk in chunks:
+            yield chunk
+
+    return read, body()
+
+
+async def stream_upstream_async(
+    upstream_resp: httpx.Response,
+    decode: bool = True,
+    body: Optional[AsyncIterator[bytes]] = None
+) -> AsyncIterator[bytes]:
+    """
+    Yield an upstream response body and release its connection afterwards.
+
+    Args:
+        upstream_resp: Streaming upstream response
+        decode: Decode Content-Encoding; False yields the raw compressed bytes
+        body: Decoded body already being read (from peek_body_async()), used as is
+
+    Yields:
+        Body chunks
+    """
+    if body is not None:
+        chunks = body
+    else:
+        chunks = upstream_resp.aiter_bytes() if decode else upstream_resp.aiter_raw()
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await upstream_resp.aclose()
+
+
+async def forward_request_async(
+    service: str,
+    path: str,
+    method: str,
+    headers: dict,
+    body: Optional[Union[bytes, AsyncStreamingBody]],
+    query_string: str,
+    credential_store: CredentialStore
+) -> Response:
+    """
+    Forward a request to an upstream service with credential injection.
+
+    Args:
+        service: Service name to forward to
+        path: URL path after the service base URL
+        method: HTTP method (GET, POST, etc.)
+        headers: Request headers
+        body: Request body (if any), as bytes or an AsyncStreamingBody
+        query_string: Query string from original request
+        credential_store: CredentialStore instance for credential lookup
+
+    Returns:
+        Starlette response with streamed upstream response
+    """
+    return to_starlette_response(await proxy_call_async(
+        service, path, method, headers, body, query_string, credential_store
+    ))
+
+
+async def proxy_call_async(
+    service: str,
+    path: str,
+    method: str,
+    headers: dict,
+    body: Optional[Union[bytes, AsyncStreamingBody]],
+    query_string: str,
+    credential_store: CredentialStore
+) -> ProxyResult:
+    """
+    Async version of proxy_call(); iterator bodies are async iterators.
+
+    Takes the same arguments as forward_request_async().
+    """
+    plan = plan_request(service, path, method, headers, body, query_string, credential_store)
+    if isinstance(plan, ProxyResult):
+        return plan
+
+    # CID-addressed blobs never change: serve repeats from the disk cache
+    if plan.blob is not None:
+        entry = await asyncio.to_thread(blob_cache.get, plan.blob)
+        if entry is not None:
+            logger.info(f"Blob cache hit {plan.describe()}")
+            return blob_result(entry)
+
+    # Share one upstream call between identical in-flight requests
+    key = plan.flight_key(body)
+    if key is not None:
+        return await coalesced_call_async(key, lambda: send_upstream_async(plan, body), plan.describe())
+
+    return await send_upstream_async(plan, body)
+
+
+async def authenticate(attempts: UpstreamAttempts) -> None:
+    """Inject credentials; ATProto may create or refresh a session, so that runs in a thread."""
+    if attempts.plan.cred.service_type == "atproto" and not attempts.public_url:
+        await asyncio.to_thread(attempts.authenticate)
+    else:
+        attempts.authenticate()
+
+
+async def send_upstream_async(
+    plan: RequestPlan,
+    body: Optional[Union[bytes, AsyncStreamingBody]]
+) -> ProxyResult:
+    """Async version of send_upstream()."""
+    cred = plan.cred
+    if buffers_for_replay(cred, body):
+        try:
+            body = b''.join([chunk async for chunk in body])
+        except BodyTooLarge as e:
+            logger.warning(f"Aborted upload to {plan.service}/{plan.path}: {e}")
+            return body_too_large_result(body.max_bytes)
+
+    attempts = UpstreamAttempts(plan, body)
+    await authenticate(attempts)
+    peeked = None  # Upstream body, partly read to check for a token error
+
+    while True:
+        admitted = attempts.admit()
+        if isinstance(admitted, ProxyResult):
+            return admitted
+        if admitted > 0:
+            try:
+                await asyncio.sleep(admitted)
+            except asyncio.CancelledError:
+                attempts.cancelled()  # admit() may have claimed a half-open probe slot
+                raise
+        timeout = attempts.sending(" (async)")
+
+        async def send() -> httpx.Response:
+            upstream_req = cred.async_pool.build_request(
+                plan.method,
+                attempts.target_url,
+                headers=attempts.forward_headers,
+                content=body,
+                timeout=timeout
+            )
+            return await cred.async_pool.send(upstream_req)
+
+        try:
+            if attempts.hedges(body):
+                upstream_resp = await cred.hedger.arun(send, lambda resp: resp.aclose(), attempts.admit_hedge)
+            else:
+                upstream_resp = await send()
+
+        except asyncio.CancelledError:
+            attempts.cancelled()
+            raise
+
+        except BodyTooLarge as e:
+            return attempts.upload_aborted(e, body.max_bytes)
+
+        except httpx.TimeoutException:
+            outcome = attempts.timed_out()
+            if isinstance(outcome, ProxyResult):
+                return outcome
+            await asyncio.sleep(outcome)
+            continue
+
+        except httpx.TransportError as e:
+            outcome = attempts.connection_failed(e)
+            if isinstance(outcome, ProxyResult):
+                return outcome
+            await asyncio.sleep(outcome)
+            continue
+
+        except Exception as e:
+            return attempts.errored(e)
+
+        status = upstream_resp.status_code
+        try:
+            if attempts.responded(status, upstream_resp.headers):
+                await upstream_resp.aclose()
+                await authenticate(attempts)
+                continue
+
+            retry_delay = attempts.retry_delay(status, upstream_resp.headers)
+            if retry_delay is not None:
+                await upstream_resp.aclose()
+                await asyncio.sleep(retry_delay)
+                continue
+
+            if attempts.checks_token(status, upstream_resp.headers):
+                read, peeked = await peek_body_async(upstream_resp.aiter_bytes(), TOKEN_ERROR_MAX_BYTES)
+                if await asyncio.to_thread(attempts.renews_token, status, read):
+                    await upstream_resp.aclose()
+                    peeked = None
+                    continue
+        except BaseException:
+            await upstream_resp.aclose()
+            raise
+
+        break
+
+    # Unchanged upstream: answer from the stored body
+    revalidated = attempts.revalidated(status, upstream_resp.headers)
+    if revalidated is not None:
+        await upstream_resp.aclose()
+        return revalidated
+
+    response = attempts.response(status, upstream_resp.headers, decoded=peeked is not None)
+    response_body = stream_upstream_async(upstream_resp, decode=not response.passthrough, body=peeked)
+    for writer in response.writers:
+        response_body = writer.awrap(response_body)
+    return response.result(response_body, release=upstream_resp.aclose)
+
+
+async def coalesced_call_async(key: tuple, fetch: Callable[[], Awaitable[ProxyResult]], description: str) -> ProxyResult:
+    """Async version of coalesced_call()."""
+    flight, reader_id, leader = async_coalescer.join(key)
+    if leader:
+        try:
+            result = await fetch()
+        except BaseException as e:
+            async_coalescer.fail(key, flight, e)
+            raise
+        result.body = async_coalescer.lead(
+            key, flight, result.status, dict(result.headers), result.content_type,
+            result.body, result.release
+        )
+        # Leaving early hands the upstream to the followers instead of closing it
+        result.release = getattr(result.body, 'aclose', None)
+        return result
+
+    logger.info(f"Coalesced {description} onto in-flight request")
+
+    reader = flight.read(reader_id)
+    try:
+        await flight.wait_started()
+    except Exception as e:
+        await reader.aclose()
+        logger.error(f"Error proxying {description}: {e}")
+        return error_result(500, f"proxy error: {str(e)}")
+
+    return ProxyResult(
+        status=flight.status,
+        headers=dict(flight.headers),
+        body=reader,
+        content_type=flight.content_type,
+        release=reader.aclose
+    )
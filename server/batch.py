@@ -0,0 +1,240 @@
+"""
+Batch Proxy for Credential Proxy
+
+Runs many proxied sub-requests from a single /proxy/batch call. The session
+is validated once, each item is checked against the session's services, and
+items run concurrently (bounded) through the same proxy_call() path as
+/proxy/<service>/<path>, so caching, coalescing, rate limiting, retries and
+circuit breakers all apply per item.
+
+Request body:
+    {
+        "requests": [
+            {"service": "bsky", "method": "GET", "path": "app.bsky.actor.getProfile",
+             "query": {"actor": "alice.bsky.social"}},
+            {"service": "github_api", "path": "repos/owner/repo/issues/1"}
+        ],
+        "max_parallel": 8
+    }
+
+Each result carries the item's index, status, headers and body. JSON bodies
+are embedded as JSON, text as a string, and anything else base64-encoded
+with "body_encoding": "base64".
+"""
+
+import base64
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional
+from urllib.parse import urlencode
+
+from credentials import CredentialStore
+from proxy import proxy_call, read_result_body
+
+logger = logging.getLogger(__name__)
+
+BATCH_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'}
+MAX_BATCH_ITEMS = int(os.environ.get('PROXY_BATCH_MAX_ITEMS', 100))
+MAX_BATCH_PARALLEL = int(os.environ.get('PROXY_BATCH_MAX_PARALLEL', 16))
+DEFAULT_BATCH_PARALLEL = 8
+MAX_ITEM_RESPONSE_BYTES = 10 * 1024 * 1024
+
+
+class BatchError(ValueError):
+    """Raised for a malformed batch request."""
+
+
+@dataclass
+class BatchItem:
+    """One sub-request of a batch."""
+    index: int
+    service: str
+    path: str
+    method: str = 'GET'
+    query_string: str = ''
+    headers: dict = field(default_factory=dict)
+    body: Optional[bytes] = None
+
+    @classmethod
+    def from_json(cls, index: int, data: Any) -> 'BatchItem':
+        """
+        Parse one entry of the "requests" array.
+
+        Args:
+            index: Position in the batch
+            data: Decoded JSON entry
+
+        Returns:
+            BatchItem
+
+        Raises:
+            BatchError if the entry is malformed
+        """
+        if not isinstance(data, dict):
+            raise BatchError(f"requests[{index}] must be an object")
+        service = data.get('service')
+        path = data.get('path')
+        if not isinstance(service, str) or not service:
+            raise BatchError(f"requests[{index}].service is required")
+        if not isinstance(path, str):
+            raise BatchError(f"requests[{index}].path is required")
+
+        method = str(data.get('method', 'GET')).upper()
+        if method not in BATCH_METHODS:
+            raise BatchError(f"requests[{index}].method {method} is not supported")
+
+        query = data.get('query') or ''
+        if isinstance(query, dict):
+            query = urlencode(query, doseq=True)
+
+        headers = {str(k): str(v) for k, v in (data.get('headers') or {}).items()}
+        body = data.get('body')
+        if body is None:
+            body = None if method not in ('POST', 'PUT', 'PATCH') else b''
+        elif isinstance(body, str):
+            body = body.encode()
+        else:
+            body = json.dumps(body).encode()
+            if not any(k.lower() == 'content-type' for k in headers):
+                headers['Content-Type'] = 'application/json'
+
+        return cls(
+            index=index,
+            service=service,
+            path=path.lstrip('/'),
+            method=method,
+            query_string=str(query),
+            headers=headers,
+            body=body,
+        )
+
+
+def parse_batch(payload: Any) -> tuple[list[BatchItem], int]:
+    """
+    Validate a batch request body.
+
+    Args:
+        payload: Decoded JSON request body
+
+    Returns:
+        Tuple of (items, parallelism)
+
+    Raises:
+        BatchError if the batch is malformed or too large
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('requests'), list):
+        raise BatchError('body must be an object with a "requests" array')
+
+    entries = payload['requests']
+    if not entries:
+        raise BatchError('"requests" must not be empty')
+    if len(entries) > MAX_BATCH_ITEMS:
+        raise BatchError(f"at most {MAX_BATCH_ITEMS} requests per batch")
+
+    try:
+        parallel = int(payload.get('max_parallel', DEFAULT_BATCH_PARALLEL))
+    except (TypeError, ValueError):
+        raise BatchError('"max_parallel" must be an integer')
+    parallel = max(1, min(parallel, MAX_BATCH_PARALLEL))
+
+    return [BatchItem.from_json(i, entry) for i, entry in enumerate(entries)], parallel
+
+
+def encode_body(body: bytes, content_type: str) -> dict:
+    """
+    Embed a response body in a batch result.
+
+    Returns:
+        Dict with "body" (and "body_encoding" for binary bodies)
+    """
+    if not body:
+        return {'body': None}
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type == 'application/json' or media_type.endswith('+json'):
+        try:
+            return {'body': json.loads(body)}
+        except ValueError:
+            pass
+    if media_type.startswith('text/') or media_type in ('application/json', 'application/xml'):
+        try:
+            return {'body': body.decode()}
+        except UnicodeDecodeError:
+            pass
+    return {'body': base64.b64encode(body).decode(), 'body_encoding': 'base64'}
+
+
+def execute_item(item: BatchItem, credential_store: CredentialStore) -> dict:
+    """
+    Run one sub-request and build its result.
+
+    Args:
+        item: Sub-request
+        credential_store: CredentialStore instance for credential lookup
+
+    Returns:
+        Result dict with index, status, headers and body
+    """
+    try:
+        result = proxy_call(
+            item.service, item.path, item.method, item.headers,
+            item.body, item.query_string, credential_store
+        )
+        body = read_result_body(result.body, MAX_ITEM_RESPONSE_BYTES)
+    except Exception as e:
+        logger.error(f"Batch item {item.index} ({item.service}/{item.path}) failed: {e}")
+        return {'index': item.index, 'status': 502, 'error': f'proxy error: {str(e)}'}
+
+    if body is None:
+        return {
+            'index': item.index,
+            'status': 502,
+            'error': 'response too large for batch',
+            'max_bytes': MAX_ITEM_RESPONSE_BYTES
+        }
+
+    return {
+        'index': item.index,
+        'status': result.status,
+        'headers': result.headers,
+        **encode_body(body, result.headers.get('Content-Type') or result.content_type),
+    }
+
+
+def run_batch(
+    items: list[BatchItem],
+    parallel: int,
+    credential_store: CredentialStore,
+    check_access: Callable[[str], Optional[tuple[dict, int]]]
+) -> Iterator[dict]:
+    """
+    Run a batch, yielding results as items complete.
+
+    Args:
+        items: Parsed sub-requests
+        parallel: Maximum sub-requests in flight at once
+        credential_store: CredentialStore instance for credential lookup
+        check_access: Returns None if the session may use a service,
+            otherwise (error body, HTTP status)
+
+    Yields:
+        Result dicts in completion order (each carries its index)
+    """
+    runnable = []
+    for item in items:
+        denied = check_access(item.service)
+        if denied:
+            error, status = denied
+            yield {'index': item.index, 'status': status, **error}
+        else:
+            runnable.append(item)
+
+    if not runnable:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(parallel, len(runnable)), thread_name_prefix='batch') as executor:
+        futures = [executor.submit(execute_item, item, credential_store) for item in runnable]
+        for future in as_completed(futures):
+            yield future.result()
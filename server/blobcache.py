@@ -0,0 +1,376 @@
+"""
+Blob Cache for Credential Proxy
+
+ATProto blobs are addressed by CID, so their bytes never change. This
+on-disk cache keeps blobs fetched through com.atproto.sync.getBlob on ATProto
+services, and images of the form img/<preset>/plain/<did>/<cid>@<format>
+from the Bluesky CDN, keyed by CID. Repeat fetches are then served from
+disk as files (with Range support and sendfile where the server provides
+it) without touching the upstream.
+
+getBlob bodies are checked against the sha256 digest in their CID before
+they are stored, so a wrong or tampered body is never served from cache.
+CDN images are resized and re-encoded renditions whose bytes don't hash to
+the CID; they are trusted because they only come from the CDN hosts.
+
+The cache has a byte budget and evicts least-recently-used blobs. Each
+blob is stored as <key> plus a small <key>.meta JSON file holding its
+content type; the index is rebuilt from the directory at startup.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+GET_BLOB = "com.atproto.sync.getBlob"
+
+# CIDv1 base32 (the ATProto form) or legacy CIDv0 base58
+CID_PATTERN = r"b[a-z2-7]{20,}|Qm[1-9A-HJ-NP-Za-km-z]{44}"
+CID_RE = re.compile(rf"^(?:{CID_PATTERN})$")
+CDN_PATH_RE = re.compile(
+    rf"(?:^|/)img/([a-z_]+)/plain/did:[a-z]+:[A-Za-z0-9._:%-]+/({CID_PATTERN})@([a-z]+)$"
+)
+
+# Hosts serving CID-addressed image renditions
+CDN_HOSTS = {"cdn.bsky.app"}
+
+META_SUFFIX = ".meta"
+
+SHA2_256 = 0x12
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def blob_key(service_type: str, base_url: str, path: str, query_string: str) -> Optional[str]:
+    """
+    Get the cache key for a blob request.
+
+    Args:
+        service_type: Type of the service the request goes to
+        base_url: Base URL of that service
+        path: Path after the service base URL
+        query_string: Query string sent upstream
+
+    Returns:
+        "<cid>" for getBlob on an ATProto service, "<cid>.<preset>.<format>"
+        for CDN images, or None if the request is not for a CID-addressed blob
+    """
+    if service_type == "atproto" and path.rstrip("/").endswith(GET_BLOB):
+        cid = dict(parse_qsl(query_string)).get("cid")
+        return cid if cid and CID_RE.match(cid) else None
+    match = CDN_PATH_RE.search(path) if urlsplit(base_url).hostname in CDN_HOSTS else None
+    if match:
+        preset, cid, fmt = match.groups()
+        return f"{cid}.{preset}.{fmt}"
+    return None
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+    """Read an unsigned varint, returning (value, next position)."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def cid_digest(cid: str) -> Optional[bytes]:
+    """
+    Get the sha256 digest a CID commits to.
+
+    Handles CIDv1 in base32 (the ATProto form, raw or dag-cbor) and CIDv0.
+
+    Returns:
+        The 32-byte digest, or None if the CID can't be decoded or uses
+        another hash function
+    """
+    try:
+        if cid.startswith("Qm"):
+            number = 0
+            for char in cid:
+                number = number * 58 + BASE58_ALPHABET.index(char)
+            multihash = number.to_bytes(34, "big")
+        elif cid.startswith("b"):
+            encoded = cid[1:].upper()
+            raw = base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+            version, pos = _varint(raw, 0)
+            if version != 1:
+                return None
+            _codec, pos = _varint(raw, pos)
+            multihash = raw[pos:]
+        else:
+            return None
+        code, pos = _varint(multihash, 0)
+        length, pos = _varint(multihash, pos)
+    except (ValueError, IndexError, OverflowError):
+        return None
+    digest = multihash[pos:]
+    if code != SHA2_256 or length != 32 or len(digest) != 32:
+        return None
+    return digest
+
+
+@dataclass
+class BlobEntry:
+    """A cached blob on disk."""
+    key: str
+    path: str
+    size: int
+    content_type: str
+
+
+class BlobCache:
+    """
+    Thread-safe content-addressed disk cache with LRU eviction.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, BlobEntry] = OrderedDict()  # LRU first
+        self._total_bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+
+        if self.enabled and os.path.isdir(directory):
+            self._scan()
+
+    def _scan(self) -> None:
+        """Rebuild the index from blobs already on disk, oldest-used first."""
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(".blob-"):
+                # Partial download left by a crash
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(META_SUFFIX):
+                continue
+            key = name[:-len(META_SUFFIX)]
+            path = os.path.join(self.directory, key)
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+                stat = os.stat(path)
+            except (OSError, ValueError):
+                continue
+            found.append((stat.st_mtime, BlobEntry(key, path, stat.st_size, meta.get("content_type", "application/octet-stream"))))
+        for _, entry in sorted(found, key=lambda item: item[0]):
+            self._entries[entry.key] = entry
+            self._total_bytes += entry.size
+        with self._lock:
+            self._evict()
+        if found:
+            logger.info(f"Blob cache: {len(self._entries)} blob(s), {self._total_bytes} bytes in {self.directory}")
+
+    def get(self, key: str) -> Optional[BlobEntry]:
+        """
+        Look up a cached blob, marking it most recently used.
+
+        Returns:
+            BlobEntry if cached, None otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        try:
+            os.utime(entry.path)  # Keeps LRU order across restarts
+        except OSError:
+            with self._lock:
+                self._drop(key)
+            return None
+        return entry
+
+    def writer(self, key: str, content_type: str) -> 'BlobWriter':
+        """
+        Start capturing a blob streamed from the upstream.
+
+        A key that is a bare CID (getBlob) is verified against the CID's
+        digest on commit; one whose digest can't be read is not stored.
+        """
+        digest = cid_digest(key) if CID_RE.match(key) else None
+        writer = BlobWriter(self, key, content_type, digest)
+        if CID_RE.match(key) and digest is None:
+            logger.info(f"Not caching blob {key}: CID hash is not sha256")
+            writer.abort()
+        return writer
+
+    def _store(self, key: str, tmp_path: str, size: int, content_type: str) -> None:
+        """Move a fully written temp file into the cache."""
+        path = os.path.join(self.directory, key)
+        try:
+            with open(f"{path}{META_SUFFIX}", "w") as f:
+                json.dump({"content_type": content_type}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to store blob {key}: {e}")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key).size
+            self._entries[key] = BlobEntry(key, path, size, content_type)
+            self._total_bytes += size
+            self._stores += 1
+            self._evict()
+
+    def _drop(self, key: str) -> None:
+        """Remove one blob (caller holds the lock)."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry.size
+        for path in (entry.path, f"{entry.path}{META_SUFFIX}"):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        """Drop least-recently-used blobs until under budget (caller holds the lock)."""
+        while self._total_bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self._evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Get blob cache counters.
+
+        Returns:
+            Dict with size, budget and hit/miss/store/eviction counts
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'blobs': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'stores': self._stores,
+                'evictions': self._evictions,
+            }
+
+
+class BlobWriter:
+    """
+    Writes a blob to a temp file as it streams to the client.
+
+    The blob is added to the cache only if the body was read to the end
+    (and, given a digest, hashes to it); an abandoned, oversized or
+    mismatched download leaves nothing behind. The temp file is created on
+    the first write, so a body that is never read touches no disk.
+    """
+
+    def __init__(self, cache: BlobCache, key: str, content_type: str, digest: Optional[bytes] = None):
+        self._cache = cache
+        self._key = key
+        self._content_type = content_type
+        self._digest = digest
+        self._hash = hashlib.sha256() if digest is not None else None
+        self._size = 0
+        self._file = None
+        self._tmp_path: Optional[str] = None
+        self._done = False  # Committed or aborted
+
+    def _open(self) -> bool:
+        """Create the temp file if needed; False once the writer is done."""
+        if self._file is None and not self._done:
+            try:
+                os.makedirs(self._cache.directory, exist_ok=True)
+                fd, self._tmp_path = tempfile.mkstemp(dir=self._cache.directory, prefix=".blob-")
+                self._file = os.fdopen(fd, "wb")
+            except OSError as e:
+                logger.warning(f"Blob cache unavailable: {e}")
+                self.abort()
+        return self._file is not None
+
+    def write(self, chunk: bytes) -> None:
+        if not self._open():
+            return
+        file = self._file
+        self._size += len(chunk)
+        if self._size > self._cache.max_bytes:
+            self.abort()
+            return
+        try:
+            file.write(chunk)
+            if self._hash is not None:
+                self._hash.update(chunk)
+        except (OSError, ValueError) as e:  # ValueError: aborted while writing in a thread
+            logger.warning(f"Failed to write blob {self._key}: {e}")
+            self.abort()
+
+    def wrap(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Pass a body through, storing it once it has been fully read."""
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+                yield chunk
+            self.commit()
+        finally:
+            self.abort()
+
+    async def awrap(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Async version of wrap(); file writes run in the default threadpool."""
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(self.write, chunk)
+                yield chunk
+            await asyncio.to_thread(self.commit)
+        finally:
+            self.abort()
+
+    def commit(self) -> None:
+        if not self._open():
+            return
+        if self._hash is not None and self._hash.digest() != self._digest:
+            logger.warning(f"Not caching blob {self._key}: body does not match its CID")
+            self.abort()
+            return
+        try:
+            self._file.close()
+        except OSError:
+            self.abort()
+            return
+        self._file = None
+        self._done = True
+        self._cache._store(self._key, self._tmp_path, self._size, self._content_type)
+        self._tmp_path = None
+
+    def abort(self) -> None:
+        """Discard a partial blob (no-op once committed)."""
+        self._done = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp_path is not None:
+            try:
+                os.unlink(self._tmp_path)
+            except OSError:
+                pass
+            self._tmp_path = None
@@ -0,0 +1,189 @@
+"""
+Circuit Breakers for Credential Proxy
+
+One breaker per upstream service. When the recent error rate or slow-call
+rate crosses its threshold, the breaker opens and proxied requests fail
+fast with 503 instead of each waiting out the upstream timeout and pinning
+a worker. After open_seconds a few half-open probes are let through; if
+they succeed the breaker closes again, otherwise it re-opens.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """Raised when a call is refused because the service's breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class BreakerConfig:
+    """Circuit breaker settings for a single service."""
+    enabled: bool = True
+    window: int = 20                 # Recent calls considered
+    min_calls: int = 10              # Calls needed in the window before tripping
+    failure_rate: float = 0.5        # Trip when this fraction of calls failed
+    slow_call_seconds: float = 10.0  # Calls slower than this to respond count as slow
+    slow_call_rate: float = 0.8      # Trip when this fraction of calls were slow
+    open_seconds: float = 30.0       # Fail fast for this long before probing
+    half_open_probes: int = 2        # Successful probes needed to close again
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'BreakerConfig':
+        """
+        Build breaker settings from a service's "circuit_breaker" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            BreakerConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            enabled=bool(config.get("enabled", defaults.enabled)),
+            window=max(1, int(config.get("window", defaults.window))),
+            min_calls=max(1, int(config.get("min_calls", defaults.min_calls))),
+            failure_rate=float(config.get("failure_rate", defaults.failure_rate)),
+            slow_call_seconds=float(config.get("slow_call_seconds", defaults.slow_call_seconds)),
+            slow_call_rate=float(config.get("slow_call_rate", defaults.slow_call_rate)),
+            open_seconds=float(config.get("open_seconds", defaults.open_seconds)),
+            half_open_probes=max(1, int(config.get("half_open_probes", defaults.half_open_probes))),
+        )
+
+
+def is_failure_status(status: int) -> bool:
+    """
+    Check whether an upstream status means the service itself is unhealthy.
+
+    429 is left to the rate governor; it says nothing about upstream health.
+    """
+    return status >= 500
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for one upstream service.
+
+    Callers call allow() before each upstream attempt and exactly one
+    record() afterwards with the outcome.
+    """
+
+    def __init__(self, config: Optional[BreakerConfig] = None):
+        self.config = config or BreakerConfig()
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._calls: deque = deque(maxlen=self.config.window)  # (failed, slow) per call
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        self._times_opened = 0
+        self._rejected = 0
+
+    def allow(self) -> None:
+        """
+        Claim permission for one upstream attempt.
+
+        Raises:
+            CircuitOpen if the breaker is open or its probe slots are taken
+        """
+        if not self.config.enabled:
+            return
+
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.config.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self._rejected += 1
+                    raise CircuitOpen(remaining)
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+                logger.info("Circuit half-open; probing upstream")
+
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.config.half_open_probes:
+                    self._rejected += 1
+                    raise CircuitOpen(1.0)
+                self._probes_in_flight += 1
+
+    def record(self, failed: Optional[bool], duration: float = 0.0) -> None:
+        """
+        Record the outcome of an allowed attempt.
+
+        Args:
+            failed: True for an upstream failure, False for a success, None
+                for an attempt that says nothing about upstream health
+                (it only releases a half-open probe slot)
+            duration: Seconds until the upstream responded
+        """
+        if not self.config.enabled:
+            return
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed is None:
+                    return
+                if failed:
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.config.half_open_probes:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    logger.info("Circuit closed; upstream recovered")
+                return
+
+            if failed is None or self.state != CLOSED:
+                return
+
+            self._calls.append((failed, duration >= self.config.slow_call_seconds))
+            if len(self._calls) < self.config.min_calls:
+                return
+            failures = sum(1 for f, _ in self._calls if f) / len(self._calls)
+            slow = sum(1 for _, s in self._calls if s) / len(self._calls)
+            if failures >= self.config.failure_rate or slow >= self.config.slow_call_rate:
+                self._open()
+
+    def _open(self) -> None:
+        """Trip the breaker (caller holds the lock)."""
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._times_opened += 1
+        self._calls.clear()
+        logger.warning(f"Circuit opened; failing fast for {self.config.open_seconds:.0f}s")
+
+    def stats(self) -> dict:
+        """
+        Get breaker state and counters.
+
+        Returns:
+            Dict with state, recent failure/slow rates and counters
+        """
+        with self._lock:
+            calls = len(self._calls)
+            return {
+                'state': self.state,
+                'recent_calls': calls,
+                'failure_rate': round(sum(1 for f, _ in self._calls if f) / calls, 3) if calls else 0.0,
+                'slow_rate': round(sum(1 for _, s in self._calls if s) / calls, 3) if calls else 0.0,
+                'times_opened': self._times_opened,
+                'rejected': self._rejected,
+            }
@@ -0,0 +1,443 @@
+"""
+Response Cache for Credential Proxy
+
+In-process cache for proxied GET responses, shared by all sessions.
+Freshness follows upstream Cache-Control/Expires headers unless a
+per-service rule overrides it. Entries are evicted least-recently-used
+once the total cached body size exceeds a byte budget.
+
+For services with "revalidate" enabled (GitHub by default), responses that
+carry an ETag or Last-Modified are kept after they go stale and revalidated
+with a conditional request; a 304 is answered from the stored body. GitHub
+does not count 304s against the rate limit.
+
+The proxy only ever talks to an upstream with its owner's credentials, so
+responses marked "private" are cacheable here.
+"""
+
+import fnmatch
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Iterator, Optional
+from urllib.parse import parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+# Only successful responses are stored
+CACHEABLE_STATUSES = {200}
+
+# Client request headers that make a request bypass the cache lookup
+BYPASS_REQUEST_HEADERS = {'range', 'if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since'}
+
+
+@dataclass
+class CacheRule:
+    """Freshness override for paths matching a glob pattern."""
+    pattern: str  # fnmatch pattern against the path after the service base URL
+    ttl: float    # Seconds to keep matching responses; 0 disables caching
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'CacheRule':
+        return cls(pattern=config["path"], ttl=float(config["ttl"]))
+
+
+@dataclass
+class CachePolicy:
+    """Per-service caching settings."""
+    enabled: bool = True
+    revalidate: bool = False               # Keep validated entries for conditional requests
+    default_ttl: float = 0.0               # TTL when upstream sends no freshness info
+    max_entry_bytes: int = 1024 * 1024     # Larger responses are streamed but not stored
+    rules: list[CacheRule] = field(default_factory=list)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'CachePolicy':
+        """
+        Build a policy from a service's "cache" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            CachePolicy with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            enabled=bool(config.get("enabled", defaults.enabled)),
+            revalidate=bool(config.get("revalidate", defaults.revalidate)),
+            default_ttl=float(config.get("default_ttl", defaults.default_ttl)),
+            max_entry_bytes=int(config.get("max_entry_bytes", defaults.max_entry_bytes)),
+            rules=[CacheRule.from_config(rule) for rule in config.get("rules", [])],
+        )
+
+    def rule_ttl(self, path: str) -> Optional[float]:
+        """Get the TTL of the first rule matching a path, if any."""
+        for rule in self.rules:
+            if fnmatch.fnmatchcase(path, rule.pattern):
+                return rule.ttl
+        return None
+
+
+@dataclass
+class CachedResponse:
+    """A stored upstream response."""
+    status: int
+    headers: dict
+    body: bytes
+    stored_at: float
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    @property
+    def has_validators(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+    def conditional_headers(self) -> dict:
+        """Request headers that revalidate this entry with the upstream."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.expires_at
+
+    def age(self, now: Optional[float] = None) -> int:
+        return max(0, int((now or time.time()) - self.stored_at))
+
+
+def parse_cache_control(value: Optional[str]) -> dict:
+    """
+    Parse a Cache-Control header into a dict of lowercase directives.
+
+    Directives without a value map to True.
+    """
+    directives = {}
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition('=')
+        directives[name.strip().lower()] = arg.strip().strip('"') if arg else True
+    return directives
+
+
+def upstream_ttl(headers: dict, now: Optional[float] = None) -> Optional[float]:
+    """
+    Get the freshness lifetime an upstream response declares.
+
+    Args:
+        headers: Upstream response headers (case-insensitive mapping)
+        now: Current time (for Expires)
+
+    Returns:
+        Seconds the response may be served from cache, 0 if it must not be,
+        or None if the upstream gave no freshness information
+    """
+    cache_control = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0.0
+
+    for directive in ('s-maxage', 'max-age'):
+        if directive in cache_control:
+            try:
+                return max(0.0, float(cache_control[directive]))
+            except (TypeError, ValueError):
+                return 0.0
+
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            expires_at = parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return 0.0  # Invalid Expires means already expired
+        return max(0.0, expires_at - (now or time.time()))
+
+    return None
+
+
+def response_ttl(policy: CachePolicy, path: str, status: int, headers: dict) -> float:
+    """
+    Decide how long to cache an upstream response.
+
+    Per-service rules take precedence over upstream headers; the service's
+    default_ttl applies when neither says anything.
+
+    Returns:
+        TTL in seconds (0 means do not store)
+    """
+    if not policy.enabled or status not in CACHEABLE_STATUSES:
+        return 0.0
+
+    ttl = policy.rule_ttl(path)
+    if ttl is None:
+        ttl = upstream_ttl(headers)
+    if ttl is None:
+        ttl = policy.default_ttl
+    return ttl
+
+
+def may_store(policy: CachePolicy, status: int, headers: dict, ttl: float) -> bool:
+    """
+    Decide whether an upstream response should be stored at all.
+
+    Responses with a positive TTL are stored; with revalidation enabled,
+    responses carrying validators are stored even when already stale.
+    """
+    if not policy.enabled or status not in CACHEABLE_STATUSES:
+        return False
+    if 'no-store' in parse_cache_control(headers.get('Cache-Control')):
+        return False
+    if ttl > 0:
+        return True
+    return policy.revalidate and bool(headers.get('ETag') or headers.get('Last-Modified'))
+
+
+def is_cacheable_request(method: str, headers: dict) -> bool:
+    """Check whether a client request may be answered from the cache."""
+    if method != 'GET':
+        return False
+    return not any(k.lower() in BYPASS_REQUEST_HEADERS for k in headers)
+
+
+def make_cache_key(
+    service: str,
+    credential_id: str,
+    method: str,
+    path: str,
+    query_string: str,
+    headers: dict
+) -> tuple:
+    """
+    Build a normalized cache key.
+
+    Query parameters are sorted so that ?a=1&b=2 and ?b=2&a=1 share an entry.
+    The credential fingerprint keeps responses fetched with one credential
+    from being served (or revalidated) under another. Accept is part of the
+    key because some APIs (GitHub media types) return different
+    representations for the same URL.
+    """
+    query = urlencode(sorted(parse_qsl(query_string, keep_blank_values=True)))
+    accept = next((v for k, v in headers.items() if k.lower() == 'accept'), '')
+    return (service, credential_id, method.upper(), path.strip('/'), query, accept)
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU response cache bounded by total body bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._evictions = 0
+        # Per-service counters: {service: {'hits': n, 'misses': n, ...}}
+        self._counters: dict[str, dict[str, int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _count(self, service: str, counter: str) -> None:
+        counters = self._counters.setdefault(
+            service, {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0}
+        )
+        counters[counter] += 1
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        """
+        Look up a fresh entry, counting a hit or miss.
+
+        Args:
+            key: Key from make_cache_key()
+
+        Stale entries without validators are dropped; stale entries with
+        validators are kept for get_stale().
+
+        Returns:
+            CachedResponse if present and fresh, None otherwise
+        """
+        service = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not entry.is_fresh():
+                if not entry.has_validators:
+                    self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._count(service, 'misses')
+                return None
+
+            self._entries.move_to_end(key)
+            self._count(service, 'hits')
+            return entry
+
+    def get_stale(self, key: tuple) -> Optional[CachedResponse]:
+        """
+        Get a stale entry that can be revalidated with a conditional request.
+
+        Returns:
+            CachedResponse with an ETag or Last-Modified, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.has_validators:
+                return None
+            return entry
+
+    def refresh(self, key: tuple, entry: CachedResponse, ttl: float) -> None:
+        """
+        Mark an entry fresh again after the upstream answered 304.
+
+        Args:
+            key: Key the entry is stored under
+            entry: The revalidated entry
+            ttl: New freshness lifetime in seconds
+        """
+        now = time.time()
+        with self._lock:
+            entry.stored_at = now
+            entry.expires_at = now + ttl
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+            self._count(key[0], 'revalidated')
+
+    def put(self, key: tuple, entry: CachedResponse) -> bool:
+        """
+        Store an entry, evicting least-recently-used entries to make room.
+
+        Returns:
+            True if stored, False if the entry alone exceeds the budget
+        """
+        if entry.size > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            while self._entries and self._bytes + entry.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._count(key[0], 'stores')
+            return True
+
+    def _remove(self, key: tuple) -> None:
+        """Remove an entry (caller holds the lock)."""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Get cache usage and hit/miss counters.
+
+        Returns:
+            Dict with totals and per-service counters
+        """
+        with self._lock:
+            services = {name: dict(counters) for name, counters in self._counters.items()}
+            entries = len(self._entries)
+            used = self._bytes
+            evictions = self._evictions
+
+        hits = sum(c['hits'] for c in services.values())
+        misses = sum(c['misses'] for c in services.values())
+        revalidated = sum(c['revalidated'] for c in services.values())
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'bytes': used,
+            'max_bytes': self.max_bytes,
+            'evictions': evictions,
+            'hits': hits,
+            'misses': misses,
+            'revalidated': revalidated,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            'services': services,
+        }
+
+
+class CacheWriter:
+    """
+    Captures a streamed response body for the cache.
+
+    The proxy passes every chunk through write() as it streams to the client
+    and calls commit() once the body has been read to the end. Bodies larger
+    than max_entry_bytes are dropped without delaying the client.
+    """
+
+    def __init__(self, cache: ResponseCache, key: tuple, status: int, headers: dict,
+                 ttl: float, max_entry_bytes: int):
+        self._cache = cache
+        self._key = key
+        self._status = status
+        self._headers = headers
+        self._ttl = ttl
+        self._etag = next((v for k, v in headers.items() if k.lower() == 'etag'), None)
+        self._last_modified = next((v for k, v in headers.items() if k.lower() == 'last-modified'), None)
+        self._max_entry_bytes = max_entry_bytes
+        self._chunks: Optional[list[bytes]] = []
+        self._size = 0
+
+    def write(self, chunk: bytes) -> None:
+        if self._chunks is None:
+            return
+        self._size += len(chunk)
+        if self._size > self._max_entry_bytes:
+            self._chunks = None
+        else:
+            self._chunks.append(chunk)
+
+    def wrap(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Pass a body through, committing once it has been fully read."""
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+        self.commit()
+
+    async def awrap(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Async version of wrap()."""
+        async for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+        self.commit()
+
+    def commit(self) -> None:
+        if self._chunks is None:
+            return
+        now = time.time()
+        self._cache.put(self._key, CachedResponse(
+            status=self._status,
+            headers=self._headers,
+            body=b''.join(self._chunks),
+            stored_at=now,
+            expires_at=now + self._ttl,
+            etag=self._etag,
+            last_modified=self._last_modified
+        ))
+        self._chunks = None
@@ -0,0 +1,676 @@
+"""
+Request Coalescing for Credential Proxy
+
+Single-flight layer for idempotent upstream requests: while a request is in
+flight, identical requests for the same service and credential join it
+instead of going upstream again.
+
+The first request (the leader) streams the upstream response inline, and
+every chunk it reads is shared with the followers through a bounded
+buffer. Without followers the leader only keeps the first
+max_buffer_bytes, so a late joiner can still replay the body from the
+start; past that the flight stops accepting joiners and nothing is kept.
+
+With followers, the leader waits whenever the slowest one falls
+max_buffer_bytes behind, and chunks every follower has consumed are
+dropped (which also closes the flight to joiners). Followers that make no
+room for stall_timeout are cut off so the leader can carry on. If the
+leader's client leaves while followers are still reading, the rest of the
+body is pumped for them in the background.
+
+Flight/Coalescer serve the threaded engine and AsyncFlight/AsyncCoalescer
+the asyncio engine; both share the buffer bookkeeping in _FlightBuffer.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Request headers that never change the upstream response
+IGNORED_KEY_HEADERS = {'user-agent', 'x-request-id', 'traceparent', 'x-forwarded-for', 'x-real-ip'}
+
+
+class FlightAborted(Exception):
+    """Raised to readers when the shared upstream response failed mid-stream."""
+
+
+def make_flight_key(service: str, credential_id: str, method: str, url: str, headers: dict) -> tuple:
+    """
+    Build the key identifying identical requests.
+
+    Args:
+        service: Service name
+        credential_id: Fingerprint of the credential used upstream
+        method: HTTP method
+        url: Target URL before credential injection
+        headers: Forwarded request headers
+
+    Returns:
+        Hashable key
+    """
+    key_headers = tuple(sorted(
+        (k.lower(), v) for k, v in headers.items()
+        if k.lower() not in IGNORED_KEY_HEADERS
+    ))
+    return (service, credential_id, method.upper(), url, key_headers)
+
+
+class _FlightBuffer:
+    """
+    Shared body buffer and follower cursors of one flight.
+
+    Holds no lock of its own: Flight calls these methods under its
+    condition, and AsyncFlight from the event loop.
+    """
+
+    def __init__(self, max_buffer_bytes: int):
+        self.max_buffer_bytes = max_buffer_bytes
+
+        self.status: Optional[int] = None
+        self.headers: dict = {}
+        self.content_type: Optional[str] = None
+        self._started = False
+        self._done = False
+        self._error: Optional[BaseException] = None
+
+        self._chunks: list[bytes] = []
+        self._offset = 0       # Absolute index of self._chunks[0]
+        self._buffered = 0     # Bytes currently held in self._chunks
+        self._readers: dict[int, int] = {}  # Reader id -> next absolute chunk index
+        self._next_reader_id = 0
+        self.joinable = True
+
+    def _add_reader(self) -> Optional[int]:
+        if not self.joinable:
+            return None
+        reader_id = self._next_reader_id
+        self._next_reader_id += 1
+        self._readers[reader_id] = self._offset
+        return reader_id
+
+    def _remove_reader(self, reader_id: int) -> None:
+        self._readers.pop(reader_id, None)
+        self._trim()
+
+    def _has_started(self) -> bool:
+        return self._started or self._error is not None
+
+    def _check_started(self) -> None:
+        if not self._started:
+            raise self._error
+
+    def _start(self, status: int, headers: dict, content_type: str) -> None:
+        self.status = status
+        self.headers = headers
+        self.content_type = content_type
+        self._started = True
+
+    def _chunk_ready(self, reader_id: int) -> bool:
+        return self._readers[reader_id] - self._offset < len(self._chunks) or self._done
+
+    def _take(self, reader_id: int) -> Optional[bytes]:
+        """
+        Get a reader's next chunk once _chunk_ready() holds.
+
+        Returns:
+            The chunk, or None at the end of the body
+
+        Raises:
+            FlightAborted if the upstream response failed mid-stream
+        """
+        position = self._readers[reader_id]
+        if position - self._offset < len(self._chunks):
+            chunk = self._chunks[position - self._offset]
+            self._readers[reader_id] = position + 1
+            self._trim()
+            return chunk
+        if self._error is not None:
+            raise FlightAborted(str(self._error))
+        return None
+
+    def _discards(self) -> bool:
+        """Check whether chunks can be dropped outright (ended, or nobody can read them)."""
+        return self._done or (not self._readers and not self.joinable)
+
+    def _has_room(self) -> bool:
+        return self._buffered <= self.max_buffer_bytes or not self._readers
+
+    def _push(self, chunk: bytes) -> None:
+        self._chunks.append(chunk)
+        self._buffered += len(chunk)
+        if not self._readers and self._buffered > self.max_buffer_bytes:
+            # Too much to replay for a late joiner: stop keeping the body
+            self._offset += len(self._chunks)
+            self._chunks.clear()
+            self._buffered = 0
+            self.joinable = False
+
+    def _end(self, error: Optional[BaseException]) -> None:
+        if self._done:
+            return
+        self._done = True
+        self._error = error
+        self.joinable = False
+
+    def _trim(self) -> None:
+        """Drop chunks every reader has consumed."""
+        if self._buffered <= self.max_buffer_bytes:
+            return
+        lowest = min(self._readers.values(), default=self._offset + len(self._chunks))
+        drop = lowest - self._offset
+        if drop <= 0:
+            return
+        self._buffered -= sum(len(c) for c in self._chunks[:drop])
+        del self._chunks[:drop]
+        self._offset += drop
+        self.joinable = False
+
+
+class Flight(_FlightBuffer):
+    """
+    One upstream response shared by every identical in-flight request.
+
+    The leader calls start(), append() and finish(); each follower reads
+    the body through its own cursor via read().
+    """
+
+    def __init__(self, max_buffer_bytes: int):
+        super().__init__(max_buffer_bytes)
+        self._cond = threading.Condition()
+
+    # -- Follower side ----------------------------------------------------
+
+    def add_reader(self) -> Optional[int]:
+        """
+        Register a follower.
+
+        Returns:
+            Reader id, or None if the flight no longer accepts joiners
+        """
+        with self._cond:
+            return self._add_reader()
+
+    def wait_started(self) -> None:
+        """
+        Block until the upstream response headers are available.
+
+        Raises:
+            The upstream exception if the request failed before responding
+        """
+        with self._cond:
+            self._cond.wait_for(self._has_started)
+            self._check_started()
+
+    def read(self, reader_id: int) -> 'FlightReader':
+        """Get an iterator over the shared body for one follower."""
+        return FlightReader(self, reader_id)
+
+    def _next_chunk(self, reader_id: int) -> Optional[bytes]:
+        """Block until the reader's next chunk is available (see _take())."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._chunk_ready(reader_id))
+            try:
+                return self._take(reader_id)
+            finally:
+                self._cond.notify_all()
+
+    def remove_reader(self, reader_id: int) -> None:
+        with self._cond:
+            self._remove_reader(reader_id)
+            self._cond.notify_all()
+
+    def has_readers(self) -> bool:
+        with self._cond:
+            return bool(self._readers)
+
+    # -- Leader side ------------------------------------------------------
+
+    def start(self, status: int, headers: dict, content_type: str) -> None:
+        with self._cond:
+            self._start(status, headers, content_type)
+            self._cond.notify_all()
+
+    def append(self, chunk: bytes, stall_timeout: float) -> None:
+        """
+        Share a body chunk the leader has read.
+
+        Waits while the slowest follower is more than max_buffer_bytes
+        behind; if none makes room for stall_timeout, the followers are cut
+        off (they get FlightAborted) and the chunk is dropped.
+
+        Args:
+            chunk: Body chunk
+            stall_timeout: Longest to wait for a follower to make room
+        """
+        with self._cond:
+            if self._discards():
+                return
+            if not self._cond.wait_for(self._has_room, stall_timeout):
+                logger.debug("Coalesced readers stalled; cutting them off")
+                self._end(FlightAborted("coalesced readers stalled"))
+            else:
+                self._push(chunk)
+            self._cond.notify_all()
+
+    def complete(self, body: bytes) -> None:
+        """Share a whole body at once and end the flight."""
+        with self._cond:
+            self._push(body)
+            self._end(None)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self._end(error)
+            self._cond.notify_all()
+
+
+class FlightReader:
+    """
+    One follower's view of a flight's body.
+
+    close() deregisters the reader even if iteration never started, so a
+    client that disconnects early cannot hold the leader back.
+    """
+
+    def __init__(self, flight: Flight, reader_id: int):
+        self._flight = flight
+        self._reader_id = reader_id
+        self._closed = False
+
+    def __iter__(self) -> 'FlightReader':
+        return self
+
+    def __next__(self) -> bytes:
+        if self._closed:
+            raise StopIteration
+        try:
+            chunk = self._flight._next_chunk(self._reader_id)
+        except BaseException:
+            self.close()
+            raise
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._flight.remove_reader(self._reader_id)
+
+
+class LeaderBody:
+    """
+    The leader's copy of a flight's body, read inline on its own thread.
+
+    Each chunk is shared with the flight as it passes through. close()
+    before the end hands the rest of the body to a background pump when
+    followers are still reading, and otherwise releases the upstream.
+    """
+
+    def __init__(
+        self,
+        coalescer: 'Coalescer',
+        key: tuple,
+        flight: Flight,
+        body: Iterator[bytes],
+        release: Optional[Callable[[], object]] = None
+    ):
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        self._body = body
+        self._chunks = iter(body)
+        self._release = release
+        self._closed = False
+
+    def __iter__(self) -> 'LeaderBody':
+        return self
+
+    def __next__(self) -> bytes:
+        if self._closed:
+            raise StopIteration
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._land(None)
+            raise
+        except BaseException as e:
+            self._land(e)
+            raise
+        self._flight.append(chunk, self._coalescer.stall_timeout)
+        return chunk
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        if self._flight.has_readers():
+            self._closed = True
+            threading.Thread(target=self._pump, daemon=True, name="coalesce-pump").start()
+        else:
+            self._land(FlightAborted("leader left"))
+
+    def _pump(self) -> None:
+        """Read the rest of the body for the followers after the leader left."""
+        error = None
+        try:
+            for chunk in self._chunks:
+                if not self._flight.has_readers():
+                    error = FlightAborted("coalesced readers left")
+                    break
+                self._flight.append(chunk, self._coalescer.stall_timeout)
+        except Exception as e:
+            error = e
+        finally:
+            self._land(error)
+
+    def _land(self, error: Optional[BaseException]) -> None:
+        """Release the upstream, unregister the flight and end it."""
+        self._closed = True
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+            if self._release is not None:
+                self._release()
+        finally:
+            self._coalescer._unregister(self._key, self._flight)
+            self._flight.finish(error)
+
+
+class AsyncFlight(_FlightBuffer):
+    """
+    Asyncio counterpart of Flight; every participant runs on the event loop.
+
+    State changes wake waiters through an Event that is replaced each time.
+    """
+
+    def __init__(self, max_buffer_bytes: int):
+        super().__init__(max_buffer_bytes)
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait_for(self, predicate: Callable[[], bool]) -> None:
+        while not predicate():
+            await self._changed.wait()
+
+    # -- Follower side ----------------------------------------------------
+
+    def add_reader(self) -> Optional[int]:
+        return self._add_reader()
+
+    async def wait_started(self) -> None:
+        """Async version of Flight.wait_started()."""
+        await self._wait_for(self._has_started)
+        self._check_started()
+
+    def read(self, reader_id: int) -> 'AsyncFlightReader':
+        return AsyncFlightReader(self, reader_id)
+
+    async def _next_chunk(self, reader_id: int) -> Optional[bytes]:
+        await self._wait_for(lambda: self._chunk_ready(reader_id))
+        try:
+            return self._take(reader_id)
+        finally:
+            self._notify()
+
+    def remove_reader(self, reader_id: int) -> None:
+        self._remove_reader(reader_id)
+        self._notify()
+
+    def has_readers(self) -> bool:
+        return bool(self._readers)
+
+    # -- Leader side ------------------------------------------------------
+
+    def start(self, status: int, headers: dict, content_type: str) -> None:
+        self._start(status, headers, content_type)
+        self._notify()
+
+    async def append(self, chunk: bytes, stall_timeout: float) -> None:
+        """Async version of Flight.append()."""
+        if self._discards():
+            return
+        try:
+            await asyncio.wait_for(self._wait_for(self._has_room), stall_timeout)
+        except asyncio.TimeoutError:
+            logger.debug("Coalesced readers stalled; cutting them off")
+            self._end(FlightAborted("coalesced readers stalled"))
+        else:
+            if not self._discards():
+                self._push(chunk)
+        self._notify()
+
+    def complete(self, body: bytes) -> None:
+        self._push(body)
+        self._end(None)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self._end(error)
+        self._notify()
+
+
+class AsyncFlightReader:
+    """One follower's view of an AsyncFlight's body (see FlightReader)."""
+
+    def __init__(self, flight: AsyncFlight, reader_id: int):
+        self._flight = flight
+        self._reader_id = reader_id
+        self._closed = False
+
+    def __aiter__(self) -> 'AsyncFlightReader':
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self._flight._next_chunk(self._reader_id)
+        except BaseException:
+            await self.aclose()
+            raise
+        if chunk is None:
+            await self.aclose()
+            raise StopAsyncIteration
+        return chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._flight.remove_reader(self._reader_id)
+
+
+class AsyncLeaderBody:
+    """The leader's copy of an AsyncFlight's body (see LeaderBody)."""
+
+    def __init__(
+        self,
+        coalescer: 'AsyncCoalescer',
+        key: tuple,
+        flight: AsyncFlight,
+        body: AsyncIterator[bytes],
+        release: Optional[Callable[[], Awaitable]] = None
+    ):
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        self._body = body
+        self._chunks = body.__aiter__()
+        self._release = release
+        self._closed = False
+
+    def __aiter__(self) -> 'AsyncLeaderBody':
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            await self._land(None)
+            raise
+        except BaseException as e:
+            await self._land(e)
+            raise
+        await self._flight.append(chunk, self._coalescer.stall_timeout)
+        return chunk
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        if self._flight.has_readers():
+            self._closed = True
+            self._coalescer._spawn(self._pump())
+        else:
+            await self._land(FlightAborted("leader left"))
+
+    async def _pump(self) -> None:
+        """Read the rest of the body for the followers after the leader left."""
+        error = None
+        try:
+            async for chunk in self._chunks:
+                if not self._flight.has_readers():
+                    error = FlightAborted("coalesced readers left")
+                    break
+                await self._flight.append(chunk, self._coalescer.stall_timeout)
+        except Exception as e:
+            error = e
+        finally:
+            await self._land(error)
+
+    async def _land(self, error: Optional[BaseException]) -> None:
+        """Release the upstream, unregister the flight and end it."""
+        self._closed = True
+        try:
+            if hasattr(self._body, 'aclose'):
+                await self._body.aclose()
+            if self._release is not None:
+                await self._release()
+        finally:
+            self._coalescer._unregister(self._key, self._flight)
+            self._flight.finish(error)
+
+
+class Coalescer:
+    """
+    Registry of in-flight upstream requests.
+
+    join() returns the flight for a key; the first caller for a key is the
+    leader, sends the upstream request itself and passes the response to
+    lead(). Everyone else gets a reader id and streams via flight.read().
+    """
+
+    flight_type = Flight
+    leader_type = LeaderBody
+
+    def __init__(self, max_buffer_bytes: int, stall_timeout: float = 60.0):
+        self.max_buffer_bytes = max_buffer_bytes
+        self.stall_timeout = stall_timeout
+        self._flights: dict[tuple, _FlightBuffer] = {}
+        self._lock = threading.Lock()
+        # Per-service counters: {service: {'upstream': n, 'coalesced': n}}
+        self._counters: dict[str, dict[str, int]] = {}
+
+    def join(self, key: tuple) -> tuple[_FlightBuffer, Optional[int], bool]:
+        """
+        Join the in-flight request for a key, or start a new one.
+
+        Returns:
+            Tuple of (flight, reader id, whether the caller is the leader);
+            the leader has no reader id
+        """
+        service = key[0]
+        with self._lock:
+            counters = self._counters.setdefault(service, {'upstream': 0, 'coalesced': 0})
+            flight = self._flights.get(key)
+            if flight is not None:
+                reader_id = flight.add_reader()
+                if reader_id is not None:
+                    counters['coalesced'] += 1
+                    return flight, reader_id, False
+
+            flight = self.flight_type(self.max_buffer_bytes)
+            self._flights[key] = flight
+            counters['upstream'] += 1
+            return flight, None, True
+
+    def lead(
+        self,
+        key: tuple,
+        flight: _FlightBuffer,
+        status: int,
+        headers: dict,
+        content_type: str,
+        body: Union[bytes, Iterator[bytes], AsyncIterator[bytes]],
+        release: Optional[Callable] = None
+    ) -> Union[bytes, LeaderBody, AsyncLeaderBody]:
+        """
+        Publish the leader's upstream response to the flight.
+
+        Args:
+            key: Flight key (removed from the registry when the body ends)
+            flight: The leader's flight
+            status: Upstream status code
+            headers: Response headers
+            content_type: Response content type
+            body: Response body
+            release: Frees the upstream even if the body is never read
+
+        Returns:
+            The body for the leader to stream: bytes unchanged, or an
+            iterator sharing each chunk as the leader reads it
+        """
+        flight.start(status, headers, content_type)
+        if isinstance(body, bytes):
+            flight.complete(body)
+            self._unregister(key, flight)
+            return body
+        return self.leader_type(self, key, flight, body, release)
+
+    def fail(self, key: tuple, flight: _FlightBuffer, error: BaseException) -> None:
+        """End a flight whose leader failed before getting a response."""
+        self._unregister(key, flight)
+        flight.finish(error)
+
+    def _unregister(self, key: tuple, flight: _FlightBuffer) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self) -> dict:
+        """
+        Get coalescing counters.
+
+        Returns:
+            Dict with in-flight count and per-service upstream/coalesced counts
+        """
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'services': {name: dict(c) for name, c in self._counters.items()},
+            }
+
+
+class AsyncCoalescer(Coalescer):
+    """Coalescer for the asyncio engine (all flights live on one event loop)."""
+
+    flight_type = AsyncFlight
+    leader_type = AsyncLeaderBody
+
+    def __init__(self, max_buffer_bytes: int, stall_timeout: float = 60.0):
+        super().__init__(max_buffer_bytes, stall_timeout)
+        self._pumps: set[asyncio.Task] = set()
+
+    def _spawn(self, pump: Awaitable) -> None:
+        """Run a handed-off pump, keeping a reference until it finishes."""
+        task = asyncio.ensure_future(pump)
+        self._pumps.add(task)
+        task.add_done_callback(self._pumps.discard)
@@ -2,22 +2,37 @@
 Credential Store for Credential Proxy
 
 Service-aware credential handling with built-in support for:
-- ATProto (Bluesky): Automatic session management with identifier + app_password
+- ATProto (Bluesky): Automatic session management with identifier + app_password,
+  renewed in the background ahead of the access token's exp claim
 - Bearer token APIs: Simple token injection
 - Git: Pseudo-service using local git/gh CLI (no credentials needed)
 """
 
+import base64
+import contextlib
+import hashlib
 import json
 import os
 import logging
 import threading
 import time
-from dataclasses import dataclass, field
-from typing import Optional
-from datetime import datetime, timedelta
+from dataclasses import asdict, dataclass, field
+from typing import Optional, Union
 
 import requests
 
+from accounts import STICKY, AccountPool, UnknownAccount
+from breaker import BreakerConfig, CircuitBreaker
+from cache import CachePolicy
+from firehose import Firehose, JetstreamConfig
+from hedge import HedgeConfig, Hedger
+from identity import DidResolver, HandleCache, IdentityConfig, create_resolver, normalize_handle, pds_endpoint
+from pool import AsyncServicePool, HTTP2ServicePool, PoolConfig, ServicePool, create_pool
+from ratelimit import RateGovernor, RateLimitConfig
+from retry import RetryPolicy
+from routing import APPVIEW, ENTRYWAY, PDS, RoutingConfig, XrpcRouter, call_repo
+from session_cache import SessionCache, create_session_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,23 +40,94 @@ logger = logging.getLogger(__name__)
 KNOWN_SERVICES = {
     "bsky": {
         "base_url": "https://bsky.social/xrpc",
-        "type": "atproto"
+        "type": "atproto",
+        "jetstream": {"enabled": True}
     },
     "github_api": {
         "base_url": "https://api.github.com",
-        "type": "bearer"
+        "type": "bearer",
+        # 304 responses are free against GitHub's rate limit
+        "cache": {"revalidate": True}
     }
 }
 
 
-@dataclass
+# Renew ATProto sessions in the background once they expire within this many seconds
+REFRESH_AHEAD = 600
+
+# Tokens closer than this many seconds to expiry are not handed out on the request path
+TOKEN_MIN_VALIDITY = 60
+
+# Assumed access token lifetime (seconds) when the JWT carries no readable exp claim
+DEFAULT_TOKEN_LIFETIME = 2 * 60 * 60
+
+# XRPC errors meaning the access token was rejected before its expected expiry
+TOKEN_ERROR_STATUSES = {400, 401}
+TOKEN_ERRORS = {"ExpiredToken", "InvalidToken"}
+
+
+def jwt_expiry(token: str) -> Optional[float]:
+    """
+    Read the exp claim of a JWT without verifying it.
+
+    Args:
+        token: Encoded JWT
+
+    Returns:
+        Expiry as a Unix timestamp, or None if it cannot be read
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def is_token_error(status: int, body: bytes) -> bool:
+    """
+    Check whether an XRPC error response rejects the access token.
+
+    Args:
+        status: Upstream HTTP status
+        body: Upstream response body
+
+    Returns:
+        True for ExpiredToken/InvalidToken errors
+    """
+    if status not in TOKEN_ERROR_STATUSES:
+        return False
+    try:
+        error = json.loads(body).get("error")
+    except (ValueError, AttributeError):
+        return False
+    return error in TOKEN_ERRORS
+
+
+@dataclass(frozen=True)
 class ATProtoSession:
-    """Cached ATProto session with access and refresh tokens."""
+    """
+    Cached ATProto session with access and refresh tokens.
+
+    Immutable: a renewal publishes a new instance, so readers can use
+    whichever snapshot they picked up without holding a lock.
+    """
     access_jwt: str
     refresh_jwt: str
     did: str
     handle: str
-    expires_at: datetime
+    expires_at: float  # Unix timestamp of the access token's exp
+
+    @classmethod
+    def from_response(cls, data: dict) -> 'ATProtoSession':
+        """Build a session from a createSession/refreshSession response."""
+        return cls(
+            access_jwt=data["accessJwt"],
+            refresh_jwt=data["refreshJwt"],
+            did=data["did"],
+            handle=data["handle"],
+            expires_at=jwt_expiry(data["accessJwt"]) or time.time() + DEFAULT_TOKEN_LIFETIME
+        )
 
 
 @dataclass
@@ -60,14 +146,90 @@ class ServiceCredential:
     app_password: Optional[str] = None
     _atproto_session: Optional[ATProtoSession] = field(default=None, repr=False)
     _session_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
-
-    def inject_auth(self, headers: dict, url: str) -> tuple[dict, str]:
+    _renew_after: float = field(default=0.0, repr=False)    # time.monotonic() backoff after failures
+    _renew_failures: int = field(default=0, repr=False)
+    identity_config: IdentityConfig = field(default_factory=IdentityConfig)
+    routing_config: RoutingConfig = field(default_factory=RoutingConfig)
+    session_cache: Optional[SessionCache] = field(default=None, repr=False)  # Shared with other processes
+    handle_cache: Optional[HandleCache] = field(default=None, repr=False)  # Shared by a service's accounts
+    resolver: Optional[DidResolver] = field(default=None, init=False, repr=False)
+    router: Optional[XrpcRouter] = field(default=None, init=False, repr=False)
+
+    # Upstream connection pooling (shared by proxied calls and auth flows)
+    pool_config: PoolConfig = field(default_factory=PoolConfig)
+    cache_policy: CachePolicy = field(default_factory=CachePolicy)
+    coalesce: bool = True  # Share one upstream call between identical in-flight GETs
+    rate_limit_config: RateLimitConfig = field(default_factory=RateLimitConfig)
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    breaker_config: BreakerConfig = field(default_factory=BreakerConfig)
+    hedge_config: HedgeConfig = field(default_factory=HedgeConfig)
+    pool: Union[ServicePool, HTTP2ServicePool] = field(init=False, repr=False)
+    rate_governor: RateGovernor = field(init=False, repr=False)
+    breaker: CircuitBreaker = field(init=False, repr=False)
+    hedger: Hedger = field(init=False, repr=False)
+    _async_pool: Optional[AsyncServicePool] = field(default=None, repr=False)
+
+    # Short fingerprint of the secret, used to key per-credential state
+    credential_id: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.pool = create_pool(self.pool_config)
+        self.rate_governor = RateGovernor(self.rate_limit_config)
+        self.breaker = CircuitBreaker(self.breaker_config)
+        self.hedger = Hedger(self.hedge_config)
+        if self.service_type == "atproto":
+            self.resolver = create_resolver(self.identity_config)
+            self.router = XrpcRouter(self.routing_config)
+        secret = self.credential or self.identifier or ""
+        self.credential_id = hashlib.sha256(
+            f"{self.service_type}:{secret}".encode()
+        ).hexdigest()[:16]
+
+    @property
+    def async_pool(self) -> AsyncServicePool:
+        """Connection pool for the asyncio engine (created on first use)."""
+        if self._async_pool is None:
+            self._async_pool = AsyncServicePool(self.pool_config)
+        return self._async_pool
+
+    def stats(self) -> dict:
+        """Get runtime statistics for this service."""
+        stats = {
+            'type': self.service_type,
+            'pool': self.pool.stats(),
+            'rate_limit': self.rate_governor.stats(),
+            'circuit': self.breaker.stats(),
+        }
+        if self.hedge_config.enabled:
+            stats['hedging'] = self.hedger.stats()
+        if self._async_pool is not None:
+            stats['async_pool'] = self._async_pool.stats()
+        if self.resolver is not None:
+            stats['identity'] = {'pds': self.pds_url(), **self.resolver.stats()}
+            if self.handle_cache is not None:
+                stats['identity']['handles'] = self.handle_cache.stats()
+        if self.router is not None:
+            stats['routing'] = self.router.stats()
+        return stats
+
+    def close(self) -> None:
+        """Release upstream connections held for this service."""
+        self.pool.close()
+
+    async def aclose(self) -> None:
+        """Release connections held by the asyncio engine's pool."""
+        if self._async_pool is not None:
+            await self._async_pool.aclose()
+            self._async_pool = None
+
+    def inject_auth(self, headers: dict, url: str, body: Optional[bytes] = None) -> tuple[dict, str]:
         """
         Inject authentication into request headers and/or URL.
 
         Args:
             headers: Request headers dict (will be modified)
             url: Request URL
+            body: Buffered request body, if any (names the repo of ATProto procedures)
 
         Returns:
             Tuple of (modified headers, modified URL)
@@ -79,6 +241,7 @@ class ServiceCredential:
             token = self._get_atproto_token()
             if token:
                 headers["Authorization"] = f"Bearer {token}"
+                url = self._route_to_pds(url, body)
             else:
                 logger.error("Failed to get ATProto session token")
 
@@ -99,27 +262,204 @@ class ServiceCredential:
 
         return headers, url
 
+    def pds_url(self) -> Optional[str]:
+        """
+        Get the XRPC base URL of the logged-in account's PDS.
+
+        Returns:
+            e.g. "https://morel.us-east.host.bsky.network/xrpc", or None if
+            there is no session or the DID cannot be resolved
+        """
+        session = self._atproto_session
+        if session is None or self.resolver is None or not self.identity_config.resolve_pds:
+            return None
+        endpoint = pds_endpoint(self.resolver.resolve(session.did))
+        return f"{endpoint}/xrpc" if endpoint else None
+
+    def _xrpc_call(self, url: str) -> Optional[str]:
+        """Get the "nsid?query" part of a URL under base_url, or None."""
+        base_url = self.base_url.rstrip("/")
+        if not url.startswith(f"{base_url}/"):
+            return None
+        return url[len(base_url) + 1:]
+
+    def public_read_url(self, method: str, url: str) -> Optional[str]:
+        """
+        Get the AppView URL for a read that needs no credentials.
+
+        Args:
+            method: HTTP method
+            url: Upstream URL under base_url
+
+        Returns:
+            URL on the configured AppView, or None if the call must be sent
+            authenticated (via inject_auth)
+        """
+        if self.router is None:
+            return None
+        call = self._xrpc_call(url)
+        if call is None or not self.router.is_public_read(method, call.split("?", 1)[0]):
+            return None
+        self.router.record(APPVIEW)
+        return f"{self.router.config.appview_url}/{call}"
+
+    def _route_to_pds(self, url: str, body: Optional[bytes] = None) -> str:
+        """
+        Point XRPC calls on the account's own repo at its PDS instead of base_url.
+
+        Calls naming another account's repo stay on base_url: the session's
+        PDS doesn't host it, and the access token must not be sent to
+        whichever PDS does.
+        """
+        call = self._xrpc_call(url)
+        pds = self.pds_url() if call is not None and self._is_own_repo_call(call, body) else None
+        if not pds or pds == self.base_url.rstrip("/"):
+            self.router.record(ENTRYWAY)
+            return url
+        self.router.record(PDS)
+        return f"{pds}/{call}"
+
+    def _is_own_repo_call(self, call: str, body: Optional[bytes]) -> bool:
+        """Check whether an "nsid?query" call is a PDS call on the session's own repo."""
+        nsid, _, query_string = call.partition("?")
+        if not self.router.is_pds_method(nsid):
+            return False
+        repo = call_repo(query_string, body)
+        if repo is None:
+            return self.router.is_session_scoped(nsid)
+        session = self._atproto_session
+        if session is None:
+            return False
+        return repo == session.did or normalize_handle(repo) == (session.handle or "").lower()
+
     def _get_atproto_token(self) -> Optional[str]:
-        """Get a valid ATProto access token, creating/refreshing session as needed."""
+        """
+        Get a valid ATProto access token.
+
+        The TokenRefresher renews sessions well before expiry, so this
+        normally just reads the published session snapshot without locking.
+        Sessions are only created/refreshed inline when there is no usable
+        token (first use, or background renewal failing).
+        """
+        session = self._atproto_session
+        if session is not None and session.expires_at > time.time() + TOKEN_MIN_VALIDITY:
+            return session.access_jwt
+
+        # Slow path, single-flight: whoever takes the lock first renews, and
+        # requests queued behind it pick up the session it published
         with self._session_lock:
-            now = datetime.utcnow()
+            if self._renew(TOKEN_MIN_VALIDITY):
+                return self._atproto_session.access_jwt
+            return None
 
-            # Check if we have a valid cached session
-            if self._atproto_session:
-                # Refresh if token expires in less than 5 minutes
-                if self._atproto_session.expires_at > now + timedelta(minutes=5):
-                    return self._atproto_session.access_jwt
+    def reauthenticate(self, rejected_token: str) -> Optional[str]:
+        """
+        Replace an access token the upstream rejected.
 
-                # Try to refresh
-                if self._refresh_atproto_session():
-                    return self._atproto_session.access_jwt
+        Single-flight: if another request already replaced the rejected
+        token, its session is reused rather than refreshing again.
 
-            # Create new session
-            if self._create_atproto_session():
-                return self._atproto_session.access_jwt
+        Args:
+            rejected_token: Access token the upstream answered ExpiredToken to
 
+        Returns:
+            A different valid access token, or None if renewal failed
+        """
+        with self._session_lock:
+            if self._renew(TOKEN_MIN_VALIDITY, rejected_token):
+                return self._atproto_session.access_jwt
             return None
 
+    def _renew(self, min_validity: float, rejected_token: Optional[str] = None) -> bool:
+        """
+        Make sure the published session is valid for min_validity seconds.
+
+        Adopts a newer session persisted by another process if there is one,
+        otherwise refreshes (or creates) and persists the result. Caller
+        holds _session_lock; the session cache lock is held throughout so
+        only one process renews at a time. A session holding rejected_token
+        is treated as unusable regardless of its expiry.
+
+        Returns:
+            True if a usable session is published
+        """
+        shared = self.session_cache.locked() if self.session_cache else contextlib.nullcontext()
+        with shared:
+            self._adopt_persisted_session()
+            session = self._atproto_session
+            if (
+                session is not None
+                and session.access_jwt != rejected_token
+                and session.expires_at > time.time() + min_validity
+            ):
+                return True
+
+            renewed = (
+                (session is not None and self._refresh_atproto_session())
+                or self._create_atproto_session()
+            )
+            # Persist a new session, or forget one the upstream rejected; a
+            # transient failure leaves the stored refresh token for next time
+            if self.session_cache and (renewed or self._atproto_session is None):
+                self.session_cache.save(
+                    self.credential_id,
+                    asdict(self._atproto_session) if self._atproto_session else None
+                )
+            return renewed
+
+    def _adopt_persisted_session(self) -> None:
+        """Publish the persisted session if it is newer than ours (caller holds both locks)."""
+        if not self.session_cache:
+            return
+        stored = self.session_cache.load(self.credential_id)
+        if not stored:
+            return
+        try:
+            session = ATProtoSession(**stored)
+        except TypeError:
+            return
+        current = self._atproto_session
+        if current is None or session.expires_at > current.expires_at:
+            self._atproto_session = session
+            logger.info(f"Loaded persisted ATProto session for {session.handle}")
+
+    def needs_renewal(self) -> bool:
+        """Check whether the background refresher should renew this session now."""
+        if self.service_type != "atproto" or time.monotonic() < self._renew_after:
+            return False
+        session = self._atproto_session
+        return session is None or session.expires_at <= time.time() + REFRESH_AHEAD
+
+    def renew_atproto_session(self) -> bool:
+        """
+        Refresh the ATProto session, or create a new one if that fails.
+
+        Called by the TokenRefresher off the request path. Failures back off
+        exponentially (1 minute up to 30) so bad credentials don't hammer
+        createSession's rate limit.
+
+        Returns:
+            True if a fresh session is cached
+        """
+        with self._session_lock:
+            renewed = self._renew(REFRESH_AHEAD)
+            if renewed:
+                self._renew_failures = 0
+                self._renew_after = 0.0
+            else:
+                self._renew_failures += 1
+                self._renew_after = time.monotonic() + min(60 * 2 ** (self._renew_failures - 1), 1800)
+            return renewed
+
+    def _publish_session(self, data: dict) -> None:
+        """Cache a createSession/refreshSession response (caller holds the lock)."""
+        session = ATProtoSession.from_response(data)
+        if self.resolver is not None:
+            self.resolver.seed(session.did, data.get("didDoc"))
+        if self.handle_cache is not None:
+            self.handle_cache.remember(session.handle, session.did)
+        self._atproto_session = session
+
     def _create_atproto_session(self) -> bool:
         """Create a new ATProto session using identifier and app password."""
         if not self.identifier or not self.app_password:
@@ -127,7 +467,7 @@ class ServiceCredential:
             return False
 
         try:
-            response = requests.post(
+            response = self.pool.post(
                 f"{self.base_url}/com.atproto.server.createSession",
                 json={
                     "identifier": self.identifier,
@@ -138,14 +478,7 @@ class ServiceCredential:
             response.raise_for_status()
             data = response.json()
 
-            # ATProto access tokens typically expire in 2 hours
-            self._atproto_session = ATProtoSession(
-                access_jwt=data["accessJwt"],
-                refresh_jwt=data["refreshJwt"],
-                did=data["did"],
-                handle=data["handle"],
-                expires_at=datetime.utcnow() + timedelta(hours=2)
-            )
+            self._publish_session(data)
 
             logger.info(f"Created ATProto session for {data['handle']}")
             return True
@@ -160,7 +493,7 @@ class ServiceCredential:
             return False
 
         try:
-            response = requests.post(
+            response = self.pool.post(
                 f"{self.base_url}/com.atproto.server.refreshSession",
                 headers={"Authorization": f"Bearer {self._atproto_session.refresh_jwt}"},
                 timeout=10
@@ -168,23 +501,61 @@ class ServiceCredential:
             response.raise_for_status()
             data = response.json()
 
-            self._atproto_session = ATProtoSession(
-                access_jwt=data["accessJwt"],
-                refresh_jwt=data["refreshJwt"],
-                did=data["did"],
-                handle=data["handle"],
-                expires_at=datetime.utcnow() + timedelta(hours=2)
-            )
+            self._publish_session(data)
 
             logger.info(f"Refreshed ATProto session for {data['handle']}")
             return True
 
         except requests.exceptions.RequestException as e:
             logger.warning(f"Failed to refresh ATProto session: {e}")
-            self._atproto_session = None
+            # Only a rejected refresh token ends the session; network errors
+            # and 5xx keep it so the refresh can be retried
+            response = getattr(e, "response", None)
+            if response is not None and is_token_error(response.status_code, response.content):
+                self._atproto_session = None
             return False
 
 
+class TokenRefresher:
+    """
+    Background thread that renews ATProto sessions before they expire.
+
+    Sessions are renewed once they are within REFRESH_AHEAD of the access
+    token's exp claim, so proxied requests never wait on refreshSession.
+    """
+
+    def __init__(self, store: 'CredentialStore', interval: float = 30.0):
+        self._store = store
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="token-refresher")
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        # First pass runs immediately so sessions exist before the first request
+        while True:
+            self.run_once()
+            if self._stop.wait(self._interval):
+                return
+
+    def run_once(self) -> None:
+        """Renew every session that is due."""
+        for name, cred in self._store.items():
+            if cred.needs_renewal():
+                if cred.renew_atproto_session():
+                    logger.debug(f"Renewed ATProto session for {name} in background")
+                else:
+                    logger.warning(f"Background renewal failed for {name}; will retry")
+
+
 class CredentialStore:
     """
     Load and manage service credentials from a JSON configuration file.
@@ -196,10 +567,37 @@ class CredentialStore:
             "app_password": "xxxx-xxxx-xxxx-xxxx"
         },
         "github_api": {
-            "token": "ghp_..."
+            "token": "ghp_...",
+            "pool": {"max_connections_per_host": 20, "max_idle_seconds": 60}
         }
     }
 
+    Any service may include a "pool" block (pool_size, max_connections_per_host,
+    max_idle_seconds, block, http2) to tune its upstream connection pool, and a
+    "cache" block (enabled, revalidate, default_ttl, max_entry_bytes, rules)
+    to control response caching; see pool.py and cache.py. "coalesce": false
+    disables request coalescing for the service. A "rate_limit" block
+    (enabled, reserve, pace_below, max_wait) tunes how requests are paced
+    against the upstream's advertised rate limit; see ratelimit.py. A "retry"
+    block (max_attempts, backoff_base, backoff_max, deadline, methods,
+    statuses) controls retries of idempotent requests; see retry.py. A
+    "circuit_breaker" block tunes when the service fails fast; see breaker.py.
+    A "hedge" block opts idempotent reads into hedged requests; see hedge.py.
+    ATProto services accept an "identity" block (resolve_pds, ttl, plc_url,
+    did_docs) controlling direct routing to the account's PDS, and
+    (cache_handles, handle_ttl, max_handles) the handle -> DID cache; see
+    identity.py.
+    A "routing" block (public_reads, appview_url, public_methods,
+    refusal_ttl) opts public reads into going straight to the AppView; see
+    routing.py.
+    ATProto sessions are persisted (encrypted) across restarts and shared
+    between processes; see session_cache.py. An ATProto service may list
+    several "accounts" (each with identifier and app_password) and an
+    "account_selection" strategy to spread load across them; see accounts.py.
+    A "jetstream" block (enabled, url, wanted_collections, queue_size,
+    max_subscribers, idle_timeout) configures the shared Jetstream
+    subscription behind /proxy/<service>/_subscribe; see firehose.py.
+
     Known services (bsky, github_api) have hardcoded base URLs and auth types.
     Custom services can specify full configuration.
     """
@@ -212,11 +610,15 @@ class CredentialStore:
             config_path: Path to credentials.json. Defaults to same directory as this file.
         """
         self._credentials: dict[str, ServiceCredential] = {}
+        self._pools: dict[str, AccountPool] = {}  # Multi-account services (primary also in _credentials)
+        self._firehoses: dict[str, Firehose] = {}
+        self._refresher: Optional[TokenRefresher] = None
 
         if config_path is None:
             config_path = os.path.join(os.path.dirname(__file__), "credentials.json")
 
         self._config_path = config_path
+        self._session_cache = create_session_cache(os.path.dirname(os.path.abspath(config_path)))
         self._load()
 
     def _load(self) -> None:
@@ -260,7 +662,7 @@ class CredentialStore:
 
         # Infer type from config keys if not specified
         if not service_type:
-            if "identifier" in config or "app_password" in config:
+            if "identifier" in config or "app_password" in config or "accounts" in config:
                 service_type = "atproto"
             elif "token" in config or "credential" in config:
                 service_type = "bearer"
@@ -268,20 +670,66 @@ class CredentialStore:
                 logger.error(f"Service {name}: cannot infer service type")
                 return None
 
+        # Settings shared by every service type
+        common = {
+            "pool_config": PoolConfig.from_config(config.get("pool")),
+            "cache_policy": CachePolicy.from_config({
+                **known.get("cache", {}),
+                **(config.get("cache") or {})
+            }),
+            "coalesce": bool(config.get("coalesce", True)),
+            "rate_limit_config": RateLimitConfig.from_config(config.get("rate_limit")),
+            "retry_policy": RetryPolicy.from_config(config.get("retry")),
+            "breaker_config": BreakerConfig.from_config(config.get("circuit_breaker")),
+            "hedge_config": HedgeConfig.from_config(config.get("hedge")),
+        }
+
         # Build ServiceCredential based on type
         if service_type == "atproto":
-            return ServiceCredential(
-                service_type="atproto",
-                base_url=base_url,
-                identifier=config.get("identifier"),
-                app_password=config.get("app_password")
-            )
+            identity_config = IdentityConfig.from_config(config.get("identity"))
+            routing_config = RoutingConfig.from_config({
+                **known.get("routing", {}),
+                **(config.get("routing") or {})
+            })
+            jetstream_config = JetstreamConfig.from_config({
+                **known.get("jetstream", {}),
+                **(config.get("jetstream") or {})
+            })
+            if jetstream_config.enabled:
+                self._firehoses[name] = Firehose(jetstream_config, name)
+            handle_cache = None
+            if identity_config.cache_handles:
+                handle_cache = HandleCache(identity_config.handle_ttl, identity_config.max_handles)
+
+            def account(identifier: Optional[str], app_password: Optional[str]) -> ServiceCredential:
+                return ServiceCredential(
+                    service_type="atproto",
+                    base_url=base_url,
+                    identifier=identifier,
+                    app_password=app_password,
+                    identity_config=identity_config,
+                    routing_config=routing_config,
+                    session_cache=self._session_cache,
+                    handle_cache=handle_cache,
+                    **common
+                )
+
+            if "accounts" not in config:
+                return account(config.get("identifier"), config.get("app_password"))
+
+            # Multi-account pool; the first account stands in for the service
+            accounts = [account(a.get("identifier"), a.get("app_password")) for a in config["accounts"]]
+            pool = AccountPool(accounts, config.get("account_selection", STICKY))
+            self._pools[name] = pool
+            logger.info(f"Service {name}: {len(accounts)} account(s), {pool.strategy} selection")
+            return pool.primary
 
         elif service_type == "bearer":
             return ServiceCredential(
                 service_type="bearer",
                 base_url=base_url,
-                credential=config.get("token") or config.get("credential")
+                credential=config.get("token") or config.get("credential"),
+                **common
             )
 
         elif service_type == "header":
@@ -289,7 +737,8 @@ class CredentialStore:
                 service_type="header",
                 base_url=base_url,
                 credential=config.get("credential"),
-                auth_header=config.get("auth_header")
+                auth_header=config.get("auth_header"),
+                **common
             )
 
         elif service_type == "query":
@@ -297,25 +746,69 @@ class CredentialStore:
                 service_type="query",
                 base_url=base_url,
                 credential=config.get("credential"),
-                query_param=config.get("query_param")
+                query_param=config.get("query_param"),
+                **common
             )
 
         else:
             logger.error(f"Service {name}: unknown service type '{service_type}'")
             return None
 
-    def get(self, service: str) -> Optional[ServiceCredential]:
+    def get(self, service: str, session_id: Optional[str] = None) -> Optional[ServiceCredential]:
         """
         Get credential configuration for a service.
 
+        For multi-account services this selects the account that serves the
+        request, so call it once per proxied request.
+
         Args:
             service: Service name
+            session_id: Proxy session making the request (for account pinning)
 
         Returns:
             ServiceCredential if found, None otherwise
         """
+        pool = self._pools.get(service)
+        if pool is not None:
+            return pool.select(session_id)
         return self._credentials.get(service)
 
+    def primary(self, service: str) -> Optional[ServiceCredential]:
+        """
+        Get a service's credential without selecting an account.
+
+        Returns:
+            ServiceCredential (the first account of a multi-account service),
+            or None if the service is not configured
+        """
+        return self._credentials.get(service)
+
+    def firehose(self, service: str) -> Optional[Firehose]:
+        """
+        Get a service's shared Jetstream subscription.
+
+        Returns:
+            Firehose, or None if the service has no Jetstream fan-out
+        """
+        return self._firehoses.get(service)
+
+    def pin_account(self, service: str, session_id: str, identifier: str) -> None:
+        """
+        Pin a session to one account of a multi-account service.
+
+        Raises:
+            UnknownAccount if the service has no such account (or no pool)
+        """
+        pool = self._pools.get(service)
+        if pool is None:
+            raise UnknownAccount(f"{service} has no account pool")
+        pool.pin(session_id, identifier)
+
+    def unpin_session(self, session_id: str) -> None:
+        """Forget a session's account pins."""
+        for pool in self._pools.values():
+            pool.unpin(session_id)
+
     def list_services(self) -> list[str]:
         """
         List all configured service names.
@@ -337,7 +830,70 @@ class CredentialStore:
         """
         return service in self._credentials
 
+    def items(self) -> list[tuple[str, ServiceCredential]]:
+        """
+        Get a snapshot of (name, credential) pairs for every credential.
+
+        Accounts of a multi-account service are listed individually as
+        "service[identifier]".
+        """
+        items = []
+        for name, cred in self._credentials.items():
+            pool = self._pools.get(name)
+            if pool is None:
+                items.append((name, cred))
+            else:
+                items.extend((f"{name}[{account.identifier}]", account) for account in pool.accounts)
+        return items
+
+    def start_token_refresher(self) -> TokenRefresher:
+        """
+        Start renewing ATProto sessions in the background.
+
+        Returns:
+            The running TokenRefresher
+        """
+        if self._refresher is None:
+            self._refresher = TokenRefresher(self)
+        self._refresher.start()
+        return self._refresher
+
+    def stats(self) -> dict:
+        """
+        Get runtime statistics for all configured services.
+
+        Returns:
+            Dict mapping service name to its stats
+        """
+        stats = {
+            name: {'type': cred.service_type, **self._pools[name].stats()} if name in self._pools else cred.stats()
+            for name, cred in sorted(self._credentials.items())
+        }
+        for name, hub in self._firehoses.items():
+            if name in stats:
+                stats[name]['jetstream'] = hub.stats()
+        return stats
+
+    def circuit_states(self) -> dict:
+        """
+        Get the circuit breaker state of every configured service.
+
+        Returns:
+            Dict mapping service name (service[identifier] for pooled
+            accounts) to "closed", "open" or "half_open"
+        """
+        return {
+            name: cred.breaker.state
+            for name, cred in sorted(self.items())
+        }
+
     def reload(self) -> None:
         """Reload credentials from config file."""
+        for _, cred in self.items():
+            cred.close()
+        for hub in self._firehoses.values():
+            hub.stop()
         self._credentials.clear()
+        self._pools.clear()
+        self._firehoses.clear()
         self._load()
@@ -0,0 +1,134 @@
+"""
+Content-Encoding Helpers for Credential Proxy
+
+Lets the proxy forward compressed upstream bodies untouched (with their
+original Content-Encoding and Content-Length) when the client accepts the
+encoding, and decode them only for clients that do not.
+"""
+
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Brotli bodies are passed through but cannot be decoded
+
+
+def parse_accept_encoding(value: Optional[str]) -> dict[str, float]:
+    """
+    Parse an Accept-Encoding header into {coding: q-value}.
+
+    Args:
+        value: Header value (may be None)
+
+    Returns:
+        Dict of lowercase codings to their quality
+    """
+    codings = {}
+    for part in (value or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, arg = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(arg)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def accepts_encoding(accept_encoding: Optional[str], content_encoding: str) -> bool:
+    """
+    Check whether a client accepts a response's Content-Encoding.
+
+    Stacked encodings ("gzip, br") are accepted only if every coding is.
+
+    Args:
+        accept_encoding: Client's Accept-Encoding header (may be None)
+        content_encoding: Upstream Content-Encoding header
+
+    Returns:
+        True if the body can be forwarded without decoding
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    for coding in content_encoding.lower().split(','):
+        coding = coding.strip()
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q <= 0:
+            return False
+    return True
+
+
+def response_encoding(headers) -> Optional[str]:
+    """
+    Get a response's Content-Encoding, ignoring identity.
+
+    Args:
+        headers: Response headers (dict or case-insensitive mapping)
+
+    Returns:
+        Lowercase encoding, or None for uncompressed bodies
+    """
+    value = next((v for k, v in headers.items() if k.lower() == 'content-encoding'), None)
+    if not value or value.strip().lower() == 'identity':
+        return None
+    return value.strip().lower()
+
+
+def decode_body(body: bytes, content_encoding: str) -> Optional[bytes]:
+    """
+    Decode a complete body.
+
+    Args:
+        body: Encoded bytes
+        content_encoding: Single coding (gzip, deflate or br)
+
+    Returns:
+        Decoded bytes, or None if the encoding is not supported
+    """
+    try:
+        if content_encoding in ('gzip', 'x-gzip'):
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if content_encoding == 'deflate':
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)  # Raw deflate
+        if content_encoding == 'br' and brotli is not None:
+            return brotli.decompress(body)
+    except Exception:
+        return None
+    return None
+
+
+def adapt_body_for_client(headers: dict, body: bytes, accept_encoding: Optional[str]) -> tuple[dict, bytes]:
+    """
+    Prepare a stored body for a client, decoding it if the client cannot.
+
+    Args:
+        headers: Stored response headers (may include Content-Encoding)
+        body: Stored body
+        accept_encoding: Client's Accept-Encoding header
+
+    Returns:
+        Tuple of (headers, body) to send
+    """
+    encoding = response_encoding(headers)
+    if encoding is None or accepts_encoding(accept_encoding, encoding):
+        return headers, body
+
+    decoded = decode_body(body, encoding)
+    if decoded is None:
+        return headers, body
+
+    headers = {
+        k: v for k, v in headers.items()
+        if k.lower() not in ('content-encoding', 'content-length')
+    }
+    return headers, decoded
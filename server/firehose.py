@@ -0,0 +1,620 @@
+"""
+Jetstream Fan-out for Credential Proxy
+
+Keeps one upstream subscription to a Bluesky Jetstream WebSocket per
+service and fans its events out to any number of proxy sessions, so agents
+watching Bluesky activity don't have to poll searchPosts:
+
+    GET /proxy/bsky/_subscribe?collections=app.bsky.feed.post&keywords=python,rust
+        (Server-Sent Events, both engines)
+    WS  /proxy/bsky/_subscribe?dids=did:plc:abc,did:plc:def
+        (WebSocket, asyncio engine only)
+
+Filters are compiled once per subscriber and evaluated server-side against
+each event:
+    collections   fnmatch patterns on the commit's collection (app.bsky.feed.*)
+    dids          repo DIDs whose events to deliver
+    keywords      words that must appear in the record's text (any of them,
+                  case-insensitive)
+Each filter that is given must match; an event without a collection or text
+doesn't match a collections or keywords filter.
+
+The upstream connection opens with the first subscriber and closes
+idle_timeout seconds after the last one leaves. After a dropped connection it
+reconnects with backoff and resumes from the last event's cursor. A
+subscriber that falls more than queue_size events behind loses the oldest
+ones (counted as dropped) rather than slowing everyone else down.
+
+Point "url" at a local emitter (ws://127.0.0.1:PORT/subscribe) to test
+against a stub stream.
+"""
+
+import asyncio
+import fnmatch
+import json
+import logging
+import re
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator, NamedTuple, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (
+    AcceptConnection,
+    CloseConnection,
+    Message,
+    Ping,
+    RejectConnection,
+    Request,
+)
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBE_PATH = '_subscribe'
+DEFAULT_JETSTREAM_URL = "wss://jetstream2.us-east.bsky.network/subscribe"
+
+MAX_FILTER_DIDS = 10000
+MAX_FILTER_COLLECTIONS = 100
+MAX_FILTER_KEYWORDS = 100
+
+CONNECT_TIMEOUT = 10.0
+POLL_INTERVAL = 1.0     # Seconds between checks for shutdown while reading
+STALL_TIMEOUT = 60.0    # Reconnect when the upstream sends nothing for this long
+RECV_BYTES = 65536
+
+# SSE comment sent when a subscriber has had no events for KEEPALIVE_INTERVAL seconds
+SSE_KEEPALIVE = b": keepalive\n\n"
+KEEPALIVE_INTERVAL = 15.0
+
+
+class FilterError(ValueError):
+    """Raised for an invalid subscription filter."""
+
+
+class FirehoseFull(RuntimeError):
+    """Raised when a hub already has its maximum number of subscribers."""
+
+
+@dataclass
+class JetstreamConfig:
+    """Jetstream fan-out settings for a single ATProto service."""
+    enabled: bool = False
+    url: str = DEFAULT_JETSTREAM_URL
+    wanted_collections: list[str] = field(default_factory=list)  # Filtered upstream by Jetstream
+    queue_size: int = 1000       # Events buffered per subscriber
+    max_subscribers: int = 100
+    idle_timeout: float = 60.0   # Seconds to keep the upstream open with no subscribers
+    backoff_max: float = 60.0    # Longest wait between reconnect attempts
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'JetstreamConfig':
+        """
+        Build fan-out settings from a service's "jetstream" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            JetstreamConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            enabled=bool(config.get("enabled", defaults.enabled)),
+            url=str(config.get("url", defaults.url)),
+            wanted_collections=list(config.get("wanted_collections", defaults.wanted_collections)),
+            queue_size=int(config.get("queue_size", defaults.queue_size)),
+            max_subscribers=int(config.get("max_subscribers", defaults.max_subscribers)),
+            idle_timeout=float(config.get("idle_timeout", defaults.idle_timeout)),
+            backoff_max=float(config.get("backoff_max", defaults.backoff_max)),
+        )
+
+
+class FirehoseEvent(NamedTuple):
+    """One upstream event, serialized once for every subscriber."""
+    kind: str
+    time_us: int
+    data: str  # JSON text as received from Jetstream
+
+
+def _split_list(values: list) -> list[str]:
+    """Flatten comma-separated and repeated values, dropping blanks."""
+    items = []
+    for value in values:
+        if not isinstance(value, str):
+            raise FilterError("filter values must be strings")
+        items.extend(v.strip() for v in value.split(",") if v.strip())
+    return list(dict.fromkeys(items))
+
+
+class EventFilter:
+    """
+    A subscriber's compiled filter.
+    """
+
+    def __init__(
+        self,
+        collections: Optional[list[str]] = None,
+        dids: Optional[list[str]] = None,
+        keywords: Optional[list[str]] = None
+    ):
+        collections = collections or []
+        dids = dids or []
+        keywords = keywords or []
+        if len(collections) > MAX_FILTER_COLLECTIONS:
+            raise FilterError(f"at most {MAX_FILTER_COLLECTIONS} collections")
+        if len(dids) > MAX_FILTER_DIDS:
+            raise FilterError(f"at most {MAX_FILTER_DIDS} dids")
+        if len(keywords) > MAX_FILTER_KEYWORDS:
+            raise FilterError(f"at most {MAX_FILTER_KEYWORDS} keywords")
+        if any(not did.startswith("did:") for did in dids):
+            raise FilterError("dids must start with did:")
+
+        self.collections = collections
+        self.dids = set(dids)
+        self.keywords = keywords
+        self._collection_re = (
+            re.compile("|".join(fnmatch.translate(c) for c in collections)) if collections else None
+        )
+        self._keyword_re = (
+            re.compile(r"(?<!\w)(?:" + "|".join(re.escape(k) for k in keywords) + r")(?!\w)", re.IGNORECASE)
+            if keywords else None
+        )
+
+    @classmethod
+    def from_params(cls, params: dict) -> 'EventFilter':
+        """
+        Compile a filter from query parameters or a JSON object.
+
+        Args:
+            params: Mapping of "collections", "dids" and "keywords" to a
+                list of values or a comma-separated string
+
+        Returns:
+            EventFilter
+
+        Raises:
+            FilterError if a value is invalid
+        """
+        def values(key: str) -> list[str]:
+            value = params.get(key) or []
+            return _split_list(value if isinstance(value, list) else [value])
+
+        return cls(values("collections"), values("dids"), values("keywords"))
+
+    @classmethod
+    def from_query(cls, query_string: str) -> 'EventFilter':
+        """Compile a filter from a query string (repeated keys are merged)."""
+        params: dict[str, list[str]] = {}
+        for key, value in parse_qsl(query_string):
+            params.setdefault(key, []).append(value)
+        return cls.from_params(params)
+
+    def matches(self, did: Optional[str], collection: Optional[str], text: Optional[str]) -> bool:
+        """Check an event's repo DID, commit collection and record text."""
+        if self.dids and did not in self.dids:
+            return False
+        if self._collection_re is not None and (collection is None or not self._collection_re.match(collection)):
+            return False
+        if self._keyword_re is not None and (text is None or not self._keyword_re.search(text)):
+            return False
+        return True
+
+    def describe(self) -> dict:
+        """Get the filter as JSON-serializable settings (DIDs are counted, not listed)."""
+        return {'collections': self.collections, 'dids': len(self.dids), 'keywords': self.keywords}
+
+
+class Subscription:
+    """
+    One subscriber's bounded event queue, read from a worker thread.
+    """
+
+    def __init__(self, event_filter: EventFilter, queue_size: int):
+        self.filter = event_filter
+        self.queue_size = queue_size
+        self.delivered = 0
+        self.dropped = 0
+        self.closed = False
+        self._events: deque[FirehoseEvent] = deque()
+        self._cond = threading.Condition()
+
+    def offer(self, event: FirehoseEvent) -> None:
+        """Queue an event, dropping the oldest if the subscriber is behind."""
+        with self._cond:
+            if len(self._events) >= self.queue_size:
+                self._events.popleft()
+                self.dropped += 1
+            self._events.append(event)
+            self.delivered += 1
+            self._cond.notify()
+
+    def get(self, timeout: float) -> Optional[FirehoseEvent]:
+        """
+        Wait for the next event.
+
+        Returns:
+            The event, or None on timeout or once the subscription is closed
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._events or self.closed, timeout)
+            return self._events.popleft() if self._events else None
+
+    def close(self) -> None:
+        """Wake the reader and stop it waiting for more events."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscription read from an asyncio event loop.
+
+    Events are handed to the loop from the upstream reader thread, so the
+    subscriber doesn't tie up a thread while it waits.
+    """
+
+    def __init__(self, event_filter: EventFilter, queue_size: int, loop: asyncio.AbstractEventLoop):
+        super().__init__(event_filter, queue_size)
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def offer(self, event: FirehoseEvent) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            self.closed = True  # Event loop is gone
+
+    def _put(self, event: Optional[FirehoseEvent]) -> None:
+        if event is not None and self._queue.qsize() >= self.queue_size:
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+        if event is not None:
+            self.delivered += 1
+
+    async def aget(self, timeout: float) -> Optional[FirehoseEvent]:
+        """Async version of get()."""
+        if self.closed and self._queue.empty():
+            return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self._loop.call_soon_threadsafe(self._put, None)  # Wake aget()
+        except RuntimeError:
+            pass
+
+
+def event_fields(data: dict) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Get the fields filters look at from a decoded Jetstream event.
+
+    Returns:
+        Tuple of (repo DID, commit collection, record text); missing ones are None
+    """
+    commit = data.get("commit") if isinstance(data.get("commit"), dict) else {}
+    record = commit.get("record") if isinstance(commit.get("record"), dict) else {}
+    text = record.get("text")
+    return data.get("did"), commit.get("collection"), text if isinstance(text, str) else None
+
+
+class JetstreamConnection:
+    """
+    Minimal blocking WebSocket client for reading a Jetstream stream.
+    """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ("ws", "wss"):
+            raise ValueError(f"Jetstream URL must be ws:// or wss://, got {url}")
+        self._ws = WSConnection(ConnectionType.CLIENT)
+        port = parts.port or (443 if parts.scheme == "wss" else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=CONNECT_TIMEOUT)
+        if parts.scheme == "wss":
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+        self._sock = sock
+        self._text: list[str] = []
+        self._closed: Optional[str] = None  # Reason, once the upstream sent a close frame
+        self._pending: list = []  # Events read along with the handshake response
+
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+        self._send(Request(host=parts.netloc, target=target))
+        while True:
+            events = self._receive()
+            for i, event in enumerate(events):
+                if isinstance(event, AcceptConnection):
+                    self._sock.settimeout(POLL_INTERVAL)
+                    self._pending = events[i + 1:]
+                    return
+                if isinstance(event, RejectConnection):
+                    self.close()
+                    raise ConnectionError(f"Jetstream refused connection ({event.status_code})")
+
+    def _send(self, event) -> None:
+        self._sock.sendall(self._ws.send(event))
+
+    def _receive(self) -> list:
+        data = self._sock.recv(RECV_BYTES)
+        if not data:
+            raise ConnectionError("Jetstream closed the connection")
+        self._ws.receive_data(data)
+        return list(self._ws.events())
+
+    def messages(self) -> list[str]:
+        """
+        Read whatever the upstream has sent.
+
+        Returns:
+            Complete text messages (empty if nothing arrived within
+            POLL_INTERVAL)
+
+        Raises:
+            ConnectionError when the connection is closed
+        """
+        if self._closed is not None:
+            raise ConnectionError(self._closed)
+        if self._pending:
+            events, self._pending = self._pending, []
+        else:
+            try:
+                events = self._receive()
+            except socket.timeout:
+                return []
+        messages = []
+        for event in events:
+            if isinstance(event, Message):
+                data = event.data if isinstance(event.data, str) else event.data.decode("utf-8", "replace")
+                self._text.append(data)
+                if event.message_finished:
+                    messages.append("".join(self._text))
+                    self._text = []
+            elif isinstance(event, Ping):
+                self._send(event.response())
+            elif isinstance(event, CloseConnection):
+                # Hand over messages that arrived before the close first
+                self._send(event.response())
+                self._closed = f"Jetstream closed the connection ({event.code})"
+                break
+        if self._closed is not None and not messages:
+            raise ConnectionError(self._closed)
+        return messages
+
+    def close(self) -> None:
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class Firehose:
+    """
+    One upstream Jetstream subscription shared by many filtered subscribers.
+    """
+
+    def __init__(self, config: Optional[JetstreamConfig] = None, name: str = "jetstream"):
+        self.config = config or JetstreamConfig(enabled=True)
+        self.name = name
+        self._lock = threading.Lock()
+        self._subscribers: list[Subscription] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._idle_since: Optional[float] = None
+        self._cursor: Optional[int] = None  # time_us of the last event received
+
+        self._connected = False
+        self._events = 0
+        self._connects = 0
+        self._failures = 0
+
+    def subscribe(self, event_filter: EventFilter, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+        """
+        Add a subscriber, opening the upstream connection if needed.
+
+        Args:
+            event_filter: Compiled filter for the subscriber
+            loop: Event loop of an asyncio subscriber (None for a thread)
+
+        Returns:
+            Subscription to read events from; pass it to unsubscribe() when done
+
+        Raises:
+            FirehoseFull if max_subscribers are already connected
+        """
+        if loop is not None:
+            subscription = AsyncSubscription(event_filter, self.config.queue_size, loop)
+        else:
+            subscription = Subscription(event_filter, self.config.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.config.max_subscribers:
+                raise FirehoseFull(f"{self.name} has {self.config.max_subscribers} subscribers already")
+            self._subscribers.append(subscription)
+            self._idle_since = None
+            if self._thread is None:
+                self._stop.clear()
+                self._cursor = None
+                self._thread = threading.Thread(target=self._run, name=f"firehose-{self.name}", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscriber (the upstream closes after idle_timeout with none left)."""
+        subscription.close()
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+            if not self._subscribers:
+                self._idle_since = time.monotonic()
+
+    def stop(self) -> None:
+        """Close the upstream connection and end every subscription."""
+        self._stop.set()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription.close()
+
+    def _idle_expired(self) -> bool:
+        """Check whether the reader should exit, clearing _thread if so (caller holds the lock)."""
+        if self._stop.is_set() or (
+            self._idle_since is not None and time.monotonic() - self._idle_since >= self.config.idle_timeout
+        ):
+            self._thread = None
+            return True
+        return False
+
+    def _upstream_url(self) -> str:
+        params = [("wantedCollections", c) for c in self.config.wanted_collections]
+        if self._cursor is not None:
+            params.append(("cursor", str(self._cursor)))
+        if not params:
+            return self.config.url
+        separator = "&" if "?" in self.config.url else "?"
+        return f"{self.config.url}{separator}{urlencode(params)}"
+
+    def _run(self) -> None:
+        """Reader thread: connect, fan out events, reconnect with backoff."""
+        failures = 0
+        while True:
+            with self._lock:
+                if self._idle_expired():
+                    break
+            try:
+                connection = JetstreamConnection(self._upstream_url())
+            except (OSError, ValueError) as e:
+                failures += 1
+                with self._lock:
+                    self._failures += 1
+                delay = min(2 ** (failures - 1), self.config.backoff_max)
+                logger.warning(f"Jetstream connect failed for {self.name}: {e}; retrying in {delay:.0f}s")
+                self._stop.wait(delay)
+                continue
+
+            failures = 0
+            with self._lock:
+                self._connected = True
+                self._connects += 1
+            logger.info(f"Jetstream connected for {self.name}")
+            idle = False
+            try:
+                idle = self._read(connection)
+            except (OSError, ConnectionError) as e:
+                logger.warning(f"Jetstream connection lost for {self.name}: {e}")
+            finally:
+                connection.close()
+                with self._lock:
+                    self._connected = False
+            if idle:
+                break
+        logger.info(f"Jetstream disconnected for {self.name} (no subscribers)")
+
+    def _read(self, connection: JetstreamConnection) -> bool:
+        """
+        Fan out events until the connection fails or the hub goes idle.
+
+        Returns:
+            True once the hub is idle (or stopped) and the reader should exit
+        """
+        last_data = time.monotonic()
+        while True:
+            with self._lock:
+                if self._idle_expired():
+                    return True
+
+            messages = connection.messages()
+            now = time.monotonic()
+            if not messages:
+                if now - last_data > STALL_TIMEOUT:
+                    raise ConnectionError(f"no events for {STALL_TIMEOUT:.0f}s")
+                continue
+            last_data = now
+
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for text in messages:
+                self._dispatch(text, subscribers)
+
+    def _dispatch(self, text: str, subscribers: list[Subscription]) -> None:
+        """Deliver one event to every subscriber whose filter matches."""
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+        time_us = data.get("time_us") if isinstance(data.get("time_us"), int) else 0
+        event = FirehoseEvent(str(data.get("kind", "")), time_us, text)
+        did, collection, record_text = event_fields(data)
+        with self._lock:
+            self._events += 1
+            if time_us > (self._cursor or 0):
+                self._cursor = time_us
+        for subscription in subscribers:
+            if subscription.filter.matches(did, collection, record_text):
+                subscription.offer(event)
+
+    def stats(self) -> dict:
+        """
+        Get fan-out statistics.
+
+        Returns:
+            Dict with connection state, event counts and per-subscriber
+            filters and delivery/drop counts
+        """
+        with self._lock:
+            return {
+                'connected': self._connected,
+                'url': self.config.url,
+                'events': self._events,
+                'connects': self._connects,
+                'connect_failures': self._failures,
+                'cursor': self._cursor,
+                'subscribers': [
+                    {'filter': s.filter.describe(), 'delivered': s.delivered, 'dropped': s.dropped}
+                    for s in self._subscribers
+                ],
+            }
+
+
+def format_sse(event: FirehoseEvent) -> bytes:
+    """Encode an event as a Server-Sent Events message."""
+    return f"id: {event.time_us}\nevent: {event.kind}\ndata: {event.data}\n\n".encode()
+
+
+def sse_stream(hub: Firehose, subscription: Subscription) -> Iterator[bytes]:
+    """
+    Stream a subscription as Server-Sent Events, unsubscribing when the client goes away.
+
+    Keepalive comments let the server notice a disconnected client even
+    when no events match its filter.
+    """
+    try:
+        yield SSE_KEEPALIVE  # Send headers now rather than with the first event
+        while not subscription.closed:
+            event = subscription.get(KEEPALIVE_INTERVAL)
+            yield format_sse(event) if event is not None else SSE_KEEPALIVE
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def asse_stream(hub: Firehose, subscription: AsyncSubscription) -> AsyncIterator[bytes]:
+    """Async version of sse_stream()."""
+    try:
+        yield SSE_KEEPALIVE
+        while not subscription.closed:
+            event = await subscription.aget(KEEPALIVE_INTERVAL)
+            yield format_sse(event) if event is not None else SSE_KEEPALIVE
+    finally:
+        hub.unsubscribe(subscription)
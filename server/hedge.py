@@ -0,0 +1,267 @@
+"""
+Hedged Requests for Credential Proxy
+
+Opt-in tail-latency cutting for idempotent reads. If the upstream has not
+answered within a delay taken from a percentile of recent response times,
+an identical second request goes out on another pooled connection. The
+first response wins; the loser is cancelled (asyncio) or closed as soon as
+it completes (threads, since a blocking requests call cannot be interrupted).
+
+Hedges are budgeted: every eligible request earns max_rate of a token and
+each hedge spends one, so hedging can never add more than max_rate extra
+upstream load. A hedge is also only sent if the caller's admit() check
+(the service's rate governor) lets it go out immediately.
+
+In the threaded engine, first requests and hedges run on separate worker
+pools, and the hedge delay is timed from when the first request actually
+starts, so a busy pool never makes requests look slow or starves hedges.
+"""
+
+import asyncio
+import fnmatch
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+HEDGE_METHODS = {'GET', 'HEAD'}
+
+# Worker threads for the first request of every hedged call in the threaded engine
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PROXY_HEDGE_WORKERS', 64)),
+    thread_name_prefix='hedge-first'
+)
+# Worker threads for hedges, kept apart so they never queue behind first requests
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PROXY_HEDGE_WORKERS', 64)),
+    thread_name_prefix='hedge'
+)
+
+
+@dataclass
+class HedgeConfig:
+    """Hedging settings for a single service."""
+    enabled: bool = False
+    paths: list[str] = field(default_factory=list)  # fnmatch patterns; empty matches every path
+    percentile: float = 95.0     # Hedge once a request is slower than this percentile
+    initial_delay: float = 1.0   # Delay used until enough samples are collected
+    min_delay: float = 0.05      # Never hedge sooner than this
+    max_rate: float = 0.05       # Hedges allowed per eligible request
+    min_samples: int = 20        # Samples needed before using the percentile
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'HedgeConfig':
+        """
+        Build hedging settings from a service's "hedge" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            HedgeConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            enabled=bool(config.get("enabled", defaults.enabled)),
+            paths=list(config.get("paths", defaults.paths)),
+            percentile=float(config.get("percentile", defaults.percentile)),
+            initial_delay=float(config.get("initial_delay", defaults.initial_delay)),
+            min_delay=float(config.get("min_delay", defaults.min_delay)),
+            max_rate=float(config.get("max_rate", defaults.max_rate)),
+            min_samples=int(config.get("min_samples", defaults.min_samples)),
+        )
+
+
+class Hedger:
+    """
+    Hedging state for one service: recent response times and the hedge budget.
+    """
+
+    def __init__(self, config: Optional[HedgeConfig] = None, sample_size: int = 200):
+        self.config = config or HedgeConfig()
+        self._lock = threading.Lock()
+        self._samples: deque = deque(maxlen=sample_size)
+        self._tokens = 1.0
+
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+
+    def applies(self, method: str, path: str, body) -> bool:
+        """Check whether a request is eligible for hedging."""
+        if not self.config.enabled or method.upper() not in HEDGE_METHODS or body:
+            return False
+        if not self.config.paths:
+            return True
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.config.paths)
+
+    def delay(self) -> float:
+        """Get how long to wait for the first response before hedging."""
+        with self._lock:
+            if len(self._samples) < self.config.min_samples:
+                return self.config.initial_delay
+            ordered = sorted(self._samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self.config.percentile / 100))
+            return max(self.config.min_delay, ordered[index])
+
+    def _record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def _start(self) -> None:
+        """Count an eligible request and earn its share of the hedge budget."""
+        with self._lock:
+            self._requests += 1
+            self._tokens = min(10.0, self._tokens + self.config.max_rate)
+
+    def _take_token(self, admit: Callable[[], bool]) -> bool:
+        """Spend a hedge token if one is available and admit() allows the hedge."""
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+        if not admit():
+            with self._lock:
+                self._tokens += 1.0
+            return False
+        with self._lock:
+            self._hedged += 1
+        return True
+
+    def _timed(self, send: Callable):
+        """Wrap a send callable so its response time is sampled."""
+        def run():
+            started = time.monotonic()
+            result = send()
+            self._record(time.monotonic() - started)
+            return result
+        return run
+
+    def run(self, send: Callable, close: Callable, admit: Callable[[], bool] = lambda: True) -> object:
+        """
+        Call send(), hedging with a second call if the first is slow.
+
+        Args:
+            send: Blocking callable returning a response (or raising)
+            close: Called with the losing response to release it
+            admit: Called before hedging; False means don't send the hedge
+
+        Returns:
+            The first successful response
+        """
+        self._start()
+        send = self._timed(send)
+        running = threading.Event()
+
+        def run_first():
+            running.set()
+            return send()
+
+        first = _executor.submit(run_first)
+        running.wait()  # Time the first request from when it starts, not while queued
+        try:
+            return first.result(timeout=self.delay())
+        except FutureTimeout:
+            pass
+
+        if not self._take_token(admit):
+            return first.result()
+
+        logger.info("Upstream slow; sending hedged request")
+        second = _hedge_executor.submit(send)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                # Winner found: release whatever the other call returns
+                for loser in pending:
+                    loser.add_done_callback(
+                        lambda f: f.exception() is None and close(f.result())
+                    )
+                for other in done - {future}:
+                    if other.exception() is None:
+                        close(other.result())
+                if future is second:
+                    with self._lock:
+                        self._hedge_wins += 1
+                return future.result()
+        raise error
+
+    async def arun(
+        self,
+        send: Callable[[], Awaitable],
+        close: Callable[[object], Awaitable],
+        admit: Callable[[], bool] = lambda: True
+    ) -> object:
+        """
+        Async counterpart of run(); the losing request is cancelled.
+
+        Args:
+            send: Coroutine function returning a response (or raising)
+            close: Coroutine function releasing a losing response
+            admit: Called before hedging; False means don't send the hedge
+
+        Returns:
+            The first successful response
+        """
+        self._start()
+
+        async def timed():
+            started = time.monotonic()
+            result = await send()
+            self._record(time.monotonic() - started)
+            return result
+
+        first = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait({first}, timeout=self.delay())
+        if done or not self._take_token(admit):
+            return await first
+
+        logger.info("Upstream slow; sending hedged request")
+        second = asyncio.ensure_future(timed())
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    for other in done - {task}:
+                        if other.exception() is None:
+                            await close(other.result())
+                    if task is second:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        """
+        Get hedging counters.
+
+        Returns:
+            Dict with eligible request, hedge and hedge-win counts
+        """
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'hedged': self._hedged,
+                'hedge_wins': self._hedge_wins,
+                'samples': len(self._samples),
+            }
@@ -0,0 +1,523 @@
+"""
+Identity Resolution for Credential Proxy
+
+Resolves ATProto DIDs to DID documents so authenticated XRPC calls that
+belong to the account's own repository can go straight to its PDS instead
+of hopping through the bsky.social entryway. did:plc documents come from
+the PLC directory and did:web documents from the host's
+/.well-known/did.json. Resolved documents are cached with a TTL.
+
+It also keeps a TTL cache of handle -> DID mappings, filled from
+com.atproto.identity.resolveHandle and from the profile views in proxied
+responses. Cached handles in actor/repo parameters and at:// URIs are
+replaced with their DIDs before a request goes upstream, so the upstream
+doesn't resolve the same handle on every call.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator, Optional
+from urllib.parse import parse_qsl, unquote, urlencode
+
+import requests
+
+from encoding import decode_body
+
+logger = logging.getLogger(__name__)
+
+PLC_DIRECTORY = "https://plc.directory"
+PDS_SERVICE_ID = "#atproto_pds"
+PDS_SERVICE_TYPE = "AtprotoPersonalDataServer"
+
+# Failed lookups are retried after this many seconds
+NEGATIVE_TTL = 60.0
+
+RESOLVE_HANDLE = "com.atproto.identity.resolveHandle"
+
+HANDLE_RE = re.compile(
+    r"^([a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]([a-z0-9-]{0,61}[a-z0-9])?$"
+)
+DID_RE = re.compile(r"^did:[a-z]+:[A-Za-z0-9._:%-]+$")
+
+# Placeholder the AppView reports for an account whose handle failed verification
+INVALID_HANDLE = "handle.invalid"
+
+# XRPC query parameters that take a handle or DID
+ACTOR_PARAMS = {"actor", "actors", "repo"}
+# XRPC query parameters that take at:// URIs (whose authority may be a handle)
+AT_URI_PARAMS = {"uri", "uris"}
+
+# Largest response body inspected for handle/DID pairs
+LEARN_MAX_BYTES = 1024 * 1024
+
+# XRPC methods whose response is itself an account view
+ACTOR_VIEW_METHODS = {"app.bsky.actor.getProfile", "com.atproto.server.getSession"}
+# Response keys holding an AppView actor/profile view
+ACTOR_VIEW_KEYS = {"author", "actor", "subject", "profile", "creator"}
+# Response keys holding a list of actor/profile views
+ACTOR_LIST_KEYS = {"actors", "profiles", "follows", "followers", "blocks", "mutes", "repostedBy"}
+# Response keys holding user-authored record content, never learned from
+RECORD_KEYS = {"record", "value"}
+
+
+@dataclass
+class IdentityConfig:
+    """DID resolution settings for a single ATProto service."""
+    resolve_pds: bool = True     # Route repo calls directly to the account's PDS
+    ttl: float = 3600.0          # Seconds to cache a resolved DID document
+    plc_url: str = PLC_DIRECTORY
+    did_docs: dict = field(default_factory=dict)  # Static DID documents (stub resolver)
+    cache_handles: bool = True   # Cache handle -> DID mappings and rewrite requests with them
+    handle_ttl: float = 900.0    # Seconds to trust a cached handle mapping
+    max_handles: int = 100000
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'IdentityConfig':
+        """
+        Build resolution settings from a service's "identity" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            IdentityConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            resolve_pds=bool(config.get("resolve_pds", defaults.resolve_pds)),
+            ttl=float(config.get("ttl", defaults.ttl)),
+            plc_url=str(config.get("plc_url", defaults.plc_url)).rstrip("/"),
+            did_docs=dict(config.get("did_docs") or {}),
+            cache_handles=bool(config.get("cache_handles", defaults.cache_handles)),
+            handle_ttl=float(config.get("handle_ttl", defaults.handle_ttl)),
+            max_handles=int(config.get("max_handles", defaults.max_handles)),
+        )
+
+
+def pds_endpoint(did_doc: Optional[dict]) -> Optional[str]:
+    """
+    Get the PDS service endpoint from a DID document.
+
+    Args:
+        did_doc: Decoded DID document (may be None)
+
+    Returns:
+        PDS base URL without trailing slash, or None if the document has none
+    """
+    if not isinstance(did_doc, dict):
+        return None
+    for service in did_doc.get("service") or []:
+        if not isinstance(service, dict):
+            continue
+        if service.get("id", "").endswith(PDS_SERVICE_ID) and service.get("type") == PDS_SERVICE_TYPE:
+            endpoint = service.get("serviceEndpoint")
+            if isinstance(endpoint, str) and endpoint.startswith(("https://", "http://")):
+                return endpoint.rstrip("/")
+    return None
+
+
+def did_web_url(did: str) -> Optional[str]:
+    """
+    Get the URL of a did:web document.
+
+    did:web:example.com resolves to https://example.com/.well-known/did.json;
+    extra colon-separated segments are path components.
+    """
+    parts = did.split(":")[2:]
+    if not parts or not parts[0]:
+        return None
+    host = unquote(parts[0])
+    if len(parts) == 1:
+        return f"https://{host}/.well-known/did.json"
+    return f"https://{host}/{'/'.join(unquote(p) for p in parts[1:])}/did.json"
+
+
+class DidResolver:
+    """
+    Thread-safe DID document resolver with a TTL cache.
+    """
+
+    def __init__(self, config: Optional[IdentityConfig] = None):
+        self.config = config or IdentityConfig()
+        self._lock = threading.Lock()
+        self._cache: dict[str, tuple[Optional[dict], float]] = {}  # did -> (doc, expires)
+        self._session = requests.Session()
+
+        self._hits = 0
+        self._lookups = 0
+        self._failures = 0
+
+    def seed(self, did: str, did_doc: Optional[dict]) -> None:
+        """
+        Cache a DID document obtained elsewhere (e.g. createSession's didDoc).
+
+        Documents whose id doesn't match the DID are ignored.
+        """
+        if not isinstance(did_doc, dict) or did_doc.get("id") != did:
+            return
+        with self._lock:
+            self._cache[did] = (did_doc, time.monotonic() + self.config.ttl)
+
+    def resolve(self, did: str) -> Optional[dict]:
+        """
+        Get the DID document for a DID, from cache or by lookup.
+
+        Args:
+            did: did:plc or did:web identifier
+
+        Returns:
+            DID document, or None if it cannot be resolved
+        """
+        with self._lock:
+            cached = self._cache.get(did)
+            if cached and cached[1] > time.monotonic():
+                self._hits += 1
+                return cached[0]
+            self._lookups += 1
+
+        doc = self._fetch(did)
+        if doc is not None and doc.get("id") != did:
+            logger.warning(f"DID document for {did} has mismatched id {doc.get('id')}")
+            doc = None
+
+        with self._lock:
+            if doc is None:
+                self._failures += 1
+                # Keep serving a stale document rather than nothing
+                stale = cached[0] if cached else None
+                self._cache[did] = (stale, time.monotonic() + NEGATIVE_TTL)
+                return stale
+            self._cache[did] = (doc, time.monotonic() + self.config.ttl)
+            return doc
+
+    def _fetch(self, did: str) -> Optional[dict]:
+        """Look up a DID document over the network."""
+        if did.startswith("did:plc:"):
+            url = f"{self.config.plc_url}/{did}"
+        elif did.startswith("did:web:"):
+            url = did_web_url(did)
+        else:
+            logger.warning(f"Unsupported DID method: {did}")
+            return None
+        if not url:
+            return None
+
+        try:
+            response = self._session.get(url, timeout=5)
+            response.raise_for_status()
+            doc = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Failed to resolve {did}: {e}")
+            return None
+        return doc if isinstance(doc, dict) else None
+
+    def stats(self) -> dict:
+        """
+        Get resolver counters.
+
+        Returns:
+            Dict with cached document, hit, lookup and failure counts
+        """
+        with self._lock:
+            return {
+                'cached': len(self._cache),
+                'hits': self._hits,
+                'lookups': self._lookups,
+                'failures': self._failures,
+            }
+
+
+class StaticDidResolver(DidResolver):
+    """
+    Resolver that answers from the configured did_docs table only.
+
+    Used for tests and for local PDS setups where the PLC directory is
+    unreachable or doesn't know the DID.
+    """
+
+    def _fetch(self, did: str) -> Optional[dict]:
+        doc = self.config.did_docs.get(did)
+        return doc if isinstance(doc, dict) else None
+
+
+def normalize_handle(value: str) -> Optional[str]:
+    """
+    Get the canonical (lowercase, no leading @) form of a handle.
+
+    Returns:
+        The handle, or None if the value is not a syntactically valid handle
+        or is the handle.invalid placeholder (shared by every account whose
+        handle failed verification, so never mapped to a DID)
+    """
+    handle = value.strip().lstrip("@").lower()
+    if handle == INVALID_HANDLE:
+        return None
+    return handle if len(handle) <= 253 and HANDLE_RE.match(handle) else None
+
+
+class HandleCache:
+    """
+    Thread-safe handle -> DID cache with a TTL and LRU size bound.
+
+    A reverse DID -> handle index drops a DID's old handle as soon as a
+    response shows it under a new one.
+    """
+
+    def __init__(self, ttl: float = 900.0, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._dids: OrderedDict[str, tuple[str, float]] = OrderedDict()  # handle -> (did, expires)
+        self._handles: dict[str, str] = {}  # did -> handle
+
+        self._hits = 0
+        self._misses = 0
+        self._learned = 0
+        self._rewrites = 0
+
+    def get(self, handle: str) -> Optional[str]:
+        """
+        Get the cached DID for a handle.
+
+        Args:
+            handle: Normalized handle
+
+        Returns:
+            DID, or None if not cached or expired
+        """
+        with self._lock:
+            cached = self._dids.get(handle)
+            if cached is None or cached[1] <= time.monotonic():
+                self._misses += 1
+                return None
+            self._dids.move_to_end(handle)
+            self._hits += 1
+            return cached[0]
+
+    def remember(self, handle: str, did: str) -> None:
+        """Cache one mapping (invalid handles and DIDs are ignored)."""
+        handle = normalize_handle(handle) if isinstance(handle, str) else None
+        if handle is None or not isinstance(did, str) or not DID_RE.match(did):
+            return
+        with self._lock:
+            self._store(handle, did)
+
+    def _store(self, handle: str, did: str) -> None:
+        """Cache a mapping (caller holds the lock)."""
+        old_handle = self._handles.get(did)
+        if old_handle is not None and old_handle != handle:
+            self._dids.pop(old_handle, None)
+        cached = self._dids.pop(handle, None)
+        if cached is not None and cached[0] != did:
+            self._handles.pop(cached[0], None)
+        self._dids[handle] = (did, time.monotonic() + self.ttl)
+        self._handles[did] = handle
+        self._learned += 1
+        while len(self._dids) > self.max_entries:
+            _, (evicted_did, _) = self._dids.popitem(last=False)
+            self._handles.pop(evicted_did, None)
+
+    def learn(self, data, actor_view: bool = False) -> None:
+        """
+        Cache the {"did": ..., "handle": ...} pairs of the actor views in a
+        decoded XRPC response.
+
+        Only AppView actor/profile views (post authors, followers, list
+        creators and so on) are trusted. Record content is written by users,
+        so "record" and "value" subtrees are never searched: a post could
+        otherwise map anyone's handle to the author's DID.
+
+        Args:
+            data: Decoded JSON response
+            actor_view: The response itself is an actor view (getProfile, getSession)
+        """
+        pairs = []
+        stack = [(data, actor_view)]
+        while stack:
+            value, is_view = stack.pop()
+            if isinstance(value, dict):
+                if is_view:
+                    did = value.get("did")
+                    handle = value.get("handle")
+                    if isinstance(did, str) and isinstance(handle, str):
+                        pairs.append((handle, did))
+                for key, child in value.items():
+                    if key in RECORD_KEYS:
+                        continue
+                    if isinstance(child, dict):
+                        stack.append((child, key in ACTOR_VIEW_KEYS))
+                    elif isinstance(child, list):
+                        stack.append((child, key in ACTOR_LIST_KEYS))
+            elif isinstance(value, list):
+                stack.extend((v, is_view and isinstance(v, dict)) for v in value if isinstance(v, (dict, list)))
+
+        valid = []
+        for handle, did in pairs:
+            handle = normalize_handle(handle)
+            if handle is not None and DID_RE.match(did):
+                valid.append((handle, did))
+        if valid:
+            with self._lock:
+                for handle, did in valid:
+                    self._store(handle, did)
+
+    def learn_response(self, nsid: str, query_string: str, body: bytes) -> None:
+        """
+        Cache the mappings in a successful XRPC JSON response.
+
+        Args:
+            nsid: XRPC method (path after the service base URL)
+            query_string: Query string of the request
+            body: Decoded response body
+        """
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return
+        if nsid.rstrip("/").endswith(RESOLVE_HANDLE):
+            handle = dict(parse_qsl(query_string)).get("handle")
+            if handle and isinstance(data, dict):
+                self.remember(handle, data.get("did"))
+            return
+        self.learn(data, actor_view=nsid.rstrip("/").rsplit("/", 1)[-1] in ACTOR_VIEW_METHODS)
+
+    def cached_resolution(self, nsid: str, query_string: str) -> Optional[str]:
+        """
+        Answer a resolveHandle call from the cache.
+
+        Returns:
+            The DID for the requested handle, or None if the call is not
+            resolveHandle or the handle isn't cached
+        """
+        if not nsid.rstrip("/").endswith(RESOLVE_HANDLE):
+            return None
+        handle = normalize_handle(dict(parse_qsl(query_string)).get("handle", ""))
+        return self.get(handle) if handle else None
+
+    def _did_for(self, value: str) -> Optional[str]:
+        """Get the cached DID for a parameter value that is a handle."""
+        if value.startswith("did:"):
+            return None
+        handle = normalize_handle(value)
+        return self.get(handle) if handle else None
+
+    def rewrite_query(self, query_string: str) -> str:
+        """
+        Replace cached handles in actor/repo parameters and at:// URIs with DIDs.
+
+        Args:
+            query_string: Query string bound for the upstream
+
+        Returns:
+            The rewritten query string (unchanged if nothing was cached)
+        """
+        if not query_string:
+            return query_string
+        params = parse_qsl(query_string, keep_blank_values=True)
+        changed = False
+        for i, (key, value) in enumerate(params):
+            did = None
+            if key in ACTOR_PARAMS:
+                did = self._did_for(value)
+                if did:
+                    params[i] = (key, did)
+            elif key in AT_URI_PARAMS and value.startswith("at://"):
+                authority, _, rest = value[len("at://"):].partition("/")
+                did = self._did_for(authority)
+                if did:
+                    params[i] = (key, f"at://{did}/{rest}" if rest else f"at://{did}")
+            changed = changed or did is not None
+        if not changed:
+            return query_string
+        with self._lock:
+            self._rewrites += 1
+        return urlencode(params)
+
+    def watcher(self, nsid: str, query_string: str, content_encoding: Optional[str] = None) -> 'HandleWatcher':
+        """Start inspecting a response body as it streams to the client."""
+        return HandleWatcher(self, nsid, query_string, content_encoding)
+
+    def stats(self) -> dict:
+        """
+        Get handle cache counters.
+
+        Returns:
+            Dict with cached mapping, hit, miss, learned and rewrite counts
+        """
+        with self._lock:
+            return {
+                'cached': len(self._dids),
+                'hits': self._hits,
+                'misses': self._misses,
+                'learned': self._learned,
+                'rewrites': self._rewrites,
+            }
+
+
+class HandleWatcher:
+    """
+    Collects a response body as it streams and learns its handle/DID pairs.
+
+    Bodies over LEARN_MAX_BYTES, and bodies the client abandons, are skipped.
+    """
+
+    def __init__(self, cache: HandleCache, nsid: str, query_string: str, content_encoding: Optional[str]):
+        self._cache = cache
+        self._nsid = nsid
+        self._query_string = query_string
+        self._content_encoding = content_encoding
+        self._chunks: Optional[list[bytes]] = []
+        self._size = 0
+
+    def write(self, chunk: bytes) -> None:
+        if self._chunks is None:
+            return
+        self._size += len(chunk)
+        if self._size > LEARN_MAX_BYTES:
+            self._chunks = None
+            return
+        self._chunks.append(chunk)
+
+    def wrap(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Pass a body through, learning from it once it has been fully read."""
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+        self.commit()
+
+    async def awrap(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Async version of wrap()."""
+        async for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+        self.commit()
+
+    def commit(self) -> None:
+        if self._chunks is None:
+            return
+        body = b"".join(self._chunks)
+        self._chunks = None
+        if self._content_encoding:
+            body = decode_body(body, self._content_encoding)
+            if body is None:
+                return
+        self._cache.learn_response(self._nsid, self._query_string, body)
+
+
+def create_resolver(config: Optional[IdentityConfig] = None) -> DidResolver:
+    """
+    Build the resolver for a service's identity settings.
+
+    Returns:
+        StaticDidResolver when did_docs are configured, DidResolver otherwise
+    """
+    config = config or IdentityConfig()
+    if config.did_docs:
+        return StaticDidResolver(config)
+    return DidResolver(config)
@@ -0,0 +1,330 @@
+"""
+Pagination Aggregation for Credential Proxy
+
+Lets a client fetch every page of a paginated list in one proxied call:
+
+    GET /proxy/github_api/repos/owner/repo/issues?state=open&_paginate=all&_max_items=500
+    GET /proxy/bsky/app.bsky.feed.searchPosts?q=python&limit=100&_paginate=all&_max_items=1000
+
+For ATProto services the proxy walks the XRPC "cursor" field; for everything
+else it follows Link: rel="next" headers. Items are streamed back as NDJSON
+(default for ATProto) or as a single JSON array (default otherwise). The
+next page request is sent as soon as its cursor or link is known, so it is
+in flight while the current page streams to the client.
+
+Control parameters (stripped before the request goes upstream):
+    _paginate=all     Enable aggregation
+    _max_items=N      Stop after N items
+    _max_pages=N      Stop after N pages (default 100)
+    _format=json|ndjson   (default: ndjson for ATProto, json otherwise)
+    _items_key=KEY    Field holding the items when pages are JSON objects
+
+Every page goes through proxy_call(), so caching, rate limiting, retries
+and circuit breakers apply page by page.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+from credentials import CredentialStore
+from proxy import ProxyResult, proxy_call, read_result_body
+
+logger = logging.getLogger(__name__)
+
+CONTROL_PARAMS = {'_paginate', '_max_items', '_max_pages', '_format', '_items_key'}
+DEFAULT_MAX_PAGES = 100
+MAX_PAGE_BYTES = 10 * 1024 * 1024
+
+# Page fetches running ahead of the page being streamed
+_prefetcher = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PROXY_PAGINATE_WORKERS', 16)),
+    thread_name_prefix='paginate'
+)
+
+
+class PaginationError(ValueError):
+    """Raised for invalid pagination control parameters."""
+
+
+@dataclass
+class PaginationRequest:
+    """Aggregation settings parsed from the query string."""
+    max_items: Optional[int] = None
+    max_pages: int = DEFAULT_MAX_PAGES
+    format: Optional[str] = None  # None picks the service's default
+    items_key: Optional[str] = None
+
+
+@dataclass
+class Page:
+    """One fetched upstream page."""
+    status: int
+    headers: dict
+    body: bytes
+    content_type: str
+
+
+def split_pagination(query_string: str) -> tuple[Optional[PaginationRequest], str]:
+    """
+    Separate pagination control parameters from the upstream query.
+
+    Args:
+        query_string: Raw query string from the client
+
+    Returns:
+        Tuple of (PaginationRequest or None if not requested, upstream query string)
+
+    Raises:
+        PaginationError if a control parameter is invalid
+    """
+    params = parse_qsl(query_string, keep_blank_values=True)
+    control = {k: v for k, v in params if k in CONTROL_PARAMS}
+    if control.get('_paginate') != 'all':
+        return None, query_string
+
+    upstream = urlencode([(k, v) for k, v in params if k not in CONTROL_PARAMS])
+    try:
+        request = PaginationRequest(
+            max_items=int(control['_max_items']) if control.get('_max_items') else None,
+            max_pages=int(control.get('_max_pages') or DEFAULT_MAX_PAGES),
+            format=control.get('_format') or None,
+            items_key=control.get('_items_key') or None,
+        )
+    except ValueError:
+        raise PaginationError('_max_items and _max_pages must be integers')
+    if request.format not in (None, 'json', 'ndjson'):
+        raise PaginationError('_format must be json or ndjson')
+    if request.max_pages < 1 or (request.max_items is not None and request.max_items < 1):
+        raise PaginationError('_max_items and _max_pages must be positive')
+    return request, upstream
+
+
+def extract_items(data, items_key: Optional[str] = None) -> Optional[list]:
+    """
+    Get the list of items from a decoded page.
+
+    Pages are either a JSON array or an object with one list field
+    (e.g. GitHub search's "items").
+
+    Returns:
+        The items, or None if the page has no recognizable list
+    """
+    if isinstance(data, list):
+        return data
+    if not isinstance(data, dict):
+        return None
+    if items_key:
+        items = data.get(items_key)
+        return items if isinstance(items, list) else None
+    for value in data.values():
+        if isinstance(value, list):
+            return value
+    return None
+
+
+def next_link_target(headers: dict, base_url: str) -> Optional[tuple[str, str]]:
+    """
+    Get the path and query string of the Link: rel="next" page.
+
+    The next link may use a different path than the first page (GitHub
+    answers /repos/owner/repo/issues with /repositories/<id>/issues?page=2),
+    so any URL on the service's scheme and host under its base URL is
+    followed.
+
+    Args:
+        headers: Page response headers
+        base_url: Service base URL
+
+    Returns:
+        Tuple of (path after the base URL, query string) for the next page,
+        or None when there is none (or it points outside the service)
+    """
+    link = next((v for k, v in headers.items() if k.lower() == 'link'), None)
+    if not link:
+        return None
+    next_url = requests.utils.parse_header_links(link)
+    next_url = next((l.get('url') for l in next_url if l.get('rel') == 'next'), None)
+    if not next_url:
+        return None
+
+    parts = urlsplit(next_url)
+    base = urlsplit(base_url)
+    base_path = base.path.rstrip('/') + '/'
+    if (parts.scheme, parts.netloc) != (base.scheme, base.netloc) or not parts.path.startswith(base_path):
+        logger.warning(f"Not following next link outside {base_url}: {next_url}")
+        return None
+    return parts.path[len(base_path):], parts.query
+
+
+def next_cursor_query(data, query_string: str) -> Optional[str]:
+    """
+    Get the query string for the next page of an XRPC list.
+
+    Args:
+        data: Decoded page
+        query_string: Query string the page was fetched with
+
+    Returns:
+        Query string with the page's cursor, or None on the last page
+    """
+    cursor = data.get('cursor') if isinstance(data, dict) else None
+    if not cursor or not isinstance(cursor, str):
+        return None
+    params = parse_qsl(query_string, keep_blank_values=True)
+    if ('cursor', cursor) in params:
+        return None  # Upstream returned the same cursor again
+    return urlencode([(k, v) for k, v in params if k != 'cursor'] + [('cursor', cursor)])
+
+
+def fetch_page(
+    service: str,
+    path: str,
+    headers: dict,
+    query_string: str,
+    credential_store: CredentialStore
+) -> Page:
+    """Fetch and fully read one page through proxy_call()."""
+    result = proxy_call(service, path, 'GET', headers, None, query_string, credential_store)
+    body = read_result_body(result.body, MAX_PAGE_BYTES)
+    if body is None:
+        raise PaginationError(f"page larger than {MAX_PAGE_BYTES} bytes")
+    return Page(
+        status=result.status,
+        headers=result.headers,
+        body=body,
+        content_type=result.headers.get('Content-Type') or result.content_type
+    )
+
+
+def paginated_call(
+    service: str,
+    path: str,
+    headers: dict,
+    query_string: str,
+    pagination: PaginationRequest,
+    credential_store: CredentialStore
+) -> ProxyResult:
+    """
+    Fetch every page of a list and stream the items as one response.
+
+    The first page is fetched before responding, so an upstream error on it
+    is returned to the client unchanged. Later failures end the stream early
+    with a final {"error": "pagination stopped: ..."} item (an NDJSON line,
+    or the last element of the JSON array), so a partial result is never
+    mistaken for a complete one.
+
+    Args:
+        service: Service name
+        path: Path after the service base URL
+        headers: Client request headers
+        query_string: Upstream query string (control parameters removed)
+        pagination: Aggregation settings
+        credential_store: CredentialStore instance for credential lookup
+
+    Returns:
+        ProxyResult streaming a JSON array or NDJSON
+    """
+    cred = credential_store.primary(service)
+    if cred is None:
+        return proxy_call(service, path, 'GET', headers, None, query_string, credential_store)
+
+    # Pages are decoded and re-serialized, so never ask for compressed bodies
+    headers = {k: v for k, v in headers.items() if k.lower() != 'accept-encoding'}
+
+    use_cursor = cred.service_type == "atproto"
+    output = pagination.format or ('ndjson' if use_cursor else 'json')
+
+    first = fetch_page(service, path, headers, query_string, credential_store)
+    if not 200 <= first.status < 300:
+        return ProxyResult(first.status, first.headers, first.body, first.content_type)
+    try:
+        first_data = json.loads(first.body)
+    except ValueError:
+        first_data = None
+    if extract_items(first_data, pagination.items_key) is None:
+        # Not a list endpoint; hand the single page back as-is
+        return ProxyResult(first.status, first.headers, first.body, first.content_type)
+
+    def pages() -> Iterator[tuple[Optional[list], Optional[str]]]:
+        """Yield (items, error) per page, prefetching the next page."""
+        page, data, page_path, query = first, first_data, path, query_string
+        fetched = 1
+        total = 0
+        future: Optional[Future] = None
+        try:
+            while True:
+                items = extract_items(data, pagination.items_key) or []
+                total += len(items)
+
+                if use_cursor:
+                    next_path, next_query = page_path, next_cursor_query(data, query)
+                else:
+                    next_path, next_query = next_link_target(page.headers, cred.base_url) or (None, None)
+                more = (
+                    next_query is not None
+                    and fetched < pagination.max_pages
+                    and (pagination.max_items is None or total < pagination.max_items)
+                    and bool(items)
+                )
+                if more:
+                    future = _prefetcher.submit(
+                        fetch_page, service, next_path, headers, next_query, credential_store
+                    )
+                    fetched += 1
+                yield items, None
+                if not more:
+                    return
+
+                try:
+                    page_path, query = next_path, next_query
+                    page, future = future.result(), None
+                    if not 200 <= page.status < 300:
+                        raise PaginationError(f"upstream returned {page.status}")
+                    data = json.loads(page.body)
+                except Exception as e:
+                    logger.warning(f"Pagination of {service}/{path} stopped after {fetched - 1} page(s): {e}")
+                    yield None, str(e)
+                    return
+        finally:
+            if future is not None:
+                future.cancel()
+
+    def stream() -> Iterator[bytes]:
+        emitted = 0
+        first_item = True
+        if output == 'json':
+            yield b'['
+        for items, error in pages():
+            if error is not None:
+                # The 200 status is already sent, so mark the result as partial in-band
+                encoded = json.dumps({'error': f'pagination stopped: {error}'}).encode()
+                if output == 'ndjson':
+                    yield encoded + b'\n'
+                else:
+                    yield encoded if first_item else b',' + encoded
+                break
+            for item in items:
+                if pagination.max_items is not None and emitted >= pagination.max_items:
+                    break
+                encoded = json.dumps(item).encode()
+                if output == 'ndjson':
+                    yield encoded + b'\n'
+                else:
+                    yield encoded if first_item else b',' + encoded
+                first_item = False
+                emitted += 1
+            if pagination.max_items is not None and emitted >= pagination.max_items:
+                break
+        if output == 'json':
+            yield b']'
+        logger.info(f"Paginated {service}/{path}: {emitted} item(s)")
+
+    content_type = 'application/json' if output == 'json' else 'application/x-ndjson'
+    return ProxyResult(status=200, headers={}, body=stream(), content_type=content_type)
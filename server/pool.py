@@ -0,0 +1,364 @@
+"""
+Upstream Connection Pools for Credential Proxy
+
+Keeps a keep-alive HTTP session per proxied service so repeated calls to the
+same upstream reuse TCP/TLS connections instead of handshaking every time.
+
+ServicePool backs the Flask (threaded) engine; AsyncServicePool backs the
+asyncio engine in asgi_server.py. Services configured with "http2": true use
+HTTP2ServicePool instead of ServicePool, so concurrent streams to one host
+share a single multiplexed connection.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from http.cookiejar import DefaultCookiePolicy
+from typing import Iterator, Optional, Union
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolConfig:
+    """Connection pool settings for a single service."""
+    pool_size: int = 10                 # Number of per-host pools kept alive
+    max_connections_per_host: int = 10  # Max open connections to one host
+    max_idle_seconds: float = 90.0      # Drop idle connections after this long
+    block: bool = False                 # Wait for a free connection instead of opening extras
+    http2: bool = False                 # Multiplex requests over HTTP/2 (falls back to 1.1)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'PoolConfig':
+        """
+        Build pool settings from a service's "pool" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            PoolConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            pool_size=int(config.get("pool_size", defaults.pool_size)),
+            max_connections_per_host=int(
+                config.get("max_connections_per_host", defaults.max_connections_per_host)
+            ),
+            max_idle_seconds=float(config.get("max_idle_seconds", defaults.max_idle_seconds)),
+            block=bool(config.get("block", defaults.block)),
+            http2=bool(config.get("http2", defaults.http2)),
+        )
+
+    def httpx_limits(self) -> httpx.Limits:
+        """Connection limits for an httpx client built from these settings."""
+        keepalive = self.pool_size * self.max_connections_per_host
+        return httpx.Limits(
+            # Mirror ServicePool: only cap open connections when blocking
+            max_connections=keepalive if self.block else None,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=self.max_idle_seconds
+        )
+
+
+class ServicePool:
+    """
+    Thread-safe keep-alive session for one upstream service.
+
+    Wraps a requests.Session with a sized HTTPAdapter. Cookies are never
+    stored, so responses for one caller cannot leak into another's requests.
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig()
+
+        self._session = requests.Session()
+        self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self._adapter = HTTPAdapter(
+            pool_connections=self.config.pool_size,
+            pool_maxsize=self.config.max_connections_per_host,
+            pool_block=self.config.block,
+            max_retries=0
+        )
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._idle_resets = 0
+        # Counters from pools that were dropped by idle expiry
+        self._retired_requests = 0
+        self._retired_connections = 0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request over a pooled connection.
+
+        Accepts the same keyword arguments as requests.request().
+        """
+        self._expire_idle()
+        return self._session.request(method, url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Send a POST request over a pooled connection."""
+        return self.request("POST", url, **kwargs)
+
+    def _expire_idle(self) -> None:
+        """Close all pooled connections if the pool has sat idle too long."""
+        with self._lock:
+            now = time.monotonic()
+            idle = now - self._last_used
+            self._last_used = now
+
+            if idle <= self.config.max_idle_seconds:
+                return
+
+            requests_seen, connections = self._pool_counters()
+            self._retired_requests += requests_seen
+            self._retired_connections += connections
+            self._idle_resets += 1
+
+        # Connections still checked out are closed when they are released
+        self._adapter.poolmanager.clear()
+        logger.debug(f"Dropped idle connections after {idle:.0f}s")
+
+    def _pool_counters(self) -> tuple[int, int]:
+        """Sum request and connection counters across live host pools."""
+        pools = self._adapter.poolmanager.pools
+        requests_seen = 0
+        connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_seen += pool.num_requests
+            connections += pool.num_connections
+        return requests_seen, connections
+
+    def stats(self) -> dict:
+        """
+        Get connection reuse statistics.
+
+        Returns:
+            Dict with request/connection counts and the connection reuse rate
+        """
+        with self._lock:
+            requests_seen, connections = self._pool_counters()
+            requests_seen += self._retired_requests
+            connections += self._retired_connections
+            idle_for = time.monotonic() - self._last_used
+            idle_resets = self._idle_resets
+
+        reuse_rate = 1 - (connections / requests_seen) if requests_seen else 0.0
+        return {
+            'requests': requests_seen,
+            'connections_opened': connections,
+            'reuse_rate': round(max(reuse_rate, 0.0), 3),
+            'hosts': len(self._adapter.poolmanager.pools),
+            'idle_resets': idle_resets,
+            'idle_seconds': round(idle_for, 1),
+            'pool_size': self.config.pool_size,
+            'max_connections_per_host': self.config.max_connections_per_host,
+        }
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self._session.close()
+
+
+class _RawStream:
+    """Minimal stand-in for urllib3's response.raw used by the proxy."""
+
+    def __init__(self, response: httpx.Response):
+        self._response = response
+
+    def stream(self, chunk_size: int = 8192, decode_content: bool = False) -> Iterator[bytes]:
+        if decode_content:
+            return self._response.iter_bytes(chunk_size)
+        return self._response.iter_raw(chunk_size)
+
+
+class HTTP2Response:
+    """
+    requests.Response look-alike over a streaming httpx response.
+
+    Covers what the proxy and the ATProto auth flows use: status_code,
+    headers, iter_content(), raw.stream(), json(), raise_for_status() and
+    close().
+    """
+
+    def __init__(self, response: httpx.Response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.http_version = response.http_version
+        self.raw = _RawStream(response)
+
+    def iter_content(self, chunk_size: int = 8192) -> Iterator[bytes]:
+        return self._response.iter_bytes(chunk_size)
+
+    @property
+    def content(self) -> bytes:
+        return self._response.read()
+
+    @property
+    def text(self) -> str:
+        self._response.read()
+        return self._response.text
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} error for url: {self.url}", response=self
+            )
+
+    def close(self) -> None:
+        self._response.close()
+
+
+class HTTP2ServicePool:
+    """
+    HTTP/2 keep-alive client for one upstream service.
+
+    Drop-in replacement for ServicePool backed by httpx.Client(http2=True):
+    concurrent requests to a host are multiplexed over one connection when
+    the upstream negotiates h2 via ALPN. Responses are wrapped in
+    HTTP2Response and httpx errors are re-raised as the equivalent
+    requests exceptions, so callers handle both pools the same way.
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig()
+        self._client = httpx.Client(limits=self.config.httpx_limits(), http2=True)
+        self._client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._versions: dict[str, int] = {}
+
+    def request(self, method: str, url: str, **kwargs) -> HTTP2Response:
+        """
+        Send a request over the multiplexed connection.
+
+        Accepts the subset of requests.request() keyword arguments the proxy
+        uses: headers, data, json, stream and timeout.
+        """
+        data = kwargs.get("data")
+        headers = dict(kwargs.get("headers") or {})
+        # Iterables with a declared size (StreamingBody) keep their Content-Length
+        if data is not None and not isinstance(data, (bytes, str)) and getattr(data, "len", 0):
+            headers.setdefault("Content-Length", str(data.len))
+
+        try:
+            upstream_req = self._client.build_request(
+                method,
+                url,
+                headers=headers,
+                content=data,
+                json=kwargs.get("json"),
+                timeout=kwargs.get("timeout", 60)
+            )
+            response = self._client.send(upstream_req, stream=True)
+            if not kwargs.get("stream", False):
+                response.read()
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+        with self._lock:
+            self._requests += 1
+            self._versions[response.http_version] = self._versions.get(response.http_version, 0) + 1
+        return HTTP2Response(response)
+
+    def post(self, url: str, **kwargs) -> HTTP2Response:
+        """Send a POST request over the multiplexed connection."""
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Get request counts per negotiated HTTP version.
+
+        Returns:
+            Dict with the request count and responses by HTTP version
+        """
+        with self._lock:
+            return {
+                'transport': 'http2',
+                'requests': self._requests,
+                'http_versions': dict(self._versions),
+            }
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self._client.close()
+
+
+def create_pool(config: Optional[PoolConfig] = None) -> Union[ServicePool, HTTP2ServicePool]:
+    """
+    Build the synchronous pool matching a service's transport settings.
+
+    Args:
+        config: Pool settings (defaults if None)
+
+    Returns:
+        HTTP2ServicePool when http2 is enabled, otherwise ServicePool
+    """
+    config = config or PoolConfig()
+    if config.http2:
+        return HTTP2ServicePool(config)
+    return ServicePool(config)
+
+
+class AsyncServicePool:
+    """
+    Keep-alive httpx.AsyncClient for one upstream service.
+
+    Used by the asyncio engine, where many in-flight streams share a handful
+    of connections without holding a thread each. Like ServicePool, cookies
+    are never stored.
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None, timeout: float = 60.0):
+        self.config = config or PoolConfig()
+
+        self._client = httpx.AsyncClient(
+            limits=self.config.httpx_limits(),
+            http2=self.config.http2,
+            timeout=timeout
+        )
+        self._client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        self._requests = 0
+
+    async def send(self, request: httpx.Request) -> httpx.Response:
+        """
+        Send a request and return as soon as response headers arrive.
+
+        The caller must close the response (aclose()) once the body is consumed.
+        """
+        self._requests += 1
+        return await self._client.send(request, stream=True)
+
+    def build_request(self, method: str, url: str, **kwargs) -> httpx.Request:
+        """Build a request bound to this pool's client."""
+        return self._client.build_request(method, url, **kwargs)
+
+    def stats(self) -> dict:
+        """Get request counts for the async client."""
+        return {'requests': self._requests}
+
+    async def aclose(self) -> None:
+        """Close all pooled connections."""
+        await self._client.aclose()
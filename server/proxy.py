@@ -5,12 +5,34 @@ Forwards requests to upstream services with credential injection.
 Streams responses back to avoid buffering large payloads.
 """
 
+import itertools
+import json
 import logging
+import math
+import os
+import time
 import requests
-from flask import Response, stream_with_context
-from typing import Optional
+from dataclasses import dataclass
+from flask import Response, send_file, stream_with_context
+from typing import BinaryIO, Callable, Iterator, Optional, Union
 
-from credentials import CredentialStore
+from blobcache import BlobCache, BlobEntry, blob_key
+from breaker import CircuitOpen, is_failure_status
+from cache import (
+    CachedResponse,
+    CacheWriter,
+    ResponseCache,
+    is_cacheable_request,
+    make_cache_key,
+    may_store,
+    response_ttl,
+)
+from coalesce import AsyncCoalescer, Coalescer, make_flight_key
+from credentials import TOKEN_ERROR_STATUSES, CredentialStore, ServiceCredential, is_token_error
+from encoding import accepts_encoding, adapt_body_for_client, response_encoding
+from ratelimit import RateBudgetExhausted
+from retry import retry_after_seconds
+from routing import APPVIEW_REFUSED_STATUSES
 
 logger = logging.getLogger(__name__)
 
@@ -35,10 +57,154 @@ EXCLUDED_RESPONSE_HEADERS = {
     'connection',
     'keep-alive',
     'transfer-encoding',
-    'content-encoding',  # Let Flask handle encoding
+    'content-encoding',  # Body is decoded unless passed through compressed
     'content-length',    # Will be recalculated
 }
 
+# Framing headers kept when a compressed body is forwarded untouched
+PASSTHROUGH_RESPONSE_HEADERS = {'content-encoding', 'content-length'}
+
+
+# Per-attempt upstream timeout (retries are further bounded by the service deadline)
+UPSTREAM_TIMEOUT = 60
+
+# Largest request body forwarded upstream (enforced while streaming)
+MAX_BODY_BYTES = int(os.environ.get('PROXY_MAX_BODY_BYTES', 100 * 1024 * 1024))
+BODY_CHUNK_SIZE = 64 * 1024
+
+# ATProto uploads up to this size are buffered so they can be replayed
+# after the upstream rejects the access token
+REPLAY_BODY_MAX_BYTES = 5 * 1024 * 1024
+
+# Largest ATProto error body inspected for ExpiredToken/InvalidToken
+TOKEN_ERROR_MAX_BYTES = 64 * 1024
+
+# Shared response cache for proxied GETs (0 disables caching)
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get('PROXY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+)
+
+# On-disk cache of CID-addressed ATProto blobs (0 disables)
+blob_cache = BlobCache(
+    directory=os.environ.get('PROXY_BLOB_CACHE_DIR', os.path.join(os.path.dirname(__file__), '.blob_cache')),
+    max_bytes=int(os.environ.get('PROXY_BLOB_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+)
+BLOB_METHODS = {'GET', 'HEAD'}
+BLOB_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Identical concurrent GET/HEAD requests share one upstream call
+COALESCE_METHODS = {'GET', 'HEAD'}
+coalescer = Coalescer(
+    max_buffer_bytes=int(os.environ.get('PROXY_COALESCE_BUFFER_BYTES', 1024 * 1024))
+)
+async_coalescer = AsyncCoalescer(max_buffer_bytes=coalescer.max_buffer_bytes)  # asyncio engine
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds MAX_BODY_BYTES."""
+
+
+class StreamingBody:
+    """
+    Request body read from the client stream chunk by chunk.
+
+    Passed to requests as an iterable: it is sent with Content-Length when
+    the client declared one and with chunked encoding otherwise, so uploads
+    are never held in memory as a whole.
+    """
+
+    def __init__(self, stream: BinaryIO, content_length: Optional[int], max_bytes: int = MAX_BODY_BYTES):
+        self._stream = stream
+        self.len = content_length or 0  # Read by requests to set Content-Length
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def declared_too_large(self) -> bool:
+        """Check whether the client's Content-Length already exceeds the limit."""
+        return self.len > self.max_bytes
+
+    def __iter__(self):
+        while True:
+            chunk = self._stream.read(BODY_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_bytes:
+                raise BodyTooLarge(f"request body exceeds {self.max_bytes} bytes")
+            yield chunk
+
+
+@dataclass
+class ProxyResult:
+    """
+    A proxied response, independent of the web framework serving it.
+
+    body is either complete bytes or an iterator of chunks that must be
+    consumed (or closed) to release the upstream connection.
+    """
+    status: int
+    headers: dict
+    body: Union[bytes, Iterator[bytes]]
+    content_type: str = 'application/json'
+    file_path: Optional[str] = None  # Body is this file; frameworks may serve it directly
+    release: Optional[Callable] = None  # Frees the upstream even if body is never iterated
+
+
+def error_result(status: int, error: str, **extra) -> ProxyResult:
+    """
+    Build a JSON error result.
+
+    Args:
+        status: HTTP status code
+        error: Error message
+        **extra: Additional fields for the JSON body
+
+    Returns:
+        ProxyResult with a {"error": ...} body
+    """
+    return ProxyResult(
+        status=status,
+        headers={},
+        body=json.dumps({'error': error, **extra}).encode()
+    )
+
+
+def body_too_large_result(max_bytes: int) -> ProxyResult:
+    """Build the 413 result for an oversized request body."""
+    return error_result(413, "request body too large", max_bytes=max_bytes)
+
+
+def rate_limited_result(retry_after: float) -> ProxyResult:
+    """
+    Build the 429 result for a request the rate governor refused to hold.
+
+    Args:
+        retry_after: Seconds until the upstream budget is expected back
+
+    Returns:
+        ProxyResult with a Retry-After header
+    """
+    seconds = math.ceil(retry_after)
+    result = error_result(429, "upstream rate limit budget exhausted", retry_after=seconds)
+    result.headers['Retry-After'] = str(seconds)
+    return result
+
+
+def circuit_open_result(retry_after: float) -> ProxyResult:
+    """
+    Build the 503 result for a request refused by an open circuit breaker.
+
+    Args:
+        retry_after: Seconds until the breaker lets probes through
+
+    Returns:
+        ProxyResult with a Retry-After header
+    """
+    seconds = math.ceil(retry_after)
+    result = error_result(503, "upstream unavailable (circuit open)", retry_after=seconds)
+    result.headers['Retry-After'] = str(seconds)
+    return result
+
 
 def filter_request_headers(headers: dict) -> dict:
     """
@@ -56,28 +222,263 @@ def filter_request_headers(headers: dict) -> dict:
     }
 
 
-def filter_response_headers(headers: dict) -> dict:
+def filter_response_headers(headers: dict, passthrough: bool = False) -> dict:
     """
     Filter response headers for forwarding back to client.
 
     Args:
         headers: Upstream response headers
+        passthrough: Keep Content-Encoding/Content-Length because the body
+            is forwarded still compressed
 
     Returns:
         Filtered headers dict
     """
+    excluded = EXCLUDED_RESPONSE_HEADERS
+    if passthrough:
+        excluded = excluded - PASSTHROUGH_RESPONSE_HEADERS
     return {
         k: v for k, v in headers.items()
-        if k.lower() not in EXCLUDED_RESPONSE_HEADERS
+        if k.lower() not in excluded
     }
 
 
+def client_accepts_compressed(request_headers: dict, upstream_headers) -> bool:
+    """
+    Check whether an upstream body can be forwarded without decoding.
+
+    Args:
+        request_headers: Headers sent by the client
+        upstream_headers: Upstream response headers
+
+    Returns:
+        True if the upstream body is compressed with an encoding the client accepts
+    """
+    encoding = response_encoding(upstream_headers)
+    if encoding is None:
+        return False
+    accept_encoding = next(
+        (v for k, v in request_headers.items() if k.lower() == 'accept-encoding'), None
+    )
+    return accepts_encoding(accept_encoding, encoding)
+
+
+def may_be_token_error(cred: ServiceCredential, status: int, headers) -> bool:
+    """
+    Check whether an upstream response is worth reading for an XRPC token error.
+
+    A missing Content-Length still qualifies; the body is then read with
+    peek_body(), which stops after TOKEN_ERROR_MAX_BYTES.
+    """
+    if cred.service_type != "atproto" or status not in TOKEN_ERROR_STATUSES:
+        return False
+    length = headers.get('Content-Length')
+    if length is None:
+        return True
+    try:
+        return int(length) <= TOKEN_ERROR_MAX_BYTES
+    except ValueError:
+        return False
+
+
+def peek_body(chunks: Iterator[bytes], max_bytes: int) -> tuple[bytes, Iterator[bytes]]:
+    """
+    Read the start of a body without losing it.
+
+    Args:
+        chunks: Body chunks
+        max_bytes: Stop reading once more than this has been read
+
+    Returns:
+        Tuple of (bytes read, the whole body with those bytes first). The
+        body was read to the end when len(bytes read) <= max_bytes.
+    """
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            break
+    read = b''.join(head)
+    return read, itertools.chain([read], chunks)
+
+
+def learns_handles(cred: ServiceCredential, method: str, status: int, headers) -> bool:
+    """Check whether an upstream response should feed the service's handle cache."""
+    return (
+        cred.handle_cache is not None and method == 'GET' and status == 200
+        and 'json' in headers.get('Content-Type', '')
+    )
+
+
+def resolved_handle_result(did: str) -> ProxyResult:
+    """Build a resolveHandle response from the handle cache."""
+    return ProxyResult(
+        status=200,
+        headers={'Content-Type': 'application/json', 'X-Proxy-Cache': 'HIT'},
+        body=json.dumps({'did': did}).encode()
+    )
+
+
+def request_session_id(headers: dict) -> Optional[str]:
+    """Get the client's X-Session-Id from request headers (any casing)."""
+    return next((v for k, v in headers.items() if k.lower() == 'x-session-id'), None)
+
+
+def bearer_token(headers: dict) -> str:
+    """Get the bearer token from injected request headers."""
+    return headers.get('Authorization', '').removeprefix('Bearer ')
+
+
+def stream_upstream(
+    upstream_resp: requests.Response,
+    chunk_size: int = 8192,
+    decode: bool = True,
+    body: Optional[Iterator[bytes]] = None
+):
+    """
+    Yield an upstream response body and release its connection afterwards.
+
+    Closing in a finally block returns the connection to the service pool
+    even when the client disconnects mid-stream.
+
+    Args:
+        upstream_resp: Streaming upstream response
+        chunk_size: Bytes per chunk
+        decode: Decode Content-Encoding; False yields the raw compressed bytes
+        body: Decoded body already being read (from peek_body()), used as is
+
+    Yields:
+        Body chunks
+    """
+    try:
+        if body is not None:
+            yield from body
+        elif decode:
+            yield from upstream_resp.iter_content(chunk_size=chunk_size)
+        else:
+            yield from upstream_resp.raw.stream(chunk_size, decode_content=False)
+    finally:
+        upstream_resp.close()
+
+
+def cached_result(entry: CachedResponse, request_headers: dict, cache_status: str = 'HIT') -> ProxyResult:
+    """
+    Build a result from a cache entry.
+
+    Args:
+        entry: Fresh (or just revalidated) cache entry
+        request_headers: Headers sent by the client (for Accept-Encoding)
+        cache_status: Value for the X-Proxy-Cache header
+
+    Returns:
+        ProxyResult with Age and X-Proxy-Cache headers added
+    """
+    accept_encoding = next(
+        (v for k, v in request_headers.items() if k.lower() == 'accept-encoding'), None
+    )
+    headers, body = adapt_body_for_client(dict(entry.headers), entry.body, accept_encoding)
+    headers['Age'] = str(entry.age())
+    headers['X-Proxy-Cache'] = cache_status
+    return ProxyResult(
+        status=entry.status,
+        headers=headers,
+        body=body,
+        content_type=headers.get('Content-Type', 'application/octet-stream')
+    )
+
+
+def iter_file(path: str, chunk_size: int = BODY_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a file's contents in chunks."""
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def blob_result(entry: BlobEntry) -> ProxyResult:
+    """
+    Build a result serving a blob from the disk cache.
+
+    Returns:
+        ProxyResult whose file_path lets the web framework send the file
+        itself (with Range support); body reads the same file for other callers
+    """
+    return ProxyResult(
+        status=200,
+        headers={
+            'Content-Type': entry.content_type,
+            'Cache-Control': BLOB_CACHE_CONTROL,
+            'X-Proxy-Cache': 'HIT',
+        },
+        body=iter_file(entry.path),
+        content_type=entry.content_type,
+        file_path=entry.path
+    )
+
+
+def read_result_body(body: Union[bytes, Iterator[bytes]], limit: int) -> Optional[bytes]:
+    """
+    Collect a ProxyResult body, releasing the upstream connection.
+
+    Returns:
+        The body, or None if it exceeds limit bytes
+    """
+    if isinstance(body, bytes):
+        return body if len(body) <= limit else None
+    chunks = []
+    size = 0
+    try:
+        for chunk in body:
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return b''.join(chunks)
+
+
+def to_flask_response(result: ProxyResult) -> Response:
+    """
+    Convert a ProxyResult into a Flask response, streaming iterator bodies.
+
+    Must be called inside a request context.
+    """
+    if result.file_path is not None:
+        # Cached blob: send_file handles Range/conditional requests and uses
+        # the server's wsgi.file_wrapper (sendfile) when it has one
+        result.body.close()
+        response = send_file(
+            result.file_path,
+            mimetype=result.content_type,
+            conditional=True,
+            etag=os.path.basename(result.file_path)
+        )
+        response.headers.update(result.headers)
+        return response
+
+    body = result.body
+    if not isinstance(body, bytes):
+        body = stream_with_context(body)
+    response = Response(
+        body,
+        status=result.status,
+        headers=result.headers,
+        content_type=result.content_type
+    )
+    if result.release is not None:
+        response.call_on_close(result.release)
+    return response
+
+
 def forward_request(
     service: str,
     path: str,
     method: str,
     headers: dict,
-    body: Optional[bytes],
+    body: Optional[Union[bytes, StreamingBody]],
     query_string: str,
     credential_store: CredentialStore
 ) -> Response:
@@ -89,22 +490,127 @@ def forward_request(
         path: URL path after the service base URL
         method: HTTP method (GET, POST, etc.)
         headers: Request headers
-        body: Request body (if any)
+        body: Request body (if any), as bytes or a StreamingBody
         query_string: Query string from original request
         credential_store: CredentialStore instance for credential lookup
 
     Returns:
         Flask Response object with streamed upstream response
     """
-    # Get service credentials
-    cred = credential_store.get(service)
+    return to_flask_response(proxy_call(
+        service, path, method, headers, body, query_string, credential_store
+    ))
+
+
+@dataclass
+class RequestPlan:
+    """
+    A request to send upstream, as decided by plan_request().
+
+    target_url and forward_headers are before credential injection.
+    """
+    cred: ServiceCredential
+    service: str
+    path: str
+    method: str
+    query_string: str                      # After handle -> DID rewriting
+    target_url: str
+    forward_headers: dict
+    blob: Optional[str] = None             # Blob cache key for CID-addressed blobs
+    cache_key: Optional[tuple] = None      # Response cache key when the response may be cached
+    stale: Optional[CachedResponse] = None  # Stale cache entry being revalidated
+
+    def describe(self) -> str:
+        """Describe the request for logging."""
+        return f"{self.method} {self.service}/{self.path}"
+
+    def flight_key(self, body) -> Optional[tuple]:
+        """
+        Get the key identical in-flight requests share.
+
+        Returns:
+            Key from make_flight_key(), or None if the request must not be coalesced
+        """
+        if not (self.cred.coalesce and self.method in COALESCE_METHODS and not body):
+            return None
+        return make_flight_key(
+            self.service, self.cred.credential_id, self.method, self.target_url, self.forward_headers
+        )
+
+
+@dataclass
+class ResponsePlan:
+    """How to stream the final upstream response back (see UpstreamAttempts.response())."""
+    status: int
+    headers: dict
+    content_type: str
+    passthrough: bool  # Forward the body still compressed
+    writers: list      # Capture the body as it streams (each has wrap() and awrap())
+
+    def result(self, body, release: Callable) -> ProxyResult:
+        """Build the result streaming body, already wrapped by the writers."""
+        return ProxyResult(
+            status=self.status,
+            headers=self.headers,
+            body=body,
+            content_type=self.content_type,
+            release=release
+        )
+
+
+def plan_request(
+    service: str,
+    path: str,
+    method: str,
+    headers: dict,
+    body,
+    query_string: str,
+    credential_store: CredentialStore
+) -> Union[ProxyResult, RequestPlan]:
+    """
+    Decide how to answer a proxied request, short of any network or disk I/O.
+
+    Shared by proxy_call() and the asyncio engine. Blob cache lookups touch
+    the disk, so they are left to the caller.
+
+    Takes the same arguments as forward_request() (body may also be an
+    AsyncStreamingBody).
+
+    Returns:
+        ProxyResult when the request is answered without the upstream,
+        otherwise the RequestPlan to send
+    """
+    # Get service credentials (choosing the account for multi-account services)
+    cred = credential_store.get(service, request_session_id(headers))
     if cred is None:
         logger.warning(f"Unknown service requested: {service}")
-        return Response(
-            f'{{"error": "unknown service: {service}"}}',
-            status=404,
-            mimetype='application/json'
-        )
+        return error_result(404, f"unknown service: {service}")
+
+    if body is not None and not isinstance(body, bytes) and body.declared_too_large():
+        logger.warning(f"Rejected {body.len} byte body for {service}/{path}")
+        return body_too_large_result(body.max_bytes)
+
+    # Known handles: answer resolveHandle here and send DIDs upstream
+    if cred.handle_cache is not None and method in ('GET', 'HEAD'):
+        did = cred.handle_cache.cached_resolution(path, query_string)
+        if did is not None:
+            return resolved_handle_result(did)
+        query_string = cred.handle_cache.rewrite_query(query_string)
+
+    # CID-addressed blobs never change: the caller serves repeats from disk
+    blob = blob_key(cred.service_type, cred.base_url, path, query_string) if blob_cache.enabled and method in BLOB_METHODS else None
+
+    # Serve fresh cached responses without touching the upstream
+    cache_key = None
+    stale = None
+    if blob is None and response_cache.enabled and cred.cache_policy.enabled and is_cacheable_request(method, headers):
+        cache_key = make_cache_key(service, cred.credential_id, method, path, query_string, headers)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Cache hit {method} {service}/{path}")
+            return cached_result(cached, headers)
+        if cred.cache_policy.revalidate:
+            stale = response_cache.get_stale(cache_key)
 
     # Build target URL
     base_url = cred.base_url.rstrip('/')
@@ -115,52 +621,481 @@ def forward_request(
     # Filter and prepare headers
     forward_headers = filter_request_headers(headers)
 
-    # Inject authentication
-    forward_headers, target_url = cred.inject_auth(forward_headers, target_url)
+    # Revalidate a stale entry instead of re-downloading it
+    if stale is not None:
+        forward_headers.update(stale.conditional_headers())
 
-    logger.info(f"Proxying {method} {service}/{path}")
+    return RequestPlan(
+        cred=cred,
+        service=service,
+        path=path,
+        method=method,
+        query_string=query_string,
+        target_url=target_url,
+        forward_headers=forward_headers,
+        blob=blob,
+        cache_key=cache_key,
+        stale=stale
+    )
 
-    try:
-        # Make upstream request with streaming
-        upstream_resp = requests.request(
-            method=method,
-            url=target_url,
-            headers=forward_headers,
-            data=body,
-            stream=True,
-            timeout=60
-        )
 
-        # Stream response back
-        response_headers = filter_response_headers(dict(upstream_resp.headers))
+def buffers_for_replay(cred: ServiceCredential, body) -> bool:
+    """
+    Check whether a streamed upload should be read into memory before sending.
+
+    ATProto requests are replayed once if the upstream rejects the access
+    token, so small uploads are buffered where they can be sent again.
+    """
+    return (
+        cred.service_type == "atproto" and body is not None and not isinstance(body, bytes)
+        and 0 < body.len <= REPLAY_BODY_MAX_BYTES
+    )
+
 
-        return Response(
-            stream_with_context(upstream_resp.iter_content(chunk_size=8192)),
-            status=upstream_resp.status_code,
-            headers=response_headers,
-            content_type=upstream_resp.headers.get('Content-Type', 'application/octet-stream')
-        )
+class UpstreamAttempts:
+    """
+    Routing, pacing, retry and token-replay decisions for one upstream request.
+
+    The engines own the I/O (sending, sleeping, reading bodies) and ask this
+    object what to do around each attempt, so both behave the same.
+    authenticate() and renews_token() may block on ATProto session requests.
+    """
+
+    def __init__(self, plan: RequestPlan, body):
+        self.plan = plan
+        self.forward_headers = plan.forward_headers
+        # Public ATProto reads go straight to the AppView without credentials
+        self.public_url = plan.cred.public_read_url(plan.method, plan.target_url)
+        self.target_url = self.public_url or plan.target_url
 
-    except requests.exceptions.Timeout:
-        logger.error(f"Timeout proxying to {service}/{path}")
-        return Response(
-            '{"error": "upstream timeout"}',
-            status=504,
-            mimetype='application/json'
+        # Only idempotent requests with a buffered body are retried, and
+        # only ATProto requests are replayed after a token error
+        resendable = body is None or isinstance(body, bytes)
+        self.retryable = plan.cred.retry_policy.allows(plan.method) and resendable
+        self.replayable = plan.cred.service_type == "atproto" and resendable
+        self.deadline = time.monotonic() + plan.cred.retry_policy.deadline
+        self._body = body if isinstance(body, bytes) else None  # Names the repo of procedures
+        self.attempt = 0
+        self._started = 0.0
+
+    def authenticate(self) -> None:
+        """Inject credentials, unless the request goes to the public AppView."""
+        if not self.public_url:
+            self.forward_headers, self.target_url = self.plan.cred.inject_auth(
+                self.forward_headers, self.plan.target_url, self._body
+            )
+
+    def admit(self) -> Union[float, ProxyResult]:
+        """
+        Pass the circuit breaker and claim rate-limit budget for the next attempt.
+
+        Returns:
+            Seconds to wait before sending, or the result to answer with
+        """
+        plan = self.plan
+        # Fail fast while the service's circuit is open (before spending
+        # rate-limit budget on a request that won't be sent)
+        try:
+            plan.cred.breaker.allow()
+        except CircuitOpen as e:
+            logger.warning(f"Circuit open for {plan.service}; failing fast {plan.method} {plan.path}")
+            return circuit_open_result(e.retry_after)
+
+        # Pace against the credential's learned rate limit
+        try:
+            delay = plan.cred.rate_governor.reserve(plan.path)
+        except RateBudgetExhausted as e:
+            plan.cred.breaker.record(None)
+            logger.warning(f"Rate limit budget exhausted for {plan.service}; rejecting {plan.method} {plan.path}")
+            return rate_limited_result(e.retry_after)
+        if delay > 0:
+            logger.info(f"Pacing {plan.describe()} by {delay:.2f}s")
+        return delay
+
+    def sending(self, note: str = '') -> float:
+        """
+        Start an attempt.
+
+        Args:
+            note: Appended to the log line (e.g. the engine)
+
+        Returns:
+            Timeout for the attempt, bounded by the retry deadline
+        """
+        self.attempt += 1
+        self._started = time.monotonic()
+        logger.info(
+            f"Proxying {self.plan.describe()}{note}"
+            + (f" (attempt {self.attempt})" if self.attempt > 1 else "")
         )
+        return max(0.1, min(UPSTREAM_TIMEOUT, self.deadline - self._started))
+
+    def hedges(self, body) -> bool:
+        """Check whether the attempt should be hedged."""
+        return self.plan.cred.hedger.applies(self.plan.method, self.plan.path, body)
+
+    def admit_hedge(self) -> bool:
+        """Claim rate-limit budget for a hedge, if it can go right away."""
+        return self.plan.cred.rate_governor.try_reserve(self.plan.path)
+
+    def upload_aborted(self, error: BodyTooLarge, max_bytes: int) -> ProxyResult:
+        """Answer an upload that went over the size limit while streaming."""
+        self.plan.cred.breaker.record(None)
+        logger.warning(f"Aborted upload to {self.plan.service}/{self.plan.path}: {error}")
+        return body_too_large_result(max_bytes)
+
+    def timed_out(self) -> Union[float, ProxyResult]:
+        """
+        Handle an attempt that timed out.
+
+        Returns:
+            Seconds to wait before retrying, or the result to answer with
+        """
+        self.plan.cred.breaker.record(True, time.monotonic() - self._started)
+        target = f"{self.plan.service}/{self.plan.path}"
+        delay = self._next_delay()
+        if delay is not None:
+            logger.warning(f"Timeout proxying to {target}; retrying in {delay:.2f}s")
+            return delay
+        logger.error(f"Timeout proxying to {target}")
+        return error_result(504, "upstream timeout")
+
+    def connection_failed(self, error: Exception) -> Union[float, ProxyResult]:
+        """Handle an attempt that could not connect (see timed_out())."""
+        self.plan.cred.breaker.record(True, time.monotonic() - self._started)
+        target = f"{self.plan.service}/{self.plan.path}"
+        delay = self._next_delay()
+        if delay is not None:
+            logger.warning(f"Connection error proxying to {target}; retrying in {delay:.2f}s")
+            return delay
+        logger.error(f"Connection error proxying to {target}: {error}")
+        return error_result(502, "upstream connection failed")
+
+    def errored(self, error: Exception) -> ProxyResult:
+        """Answer an attempt that failed unexpectedly."""
+        self.plan.cred.breaker.record(None)
+        logger.error(f"Error proxying to {self.plan.service}/{self.plan.path}: {error}")
+        return error_result(500, f"proxy error: {str(error)}")
+
+    def cancelled(self) -> None:
+        """Note an attempt abandoned because the client went away."""
+        self.plan.cred.breaker.record(None)  # Frees any half-open probe slot
+
+    def responded(self, status: int, headers) -> bool:
+        """
+        Record an upstream response.
+
+        Returns:
+            True if the AppView refused a public read; the caller closes the
+            response, calls authenticate() and sends again
+        """
+        plan = self.plan
+        plan.cred.breaker.record(is_failure_status(status), time.monotonic() - self._started)
+
+        # The AppView refused an unauthenticated read: send it authenticated
+        if self.public_url and status in APPVIEW_REFUSED_STATUSES:
+            logger.info(f"AppView refused {plan.service}/{plan.path} ({status}); sending authenticated")
+            plan.cred.router.refused(plan.path)
+            self.public_url = None
+            return True
+
+        # The AppView's limits are per client IP, not the credential's
+        if not self.public_url:
+            plan.cred.rate_governor.update(status, headers, plan.path)
+        return False
+
+    def retry_delay(self, status: int, headers) -> Optional[float]:
+        """
+        Get how long to wait before retrying a response, if it should be retried.
+        """
+        if not self.retryable or status not in self.plan.cred.retry_policy.statuses:
+            return None
+        delay = self._next_delay(retry_after_seconds(headers))
+        if delay is not None:
+            logger.warning(
+                f"Upstream {status} for {self.plan.service}/{self.plan.path}; "
+                f"retrying in {delay:.2f}s"
+            )
+        return delay
+
+    def _next_delay(self, retry_after: Optional[float] = None) -> Optional[float]:
+        if not self.retryable:
+            return None
+        return self.plan.cred.retry_policy.next_delay(self.attempt, self.deadline, retry_after)
+
+    def checks_token(self, status: int, headers) -> bool:
+        """
+        Check whether to read the body for an ExpiredToken/InvalidToken error.
+
+        Token rejected before its expected expiry (e.g. after a PDS
+        restart): the session is renewed and the request replayed, once per
+        request. The caller reads at most TOKEN_ERROR_MAX_BYTES with
+        peek_body() and passes them to renews_token().
+        """
+        if not self.replayable or not may_be_token_error(self.plan.cred, status, headers):
+            return False
+        self.replayable = False
+        return True
 
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"Connection error proxying to {service}/{path}: {e}")
-        return Response(
-            '{"error": "upstream connection failed"}',
-            status=502,
-            mimetype='application/json'
+    def renews_token(self, status: int, read: bytes) -> bool:
+        """
+        Renew the session if the body read is a token error.
+
+        Returns:
+            True if the request should be replayed with the renewed token
+        """
+        if len(read) > TOKEN_ERROR_MAX_BYTES or not is_token_error(status, read):
+            return False
+        token = self.plan.cred.reauthenticate(bearer_token(self.forward_headers))
+        if not token:
+            return False
+        logger.warning(f"Access token rejected for {self.plan.service}/{self.plan.path}; replaying with renewed session")
+        self.forward_headers = {**self.forward_headers, 'Authorization': f'Bearer {token}'}
+        return True
+
+    def revalidated(self, status: int, headers) -> Optional[ProxyResult]:
+        """
+        Answer a 304 to a revalidation from the stored body.
+
+        Returns:
+            The revalidated result, or None if the response is not one
+        """
+        plan = self.plan
+        if plan.stale is None or status != 304:
+            return None
+        ttl = response_ttl(plan.cred.cache_policy, plan.path, plan.stale.status, headers)
+        response_cache.refresh(plan.cache_key, plan.stale, ttl)
+        logger.info(f"Revalidated {plan.describe()}")
+        return cached_result(plan.stale, self.forward_headers, 'REVALIDATED')
+
+    def response(self, status: int, headers, decoded: bool) -> ResponsePlan:
+        """
+        Decide how to stream the final upstream response back.
+
+        Args:
+            status: Upstream status code
+            headers: Upstream response headers
+            decoded: The body was partly read already, so is only available decoded
+        """
+        plan = self.plan
+        cred = plan.cred
+        content_type = headers.get('Content-Type', 'application/octet-stream')
+
+        # Stream response back, still compressed if the client can decode it
+        passthrough = not decoded and client_accepts_compressed(self.forward_headers, headers)
+        response_headers = filter_response_headers(dict(headers), passthrough)
+        writers = []
+
+        # Capture cacheable responses as they stream to the client
+        if plan.cache_key is not None:
+            ttl = response_ttl(cred.cache_policy, plan.path, status, headers)
+            if may_store(cred.cache_policy, status, headers, ttl):
+                writers.append(CacheWriter(
+                    response_cache, plan.cache_key, status,
+                    dict(response_headers), ttl, cred.cache_policy.max_entry_bytes
+                ))
+            response_headers['X-Proxy-Cache'] = 'MISS'
+
+        # Store complete blobs on disk as they stream to the client
+        if plan.blob is not None and plan.method == 'GET' and status == 200 and not passthrough:
+            writers.append(blob_cache.writer(plan.blob, content_type))
+            response_headers['X-Proxy-Cache'] = 'MISS'
+
+        # Learn handle -> DID mappings from the profile views being returned
+        if learns_handles(cred, plan.method, status, headers):
+            encoding = response_encoding(headers) if passthrough else None
+            writers.append(cred.handle_cache.watcher(plan.path, plan.query_string, encoding))
+
+        return ResponsePlan(status, response_headers, content_type, passthrough, writers)
+
+
+def proxy_call(
+    service: str,
+    path: str,
+    method: str,
+    headers: dict,
+    body: Optional[Union[bytes, StreamingBody]],
+    query_string: str,
+    credential_store: CredentialStore
+) -> ProxyResult:
+    """
+    Forward a request upstream and return the framework-independent result.
+
+    Takes the same arguments as forward_request().
+    """
+    plan = plan_request(service, path, method, headers, body, query_string, credential_store)
+    if isinstance(plan, ProxyResult):
+        return plan
+
+    # CID-addressed blobs never change: serve repeats from the disk cache
+    if plan.blob is not None:
+        entry = blob_cache.get(plan.blob)
+        if entry is not None:
+            logger.info(f"Blob cache hit {plan.describe()}")
+            return blob_result(entry)
+
+    def fetch() -> ProxyResult:
+        return send_upstream(plan, body)
+
+    # Share one upstream call between identical in-flight requests
+    key = plan.flight_key(body)
+    if key is not None:
+        return coalesced_call(key, fetch, plan.describe())
+
+    return fetch()
+
+
+def send_upstream(plan: RequestPlan, body: Optional[Union[bytes, StreamingBody]]) -> ProxyResult:
+    """
+    Send one request upstream with credentials injected, retrying
+    idempotent requests according to the service's retry policy.
+
+    Args:
+        plan: Request from plan_request()
+        body: Request body (if any)
+
+    Returns:
+        ProxyResult streaming the upstream body, or an error result
+    """
+    cred = plan.cred
+    if buffers_for_replay(cred, body):
+        try:
+            body = b''.join(body)
+        except BodyTooLarge as e:
+            logger.warning(f"Aborted upload to {plan.service}/{plan.path}: {e}")
+            return body_too_large_result(body.max_bytes)
+
+    attempts = UpstreamAttempts(plan, body)
+    attempts.authenticate()
+    peeked = None  # Upstream body, partly read to check for a token error
+
+    while True:
+        admitted = attempts.admit()
+        if isinstance(admitted, ProxyResult):
+            return admitted
+        if admitted > 0:
+            time.sleep(admitted)
+        timeout = attempts.sending()
+
+        def send() -> requests.Response:
+            # Make upstream request with streaming over the service's pooled session
+            return cred.pool.request(
+                method=plan.method,
+                url=attempts.target_url,
+                headers=attempts.forward_headers,
+                data=body,
+                stream=True,
+                timeout=timeout
+            )
+
+        try:
+            if attempts.hedges(body):
+                upstream_resp = cred.hedger.run(send, lambda resp: resp.close(), attempts.admit_hedge)
+            else:
+                upstream_resp = send()
+
+        except BodyTooLarge as e:
+            return attempts.upload_aborted(e, body.max_bytes)
+
+        except requests.exceptions.Timeout:
+            outcome = attempts.timed_out()
+            if isinstance(outcome, ProxyResult):
+                return outcome
+            time.sleep(outcome)
+            continue
+
+        except requests.exceptions.ConnectionError as e:
+            outcome = attempts.connection_failed(e)
+            if isinstance(outcome, ProxyResult):
+                return outcome
+            time.sleep(outcome)
+            continue
+
+        except Exception as e:
+            return attempts.errored(e)
+
+        status = upstream_resp.status_code
+        try:
+            if attempts.responded(status, upstream_resp.headers):
+                upstream_resp.close()
+                attempts.authenticate()
+                continue
+
+            retry_delay = attempts.retry_delay(status, upstream_resp.headers)
+            if retry_delay is not None:
+                upstream_resp.close()
+                time.sleep(retry_delay)
+                continue
+
+            if attempts.checks_token(status, upstream_resp.headers):
+                read, peeked = peek_body(upstream_resp.iter_content(chunk_size=8192), TOKEN_ERROR_MAX_BYTES)
+                if attempts.renews_token(status, read):
+                    upstream_resp.close()
+                    peeked = None
+                    continue
+        except BaseException:
+            upstream_resp.close()
+            raise
+
+        break
+
+    # Unchanged upstream: answer from the stored body
+    revalidated = attempts.revalidated(status, upstream_resp.headers)
+    if revalidated is not None:
+        upstream_resp.close()
+        return revalidated
+
+    response = attempts.response(status, upstream_resp.headers, decoded=peeked is not None)
+    response_body = stream_upstream(upstream_resp, decode=not response.passthrough, body=peeked)
+    for writer in response.writers:
+        response_body = writer.wrap(response_body)
+    return response.result(response_body, release=upstream_resp.close)
+
+
+def coalesced_call(key: tuple, fetch, description: str) -> ProxyResult:
+    """
+    Run fetch() once for all identical in-flight requests.
+
+    The first caller runs fetch() itself and streams the body inline,
+    sharing each chunk; later callers stream their copy from the flight.
+
+    Args:
+        key: Flight key from RequestPlan.flight_key()
+        fetch: Callable performing the upstream request
+        description: Request description for logging
+
+    Returns:
+        ProxyResult streaming this caller's copy of the body
+    """
+    flight, reader_id, leader = coalescer.join(key)
+    if leader:
+        try:
+            result = fetch()
+        except BaseException as e:
+            coalescer.fail(key, flight, e)
+            raise
+        result.body = coalescer.lead(
+            key, flight, result.status, dict(result.headers), result.content_type,
+            result.body, result.release
         )
+        # Leaving early hands the upstream to the followers instead of closing it
+        result.release = getattr(result.body, 'close', None)
+        return result
+
+    logger.info(f"Coalesced {description} onto in-flight request")
 
+    reader = flight.read(reader_id)
+    try:
+        flight.wait_started()
     except Exception as e:
-        logger.error(f"Error proxying to {service}/{path}: {e}")
-        return Response(
-            f'{{"error": "proxy error: {str(e)}"}}',
-            status=500,
-            mimetype='application/json'
-        )
+        reader.close()
+        logger.error(f"Error proxying {description}: {e}")
+        return error_result(500, f"proxy error: {str(e)}")
+
+    return ProxyResult(
+        status=flight.status,
+        headers=dict(flight.headers),
+        body=reader,
+        content_type=flight.content_type,
+        release=reader.close
+    )
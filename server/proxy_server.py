@@ -10,18 +10,26 @@ Provides:
 All file operations use temporary directories with automatic cleanup.
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+import asyncio
 import subprocess
 import os
+import json
 import logging
 from datetime import datetime
 import tempfile
 import shutil
+from typing import Optional, Union
 
 # Local modules
-from sessions import SessionStore
+from sessions import Session, SessionStore
+from accounts import UnknownAccount
 from credentials import CredentialStore
-from proxy import forward_request
+from batch import BatchError, parse_batch, run_batch
+from pagination import PaginationError, paginated_call, split_pagination
+from resolve import RESOLVE_PATH, ResolveError, parse_resolve_request, resolve_call
+from firehose import SUBSCRIBE_PATH, EventFilter, Firehose, FilterError, FirehoseFull, Subscription, sse_stream
+from proxy import StreamingBody, async_coalescer, blob_cache, coalescer, forward_request, response_cache, to_flask_response
 
 # Load .env file if it exists
 try:
@@ -62,6 +70,7 @@ else:
 # Initialize session and credential stores
 session_store = SessionStore()
 credential_store = CredentialStore()
+credential_store.start_token_refresher()
 
 logger.info(f"Loaded {len(credential_store.list_services())} service(s) from credential store")
 
@@ -99,10 +108,24 @@ def health():
         'mode': 'credential-proxy',
         'timestamp': datetime.now().isoformat(),
         'services': credential_store.list_services(),
+        'circuits': credential_store.circuit_states(),
         'active_sessions': session_store.count()
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Per-service upstream statistics (connection pool reuse, cache hits, etc.)"""
+    return jsonify({
+        'timestamp': datetime.now().isoformat(),
+        'services': credential_store.stats(),
+        'cache': response_cache.stats(),
+        'blob_cache': blob_cache.stats(),
+        'coalescing': coalescer.stats(),
+        'async_coalescing': async_coalescer.stats()
+    })
+
+
 # =============================================================================
 # Session Management Endpoints
 # =============================================================================
@@ -112,12 +135,16 @@ def create_session():
     """
     Create a new session granting access to specified services.
 
-    Input: {"services": ["bsky", "github", "git"], "ttl_minutes": 30}
+    Input: {"services": ["bsky", "github", "git"], "ttl_minutes": 30,
+            "accounts": {"bsky": "alice.bsky.social"}}  (accounts optional)
     Output: {"session_id": "...", "proxy_url": "...", "expires_in_minutes": 30, "services": [...]}
+
+    "accounts" pins the session to one account of a multi-account service.
     """
     data = request.json or {}
     services = data.get('services', [])
     ttl_minutes = data.get('ttl_minutes', 30)
+    accounts = data.get('accounts') or {}
 
     if not services:
         return jsonify({'error': 'services list is required'}), 400
@@ -134,8 +161,19 @@ def create_session():
             'available': sorted(available)
         }), 400
 
+    if not isinstance(accounts, dict) or set(accounts) - set(services):
+        return jsonify({'error': 'accounts must map requested services to account identifiers'}), 400
+
     session = session_store.create(services, ttl_minutes)
 
+    for service, identifier in accounts.items():
+        try:
+            credential_store.pin_account(service, session.session_id, str(identifier))
+        except UnknownAccount as e:
+            session_store.revoke(session.session_id)
+            credential_store.unpin_session(session.session_id)
+            return jsonify({'error': f'{service}: {e}'}), 400
+
     # Build proxy URL from request host
     scheme = 'https' if request.is_secure else 'http'
     proxy_url = f"{scheme}://{request.host}"
@@ -153,6 +191,7 @@ def create_session():
 @app.route('/sessions/<session_id>', methods=['DELETE'])
 def revoke_session(session_id: str):
     """Revoke a session."""
+    credential_store.unpin_session(session_id)
     if session_store.revoke(session_id):
         logger.info(f"Revoked session {session_id[:8]}...")
         return jsonify({'status': 'revoked'})
@@ -173,46 +212,222 @@ def list_services():
 # Transparent Proxy Endpoint
 # =============================================================================
 
-@app.route('/proxy/<service>/<path:rest>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'])
-def proxy_request(service: str, rest: str):
+def check_proxy_access(service: str, session_id: Optional[str]) -> Optional[tuple[dict, int]]:
     """
-    Transparent proxy to upstream service.
+    Check that a session may proxy requests to a service.
 
-    Requires valid X-Session-Id header with access to the service.
-    Forwards request with credentials injected based on service config.
+    Shared by the Flask and asyncio engines so both enforce the same rules.
+
+    Args:
+        service: Requested service name
+        session_id: Value of the X-Session-Id header (may be None)
+
+    Returns:
+        None if access is allowed, otherwise (error body, HTTP status)
     """
     # Reject 'git' as a proxy service (it's not an upstream API)
     if service == 'git':
-        return jsonify({
-            'error': 'git is not a proxy service',
-            'hint': 'Use /git/fetch-bundle or /git/push-bundle for git operations'
-        }), 400
+        return check_service_access(None, service)
 
-    session_id = request.headers.get('X-Session-Id')
+    session, denied = check_session(session_id)
+    if denied:
+        return denied
+
+    return check_service_access(session, service)
+
+
+def check_session(session_id: Optional[str]) -> tuple[Optional[Session], Optional[tuple[dict, int]]]:
+    """
+    Look up the session behind an X-Session-Id header.
+
+    Returns:
+        Tuple of (session, None) if valid, otherwise (None, (error body, HTTP status))
+    """
     if not session_id:
-        return jsonify({'error': 'missing X-Session-Id header'}), 401
+        return None, ({'error': 'missing X-Session-Id header'}, 401)
 
     session = session_store.get(session_id)
     if session is None:
-        return jsonify({'error': 'invalid or expired session'}), 401
+        return None, ({'error': 'invalid or expired session'}, 401)
+
+    return session, None
+
+
+def check_service_access(session: Optional[Session], service: str) -> Optional[tuple[dict, int]]:
+    """
+    Check that an already validated session may proxy to a service.
+
+    Returns:
+        None if access is allowed, otherwise (error body, HTTP status)
+    """
+    if service == 'git':
+        return {
+            'error': 'git is not a proxy service',
+            'hint': 'Use /git/fetch-bundle or /git/push-bundle for git operations'
+        }, 400
 
     if not session.has_service(service):
-        return jsonify({
+        return {
             'error': f'session does not have access to {service}',
             'session_services': session.services
-        }), 403
+        }, 403
+
+    return None
+
+
+def open_subscription(
+    service: str,
+    query_string: str,
+    loop: Optional[asyncio.AbstractEventLoop] = None
+) -> tuple[Optional[Firehose], Optional[Subscription], Optional[tuple[dict, int]]]:
+    """
+    Subscribe to a service's Jetstream events using the filter in a query string.
+
+    Shared by the Flask and asyncio engines.
+
+    Args:
+        service: Requested service name
+        query_string: Query string with collections/dids/keywords filters
+        loop: Event loop of an asyncio subscriber (None for a thread)
+
+    Returns:
+        (firehose, subscription, None) if subscribed, otherwise
+        (None, None, (error body, HTTP status))
+    """
+    hub = credential_store.firehose(service)
+    if hub is None:
+        return None, None, ({'error': f'{service} has no Jetstream subscription'}, 404)
+
+    try:
+        event_filter = EventFilter.from_query(query_string)
+    except FilterError as e:
+        return None, None, ({'error': str(e)}, 400)
+
+    try:
+        subscription = hub.subscribe(event_filter, loop)
+    except FirehoseFull as e:
+        return None, None, ({'error': str(e)}, 503)
+
+    logger.info(f"Jetstream subscriber for {service}: {event_filter.describe()}")
+    return hub, subscription, None
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def proxy_request_body() -> Optional[Union[bytes, StreamingBody]]:
+    """
+    Wrap the incoming request body for streaming to the upstream.
+
+    Returns:
+        None for methods without a body, b'' for an empty body,
+        otherwise a StreamingBody over the WSGI input stream
+    """
+    if request.method not in ['POST', 'PUT', 'PATCH']:
+        return None
+
+    chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+    if not request.content_length and not chunked:
+        return b''
+
+    return StreamingBody(request.stream, request.content_length)
+
+
+@app.route('/proxy/<service>/<path:rest>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'])
+def proxy_request(service: str, rest: str):
+    """
+    Transparent proxy to upstream service.
+
+    Requires valid X-Session-Id header with access to the service.
+    Forwards request with credentials injected based on service config.
+    """
+    denied = check_proxy_access(service, request.headers.get('X-Session-Id'))
+    if denied:
+        error, status = denied
+        return jsonify(error), status
+
+    query_string = request.query_string.decode()
+
+    # /proxy/<service>/_subscribe: filtered Jetstream events as Server-Sent Events
+    if rest == SUBSCRIBE_PATH and request.method == 'GET':
+        hub, subscription, error = open_subscription(service, query_string)
+        if error:
+            body, status = error
+            return jsonify(body), status
+        return Response(sse_stream(hub, subscription), content_type='text/event-stream', headers=SSE_HEADERS)
+
+    # /proxy/<service>/_resolve: bulk handle -> DID resolution
+    if rest == RESOLVE_PATH:
+        try:
+            payload = request.get_json(silent=True) if request.method == 'POST' else None
+            handles = parse_resolve_request(query_string, payload)
+        except ResolveError as e:
+            return jsonify({'error': str(e)}), 400
+        return to_flask_response(resolve_call(service, handles, dict(request.headers), credential_store))
+
+    # ?_paginate=all: follow the upstream's pagination and aggregate the pages
+    if request.method == 'GET':
+        try:
+            pagination, query_string = split_pagination(query_string)
+        except PaginationError as e:
+            return jsonify({'error': str(e)}), 400
+        if pagination is not None:
+            return to_flask_response(paginated_call(
+                service, rest, dict(request.headers), query_string, pagination, credential_store
+            ))
 
     return forward_request(
         service=service,
         path=rest,
         method=request.method,
         headers=dict(request.headers),
-        body=request.get_data() if request.method in ['POST', 'PUT', 'PATCH'] else None,
-        query_string=request.query_string.decode(),
+        body=proxy_request_body(),
+        query_string=query_string,
         credential_store=credential_store
     )
 
 
+@app.route('/proxy/batch', methods=['POST'])
+def proxy_batch():
+    """
+    Run many proxied sub-requests concurrently under one session.
+
+    Input: {"requests": [{"service": "bsky", "method": "GET", "path": "...",
+            "query": {...}, "headers": {...}, "body": ...}], "max_parallel": 8}
+    Output: {"results": [{"index": 0, "status": 200, "headers": {...}, "body": ...}]}
+
+    With "stream": true or Accept: application/x-ndjson, results are streamed
+    as NDJSON lines in completion order instead.
+    """
+    session, denied = check_session(request.headers.get('X-Session-Id'))
+    if denied:
+        error, status = denied
+        return jsonify(error), status
+
+    try:
+        payload = request.get_json(silent=True)
+        items, parallel = parse_batch(payload)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Sub-requests are attributed to the session (e.g. for account pinning)
+    for item in items:
+        item.headers['X-Session-Id'] = session.session_id
+
+    logger.info(f"Batch of {len(items)} request(s), parallelism {parallel}")
+    results = run_batch(
+        items, parallel, credential_store,
+        lambda service: check_service_access(session, service)
+    )
+
+    stream = payload.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', '')
+    if stream:
+        lines = (json.dumps(result) + '\n' for result in results)
+        return Response(stream_with_context(lines), content_type='application/x-ndjson')
+
+    return jsonify({'results': sorted(results, key=lambda result: result['index'])})
+
+
 # =============================================================================
 # Git Bundle Endpoints
 # =============================================================================
@@ -0,0 +1,296 @@
+"""
+Upstream Rate Governor for Credential Proxy
+
+Learns each credential's rate-limit budget from upstream response headers
+and paces outgoing requests so the proxy runs out of budget gracefully
+instead of collecting hard 429/403 errors.
+
+Understood headers:
+- GitHub: X-RateLimit-Limit / X-RateLimit-Remaining / X-RateLimit-Reset (epoch seconds)
+- ATProto: RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset (epoch or delta seconds)
+- Retry-After on 429/403 responses
+
+GitHub keeps separate budgets per resource (core, search, graphql, ...) and
+names the one a response counted against in X-RateLimit-Resource. Budgets
+are kept per resource, and each request is charged to the resource its
+route last reported, so an exhausted search budget never holds core calls.
+Services that don't report a resource use one default budget.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Reset values below this are delta-seconds rather than a Unix timestamp
+EPOCH_THRESHOLD = 1_000_000_000
+
+# Budget for responses without X-RateLimit-Resource (GitHub's name for its main budget)
+DEFAULT_RESOURCE = 'core'
+
+# Routes remembered per governor (oldest are forgotten first)
+MAX_ROUTES = 1024
+
+
+class RateBudgetExhausted(Exception):
+    """Raised when a request would have to wait longer than the governor allows."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limit budget exhausted, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class RateLimitConfig:
+    """Rate governor settings for a single service."""
+    enabled: bool = True
+    reserve: int = 0             # Requests kept back from the learned budget
+    pace_below: float = 0.1      # Spread requests out once under this fraction of the limit
+    max_wait: float = 30.0       # Longest a request may be held before answering 429
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'RateLimitConfig':
+        """
+        Build governor settings from a service's "rate_limit" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            RateLimitConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            enabled=bool(config.get("enabled", defaults.enabled)),
+            reserve=int(config.get("reserve", defaults.reserve)),
+            pace_below=float(config.get("pace_below", defaults.pace_below)),
+            max_wait=float(config.get("max_wait", defaults.max_wait)),
+        )
+
+
+def _header(headers, *names: str) -> Optional[str]:
+    """Get the first present header among names (case-insensitive)."""
+    lowered = {k.lower(): v for k, v in headers.items()}
+    for name in names:
+        if name in lowered:
+            return lowered[name]
+    return None
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    """Parse a numeric header value, ignoring trailing parameters."""
+    if value is None:
+        return None
+    try:
+        return float(value.split(',')[0].split(';')[0].strip())
+    except ValueError:
+        return None
+
+
+def route_of(path: str) -> str:
+    """
+    Get the route a request path is charged under.
+
+    The first two path segments group requests that share a rate-limit
+    resource (e.g. "search/issues", "repos/owner", "graphql"); an XRPC
+    method is a single segment.
+    """
+    return '/'.join(path.strip('/').split('/')[:2])
+
+
+class _Budget:
+    """Learned budget for one rate-limit resource."""
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None  # Unix time the window resets
+        self.blocked_until = 0.0               # From Retry-After
+        self.next_slot = 0.0                   # Earliest send time while pacing
+
+    def stats(self, now: float) -> dict:
+        """Get this budget's limit, remaining, reset_in and blocked_for."""
+        return {
+            'limit': self.limit,
+            'remaining': self.remaining,
+            'reset_in': round(self.reset_at - now, 1) if self.reset_at else None,
+            'blocked_for': round(max(0.0, self.blocked_until - now), 1),
+        }
+
+
+class RateGovernor:
+    """
+    Thread-safe request budget for one credential.
+
+    reserve() is called before each upstream request and returns how long
+    to wait first; update() is called with every upstream response. Both
+    take the request path, which picks the resource budget. Until the
+    upstream reports a limit, requests pass straight through.
+    """
+
+    def __init__(self, config: Optional[RateLimitConfig] = None):
+        self.config = config or RateLimitConfig()
+        self._lock = threading.Lock()
+        self._budgets: dict[str, _Budget] = {DEFAULT_RESOURCE: _Budget()}
+        self._routes: dict[str, str] = {}  # route -> resource it last reported
+
+        self._requests = 0
+        self._delayed = 0
+        self._rejected = 0
+        self._wait_seconds = 0.0
+
+    def _budget(self, path: str) -> _Budget:
+        """Get the budget a request path is charged to (caller holds the lock)."""
+        resource = self._routes.get(route_of(path), DEFAULT_RESOURCE)
+        return self._budgets.setdefault(resource, _Budget())
+
+    def reserve(self, path: str = '') -> float:
+        """
+        Claim budget for one upstream request.
+
+        Args:
+            path: Request path after the service base URL
+
+        Returns:
+            Seconds the caller must wait before sending
+
+        Raises:
+            RateBudgetExhausted if the wait would exceed max_wait
+        """
+        delay = self._reserve(path, self.config.max_wait)
+        if isinstance(delay, RateBudgetExhausted):
+            with self._lock:
+                self._rejected += 1
+            raise delay
+        return delay
+
+    def try_reserve(self, path: str = '') -> bool:
+        """
+        Claim budget for an optional request (e.g. a hedge) only if it can
+        be sent right away.
+
+        Args:
+            path: Request path after the service base URL
+
+        Returns:
+            True if budget was claimed, False if the request should be skipped
+        """
+        return self._reserve(path, 0.0) == 0.0
+
+    def _reserve(self, path: str, max_wait: float) -> Union[float, RateBudgetExhausted]:
+        """
+        Claim budget if the wait is at most max_wait.
+
+        Returns:
+            Seconds to wait, or (without claiming anything) the
+            RateBudgetExhausted to raise
+        """
+        if not self.config.enabled:
+            return 0.0
+
+        with self._lock:
+            now = time.time()
+            self._requests += 1
+            budget = self._budget(path)
+            delay = max(0.0, budget.blocked_until - now)
+            next_slot = None
+
+            if budget.remaining is not None and budget.reset_at is not None:
+                if now >= budget.reset_at:
+                    # Window rolled over; assume a full budget until told otherwise
+                    budget.remaining = budget.limit
+                    budget.reset_at = None
+                else:
+                    available = budget.remaining - self.config.reserve
+                    if available <= 0:
+                        delay = max(delay, budget.reset_at - now)
+                    elif budget.limit and available < budget.limit * self.config.pace_below:
+                        # Spread what is left evenly over the rest of the window
+                        interval = (budget.reset_at - now) / available
+                        slot = max(now, budget.next_slot)
+                        next_slot = slot + interval
+                        delay = max(delay, slot - now)
+
+            if delay > max_wait:
+                return RateBudgetExhausted(delay)
+            if next_slot is not None:
+                budget.next_slot = next_slot
+
+            if budget.remaining is not None:
+                budget.remaining -= 1
+            if delay > 0:
+                self._delayed += 1
+                self._wait_seconds += delay
+            return delay
+
+    def update(self, status: int, headers, path: str = '') -> None:
+        """
+        Learn the current budget from an upstream response.
+
+        Args:
+            status: Upstream status code
+            headers: Upstream response headers
+            path: Request path after the service base URL
+        """
+        if not self.config.enabled:
+            return
+
+        limit = _number(_header(headers, 'x-ratelimit-limit', 'ratelimit-limit'))
+        remaining = _number(_header(headers, 'x-ratelimit-remaining', 'ratelimit-remaining'))
+        reset = _number(_header(headers, 'x-ratelimit-reset', 'ratelimit-reset'))
+        retry_after = _number(_header(headers, 'retry-after'))
+        resource = _header(headers, 'x-ratelimit-resource') or DEFAULT_RESOURCE
+
+        with self._lock:
+            now = time.time()
+            route = route_of(path)
+            if self._routes.get(route) != resource:
+                if route not in self._routes and len(self._routes) >= MAX_ROUTES:
+                    self._routes.pop(next(iter(self._routes)))
+                self._routes[route] = resource
+            budget = self._budgets.setdefault(resource, _Budget())
+
+            if limit is not None:
+                budget.limit = int(limit)
+            if remaining is not None:
+                budget.remaining = int(remaining)
+            if reset is not None:
+                budget.reset_at = reset if reset >= EPOCH_THRESHOLD else now + reset
+
+            # 403 only counts as a rate limit when the upstream says so
+            blocked_until = None
+            if status in (403, 429):
+                if retry_after is not None:
+                    blocked_until = now + retry_after
+                elif remaining == 0 and budget.reset_at is not None:
+                    blocked_until = budget.reset_at
+            if blocked_until is not None and blocked_until > budget.blocked_until:
+                budget.blocked_until = blocked_until
+                logger.warning(
+                    f"Upstream rate limited (status {status}); "
+                    f"holding {resource} requests for {blocked_until - now:.0f}s"
+                )
+
+    def stats(self) -> dict:
+        """
+        Get the learned budgets and pacing counters.
+
+        Returns:
+            Dict with the default resource's limit, remaining, reset_in and
+            blocked_for, each resource's budget under "resources", and
+            request/delay counters
+        """
+        with self._lock:
+            now = time.time()
+            return {
+                **self._budgets[DEFAULT_RESOURCE].stats(now),
+                'resources': {name: budget.stats(now) for name, budget in self._budgets.items()},
+                'requests': self._requests,
+                'delayed': self._delayed,
+                'rejected': self._rejected,
+                'wait_seconds': round(self._wait_seconds, 3),
+            }
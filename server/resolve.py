@@ -0,0 +1,155 @@
+"""
+Bulk Handle Resolution for Credential Proxy
+
+Resolves many ATProto handles to DIDs in one call:
+
+    GET  /proxy/bsky/_resolve?handles=alice.bsky.social,bob.bsky.social
+    POST /proxy/bsky/_resolve  {"handles": ["alice.bsky.social", "bob.bsky.social"]}
+
+    -> {"dids": {"alice.bsky.social": "did:plc:...", "bob.bsky.social": null},
+        "cached": 1, "resolved": 0}
+
+Handles in the service's handle cache (see identity.py) are answered
+immediately. The rest are looked up concurrently with
+com.atproto.identity.resolveHandle through proxy_call(), so rate limiting,
+retries and circuit breakers apply, and each answer fills the cache.
+Handles that are invalid or cannot be resolved map to null.
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from credentials import CredentialStore
+from identity import RESOLVE_HANDLE, normalize_handle
+from proxy import ProxyResult, error_result, proxy_call, read_result_body, request_session_id
+
+logger = logging.getLogger(__name__)
+
+RESOLVE_PATH = '_resolve'
+MAX_RESOLVE_HANDLES = 500
+MAX_RESOLVE_PARALLEL = 8
+MAX_RESOLUTION_BYTES = 64 * 1024
+
+
+class ResolveError(ValueError):
+    """Raised for a malformed _resolve request."""
+
+
+def parse_resolve_request(query_string: str, payload: Any = None) -> list[str]:
+    """
+    Get the handles to resolve from a _resolve request.
+
+    Handles come from "handle"/"handles" query parameters (comma-separated
+    lists allowed) and from a JSON body's "handles" array.
+
+    Args:
+        query_string: Raw query string from the client
+        payload: Decoded JSON body, if any
+
+    Returns:
+        Handles in request order, without duplicates
+
+    Raises:
+        ResolveError if no handles are given, too many are given, or the
+        body is malformed
+    """
+    handles = []
+    for key, value in parse_qsl(query_string):
+        if key in ('handle', 'handles'):
+            handles.extend(h for h in value.split(',') if h.strip())
+
+    if payload is not None:
+        listed = payload.get('handles') if isinstance(payload, dict) else None
+        if not isinstance(listed, list) or not all(isinstance(h, str) for h in listed):
+            raise ResolveError('body must be {"handles": [...]} with string handles')
+        handles.extend(listed)
+
+    handles = list(dict.fromkeys(h.strip() for h in handles))
+    if not handles:
+        raise ResolveError('no handles given')
+    if len(handles) > MAX_RESOLVE_HANDLES:
+        raise ResolveError(f'at most {MAX_RESOLVE_HANDLES} handles per call')
+    return handles
+
+
+def resolve_handle(
+    service: str,
+    handle: str,
+    session_id: Optional[str],
+    credential_store: CredentialStore
+) -> Optional[str]:
+    """
+    Look up one handle with com.atproto.identity.resolveHandle.
+
+    Returns:
+        The DID, or None if the upstream could not resolve it
+    """
+    headers = {'X-Session-Id': session_id} if session_id else {}
+    result = proxy_call(
+        service, RESOLVE_HANDLE, 'GET', headers, None,
+        urlencode({'handle': handle}), credential_store
+    )
+    body = read_result_body(result.body, MAX_RESOLUTION_BYTES)
+    if result.status != 200 or body is None:
+        return None
+    try:
+        did = json.loads(body).get('did')
+    except (ValueError, AttributeError):
+        return None
+    return did if isinstance(did, str) else None
+
+
+def resolve_call(
+    service: str,
+    handles: list[str],
+    headers: dict,
+    credential_store: CredentialStore
+) -> ProxyResult:
+    """
+    Resolve handles for a service, from cache where possible.
+
+    Args:
+        service: ATProto service name
+        handles: Handles from parse_resolve_request()
+        headers: Client request headers (for the session's account)
+        credential_store: CredentialStore instance for credential lookup
+
+    Returns:
+        ProxyResult with the {"dids": ...} body
+    """
+    cred = credential_store.primary(service)
+    if cred is None:
+        return error_result(404, f"unknown service: {service}")
+    if cred.handle_cache is None:
+        return error_result(400, f"{service} does not cache handles (ATProto services with cache_handles only)")
+
+    dids: dict[str, Optional[str]] = {}
+    misses: dict[str, str] = {}  # requested -> normalized
+    for requested in handles:
+        handle = normalize_handle(requested)
+        did = cred.handle_cache.get(handle) if handle else None
+        dids[requested] = did
+        if handle and did is None:
+            misses[requested] = handle
+    cached = sum(1 for did in dids.values() if did is not None)
+
+    if misses:
+        session_id = request_session_id(headers)
+        with ThreadPoolExecutor(max_workers=min(MAX_RESOLVE_PARALLEL, len(misses)), thread_name_prefix='resolve') as executor:
+            lookups = {
+                requested: executor.submit(resolve_handle, service, handle, session_id, credential_store)
+                for requested, handle in misses.items()
+            }
+            for requested, future in lookups.items():
+                dids[requested] = future.result()
+
+    resolved = sum(1 for did in dids.values() if did is not None) - cached
+    logger.info(f"Resolved {len(handles)} handle(s) for {service}: {cached} cached, {resolved} looked up")
+    return ProxyResult(
+        status=200,
+        headers={'Content-Type': 'application/json'},
+        body=json.dumps({'dids': dids, 'cached': cached, 'resolved': resolved}).encode()
+    )
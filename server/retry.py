@@ -0,0 +1,100 @@
+"""
+Retry Policies for Credential Proxy
+
+Per-service retries for idempotent proxied requests: exponential backoff
+with full jitter, retryable status codes, Retry-After, and a total deadline
+that no attempt or backoff may exceed.
+"""
+
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+DEFAULT_RETRY_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+DEFAULT_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP date).
+
+    Args:
+        headers: Response headers
+
+    Returns:
+        Seconds to wait, or None if absent or unparseable
+    """
+    value = next((v for k, v in headers.items() if k.lower() == 'retry-after'), None)
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    """Retry settings for a single service."""
+    max_attempts: int = 3          # Total attempts including the first (1 disables retries)
+    backoff_base: float = 0.25     # Backoff before the first retry, doubled each time
+    backoff_max: float = 5.0       # Cap on a single backoff
+    deadline: float = 60.0         # Total seconds for all attempts and backoffs
+    methods: frozenset = field(default_factory=lambda: DEFAULT_RETRY_METHODS)
+    statuses: frozenset = field(default_factory=lambda: DEFAULT_RETRY_STATUSES)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'RetryPolicy':
+        """
+        Build a retry policy from a service's "retry" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            RetryPolicy with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            max_attempts=max(1, int(config.get("max_attempts", defaults.max_attempts))),
+            backoff_base=float(config.get("backoff_base", defaults.backoff_base)),
+            backoff_max=float(config.get("backoff_max", defaults.backoff_max)),
+            deadline=float(config.get("deadline", defaults.deadline)),
+            methods=frozenset(m.upper() for m in config.get("methods", defaults.methods)),
+            statuses=frozenset(int(s) for s in config.get("statuses", defaults.statuses)),
+        )
+
+    def allows(self, method: str) -> bool:
+        """Check whether requests with this method may be retried."""
+        return self.max_attempts > 1 and method.upper() in self.methods
+
+    def next_delay(self, attempt: int, deadline: float, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Decide whether to retry after a failed attempt.
+
+        Args:
+            attempt: Number of attempts made so far
+            deadline: time.monotonic() value all attempts must finish by
+            retry_after: Delay requested by the upstream, if any
+
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            # Full jitter keeps concurrent retries from synchronizing
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
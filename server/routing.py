@@ -0,0 +1,195 @@
+"""
+XRPC Routing for Credential Proxy
+
+Decides where an ATProto service's XRPC calls are sent:
+
+- appview:  listed read-only methods go straight to the public AppView,
+            without credentials, instead of being proxied through the PDS
+            (saving a hop and the account's PDS rate limit); opt-in
+            with public_reads
+- pds:      calls on the account's own repo go to its resolved PDS
+            (see identity.py); calls naming another repo stay on the
+            entryway, which knows where that repo lives
+- entryway: everything else goes to the service's base_url as before
+
+If the AppView refuses an unauthenticated read (401/403), the request is
+sent again through the authenticated path, and that method keeps going the
+authenticated way for refusal_ttl seconds.
+
+Most app.bsky.* views carry viewer state: profiles, feeds, threads and
+search results say whether the account follows, mutes or blocks an actor
+and whether it liked or reposted a post, and the AppView hides muted and
+blocked content from the viewer. Answered without credentials, those reads
+silently lose that. The default public_methods therefore only lists calls
+whose answer is the same for every viewer; listing other methods trades
+viewer state for the shorter path.
+"""
+
+import fnmatch
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import parse_qsl
+
+APPVIEW = 'appview'
+PDS = 'pds'
+ENTRYWAY = 'entryway'
+APPVIEW_FALLBACK = 'appview_fallback'
+
+DEFAULT_APPVIEW_URL = "https://public.api.bsky.app/xrpc"
+
+# XRPC methods served by the account's own PDS rather than the AppView
+PDS_ROUTED_PREFIXES = (
+    "com.atproto.repo.",
+    "com.atproto.sync.",
+    "app.bsky.actor.getPreferences",
+    "app.bsky.actor.putPreferences",
+)
+
+# PDS methods that take no repo parameter and act on the session's own account
+SESSION_SCOPED_METHODS = {
+    "com.atproto.repo.uploadBlob",
+    "com.atproto.repo.importRepo",
+    "com.atproto.repo.listMissingBlobs",
+    "app.bsky.actor.getPreferences",
+    "app.bsky.actor.putPreferences",
+}
+
+# Query parameters naming the repo a PDS method acts on
+REPO_PARAMS = ("repo", "did")
+
+# Reads whose responses don't depend on the viewer (fnmatch patterns)
+DEFAULT_PUBLIC_METHODS = [
+    "com.atproto.identity.resolveHandle",
+]
+
+PUBLIC_HTTP_METHODS = {'GET', 'HEAD'}
+
+# Statuses from the AppView that send the read back through the authenticated path
+APPVIEW_REFUSED_STATUSES = {401, 403}
+
+
+def call_repo(query_string: str, body: Optional[bytes] = None) -> Optional[str]:
+    """
+    Get the repo (DID or handle) an XRPC call acts on.
+
+    Args:
+        query_string: Query string of the call
+        body: Buffered JSON body of a procedure, if any
+
+    Returns:
+        The repo/did query parameter or the body's "repo" field, or None
+    """
+    params = dict(parse_qsl(query_string))
+    for name in REPO_PARAMS:
+        if params.get(name):
+            return params[name]
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if isinstance(data, dict) and isinstance(data.get("repo"), str):
+            return data["repo"]
+    return None
+
+
+@dataclass
+class RoutingConfig:
+    """XRPC routing settings for a single ATProto service."""
+    public_reads: bool = False   # Send public reads straight to the AppView
+    appview_url: str = DEFAULT_APPVIEW_URL
+    public_methods: list[str] = field(default_factory=lambda: list(DEFAULT_PUBLIC_METHODS))
+    refusal_ttl: float = 300.0   # Seconds a method the AppView refused stays authenticated
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> 'RoutingConfig':
+        """
+        Build routing settings from a service's "routing" config block.
+
+        Args:
+            config: Dict from credentials.json (may be None)
+
+        Returns:
+            RoutingConfig with defaults for any missing keys
+        """
+        config = config or {}
+        defaults = cls()
+        return cls(
+            public_reads=bool(config.get("public_reads", defaults.public_reads)),
+            appview_url=str(config.get("appview_url", defaults.appview_url)).rstrip("/"),
+            public_methods=list(config.get("public_methods", defaults.public_methods)),
+            refusal_ttl=float(config.get("refusal_ttl", defaults.refusal_ttl)),
+        )
+
+
+class XrpcRouter:
+    """
+    Routing table and per-route request counts for one ATProto service.
+    """
+
+    def __init__(self, config: Optional[RoutingConfig] = None):
+        self.config = config or RoutingConfig()
+        self._lock = threading.Lock()
+        self._counts = {APPVIEW: 0, PDS: 0, ENTRYWAY: 0, APPVIEW_FALLBACK: 0}
+        self._refused: dict[str, float] = {}  # nsid -> time the refusal expires
+
+    def is_public_read(self, http_method: str, nsid: str) -> bool:
+        """Check whether a call can be answered by the AppView without credentials."""
+        if not self.config.public_reads or http_method.upper() not in PUBLIC_HTTP_METHODS:
+            return False
+        if not any(fnmatch.fnmatch(nsid, pattern) for pattern in self.config.public_methods):
+            return False
+        with self._lock:
+            until = self._refused.get(nsid)
+            if until is None:
+                return True
+            if time.monotonic() < until:
+                return False
+            del self._refused[nsid]
+            return True
+
+    def refused(self, nsid: str) -> None:
+        """
+        Record that the AppView refused an unauthenticated call.
+
+        The method is sent authenticated for refusal_ttl seconds instead of
+        paying for a refused round trip on every call.
+        """
+        with self._lock:
+            self._counts[APPVIEW_FALLBACK] += 1
+            self._refused[nsid] = time.monotonic() + self.config.refusal_ttl
+
+    @staticmethod
+    def is_pds_method(nsid: str) -> bool:
+        """Check whether a call is served by a PDS (for the repo it names)."""
+        return nsid.startswith(PDS_ROUTED_PREFIXES)
+
+    @staticmethod
+    def is_session_scoped(nsid: str) -> bool:
+        """Check whether a PDS call without a repo parameter acts on the session's account."""
+        return nsid in SESSION_SCOPED_METHODS
+
+    def record(self, route: str) -> None:
+        """Count one request sent along a route."""
+        with self._lock:
+            self._counts[route] += 1
+
+    def stats(self) -> dict:
+        """
+        Get routing counters.
+
+        Returns:
+            Dict with the AppView URL, request counts per route and the
+            methods currently sent authenticated after a refusal
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'public_reads': self.config.public_reads,
+                'appview_url': self.config.appview_url,
+                **self._counts,
+                'refused_methods': sorted(nsid for nsid, until in self._refused.items() if until > now),
+            }
@@ -0,0 +1,134 @@
+"""
+Persistent ATProto Session Cache for Credential Proxy
+
+Keeps ATProto sessions (access/refresh JWTs, DID, handle, expiry) in an
+encrypted file so a restarted proxy reuses its refresh token instead of
+calling createSession, which is slow and tightly rate-limited.
+
+The file is shared by every proxy process. Renewals run under an exclusive
+flock on a sidecar lock file, and each process re-reads the file under that
+lock before renewing. So only one process logs in, and nobody reuses a
+refresh token another process has already rotated.
+
+Contents are encrypted with Fernet (from the optional "cryptography"
+package). The key is derived from PROXY_SESSION_CACHE_KEY, or from
+PROXY_SECRET_KEY if that is unset. Without cryptography or a key, sessions
+are not persisted.
+"""
+
+import base64
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Iterator, Optional
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None  # Sessions stay in memory only
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILENAME = ".atproto_sessions"
+
+
+class SessionCache:
+    """
+    Encrypted on-disk store of ATProto sessions keyed by credential id.
+    """
+
+    def __init__(self, path: str, secret: str):
+        self.path = path
+        self._lock_path = f"{path}.lock"
+        key = hashlib.sha256(f"atproto-session-cache:{secret}".encode()).digest()
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the cross-process renewal lock."""
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # Closing the descriptor releases the flock
+
+    def _read_all(self) -> dict:
+        try:
+            with open(self.path, "rb") as f:
+                data = self._fernet.decrypt(f.read())
+            entries = json.loads(data)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (InvalidToken, ValueError) as e:
+            logger.warning(f"Ignoring unreadable session cache {self.path}: {e or 'wrong key'}")
+            return {}
+
+    def load(self, credential_id: str) -> Optional[dict]:
+        """
+        Get the stored session fields for a credential.
+
+        Args:
+            credential_id: ServiceCredential.credential_id
+
+        Returns:
+            Session fields as stored by save(), or None
+        """
+        entry = self._read_all().get(credential_id)
+        return entry if isinstance(entry, dict) else None
+
+    def save(self, credential_id: str, session: Optional[dict]) -> None:
+        """
+        Store (or with None, drop) the session for a credential.
+
+        Callers should hold locked() so concurrent writers don't lose updates.
+        """
+        entries = self._read_all()
+        if session is None:
+            entries.pop(credential_id, None)
+        else:
+            entries[credential_id] = session
+        token = self._fernet.encrypt(json.dumps(entries).encode())
+
+        # Write-then-rename so readers never see a partial file
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".sessions-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(token)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write session cache {self.path}: {e}")
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+
+
+def create_session_cache(default_dir: str) -> Optional[SessionCache]:
+    """
+    Build the session cache from the environment.
+
+    PROXY_SESSION_CACHE overrides the file location (an empty value turns
+    persistence off).
+
+    Args:
+        default_dir: Directory for the default cache file (next to credentials.json)
+
+    Returns:
+        SessionCache, or None if persistence is off or unavailable
+    """
+    path = os.environ.get("PROXY_SESSION_CACHE", os.path.join(default_dir, DEFAULT_FILENAME))
+    if not path:
+        return None
+    if Fernet is None:
+        logger.warning("cryptography not installed; ATProto sessions will not be persisted")
+        return None
+    secret = os.environ.get("PROXY_SESSION_CACHE_KEY") or os.environ.get("PROXY_SECRET_KEY")
+    if not secret:
+        logger.warning("No PROXY_SESSION_CACHE_KEY or PROXY_SECRET_KEY; ATProto sessions will not be persisted")
+        return None
+    return SessionCache(os.path.expanduser(path), secret)
@@ -9,6 +9,9 @@ Search Bluesky posts via credential proxy.
 Usage:
     python search_posts.py <query> [limit]
 
+Limits above 100 are fetched by the proxy, which follows the search cursor
+across pages (?_paginate=all).
+
 Environment variables (from MCP create_session):
     SESSION_ID - Session ID
     PROXY_URL  - Proxy base URL
@@ -29,7 +32,7 @@ def search_posts(query: str, limit: int = 25) -> dict:
 
     Args:
         query: Search query string
-        limit: Maximum number of results (1-100)
+        limit: Maximum number of results (above 100 follows the cursor)
 
     Returns:
         API response with posts array
@@ -43,11 +46,16 @@ def search_posts(query: str, limit: int = 25) -> dict:
             "Use MCP create_session tool first."
         )
 
+    params = {"q": query, "limit": min(limit, 100)}
+    if limit > 100:
+        # Let the proxy walk the cursor and return one JSON array of posts
+        params.update({"_paginate": "all", "_max_items": limit, "_format": "json"})
+
     response = requests.get(
         f"{proxy_url}/proxy/bsky/app.bsky.feed.searchPosts",
-        params={"q": query, "limit": min(limit, 100)},
+        params=params,
         headers={"X-Session-Id": session_id},
-        timeout=30
+        timeout=120 if limit > 100 else 30
     )
 
     if response.status_code == 401:
@@ -56,7 +64,10 @@ def search_posts(query: str, limit: int = 25) -> dict:
         raise ValueError("Session does not have access to bsky service.")
 
     response.raise_for_status()
-    return response.json()
+    result = response.json()
+    if isinstance(result, list):
+        return {"posts": result}
+    return result
 
 
 def format_post(post: dict) -> str:
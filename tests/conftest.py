@@ -0,0 +1,181 @@
+"""
+Shared fixtures for the Credential Proxy tests.
+
+The server modules import each other by top-level name, so server/ is put
+on sys.path here. Upstream services are stood in for by local HTTP servers
+whose responses each test scripts with a handler function.
+"""
+
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional, Union
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server'))
+
+# No shared ATProto session file, no blob cache on disk
+os.environ['PROXY_SESSION_CACHE'] = ''
+os.environ['PROXY_BLOB_CACHE_MAX_BYTES'] = '0'
+
+
+@dataclass
+class UpstreamRequest:
+    """A request received by an Upstream."""
+    method: str
+    path: str
+    headers: dict
+    body: bytes
+
+
+# (status, headers, body); a non-bytes body is sent chunk by chunk with chunked encoding
+UpstreamResponse = tuple[int, dict, Union[bytes, Iterable[bytes]]]
+
+
+def json_response(data, status: int = 200, headers: Optional[dict] = None) -> UpstreamResponse:
+    """Build an upstream JSON response."""
+    return status, {'Content-Type': 'application/json', **(headers or {})}, json.dumps(data).encode()
+
+
+def jwt(name: str, expires_in: float = 7200) -> str:
+    """Build an unsigned JWT named name (its first segment) with an exp claim."""
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': int(time.time() + expires_in)}).encode()).decode().rstrip('=')
+    return f"{name}.{payload}.sig"
+
+
+def echo(request: UpstreamRequest) -> UpstreamResponse:
+    """Default handler: describe the request that was received."""
+    return json_response({'path': request.path, 'auth': request.headers.get('Authorization')})
+
+
+class Upstream:
+    """
+    Local HTTP server standing in for an upstream service.
+
+    handler is called for every request and returns the response; requests
+    records what was received.
+    """
+
+    def __init__(self):
+        self.handler: Callable[[UpstreamRequest], UpstreamResponse] = echo
+        self.requests: list[UpstreamRequest] = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def paths(self) -> list[str]:
+        return [r.path for r in self.requests]
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _read_body(self) -> bytes:
+                if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+                    body = b''
+                    while True:
+                        size = int(self.rfile.readline().strip(), 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return body
+                        body += self.rfile.read(size)
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def _handle(self):
+                request = UpstreamRequest(self.command, self.path, dict(self.headers), self._read_body())
+                upstream.requests.append(request)
+                status, headers, body = upstream.handler(request)
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if isinstance(body, bytes):
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    if self.command != 'HEAD':
+                        self.wfile.write(body)
+                    return
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for chunk in body:
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        self.wfile.flush()
+                    self.wfile.write(b'0\r\n\r\n')
+                except OSError:
+                    self.close_connection = True
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+
+        return Handler
+
+
+@pytest.fixture
+def start_upstream():
+    """Start Upstreams on demand; all are shut down after the test."""
+    started = []
+
+    def start() -> Upstream:
+        upstream = Upstream()
+        started.append(upstream)
+        return upstream
+
+    yield start
+    for upstream in started:
+        upstream.close()
+
+
+@pytest.fixture
+def upstream(start_upstream) -> Upstream:
+    return start_upstream()
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    """Build a CredentialStore from a credentials.json dict."""
+    from credentials import CredentialStore
+
+    stores = []
+
+    def make(config: dict) -> 'CredentialStore':
+        path = tmp_path / f"credentials-{len(stores)}.json"
+        path.write_text(json.dumps(config))
+        store = CredentialStore(str(path))
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        for _, cred in store.items():
+            cred.close()
+
+
+@pytest.fixture
+def response_cache():
+    """The shared response cache, emptied before and after the test."""
+    from proxy import response_cache
+
+    response_cache.clear()
+    yield response_cache
+    response_cache.clear()
+
@@ -0,0 +1,87 @@
+"""Tests for multi-account pools (accounts.py and account selection in the proxy)."""
+
+import json
+import time
+
+import pytest
+
+from accounts import UnknownAccount
+from conftest import json_response, jwt
+from proxy import proxy_call, read_result_body
+
+
+def pool_service(url: str, selection: str = 'sticky', **config) -> dict:
+    return {'bsky': {
+        'base_url': f'{url}/xrpc',
+        'accounts': [
+            {'identifier': 'alice.test', 'app_password': 'a'},
+            {'identifier': 'bob.test', 'app_password': 'b'},
+        ],
+        'account_selection': selection,
+        'identity': {'resolve_pds': False},
+        'cache': {'enabled': False},
+        **config,
+    }}
+
+
+def selected(store, *session_ids) -> list[str]:
+    return [store.get('bsky', session_id).identifier for session_id in session_ids]
+
+
+def test_sticky_sessions_keep_their_first_account(make_store):
+    store = make_store(pool_service('http://pds.invalid'))
+
+    assert selected(store, 's1', 's2', 's1', 's2', 's1') == ['alice.test', 'bob.test', 'alice.test', 'bob.test', 'alice.test']
+    # A third session goes to the least-used account
+    assert selected(store, 's3') == ['bob.test']
+
+
+def test_sessions_can_be_pinned_explicitly(make_store):
+    store = make_store(pool_service('http://pds.invalid'))
+    store.pin_account('bsky', 's1', 'bob.test')
+    assert selected(store, 's1', 's1') == ['bob.test', 'bob.test']
+
+    with pytest.raises(UnknownAccount):
+        store.pin_account('bsky', 's1', 'carol.test')
+
+    store.unpin_session('s1')
+    assert selected(store, 's1') == ['alice.test']
+
+
+def test_least_used_spreads_requests_and_skips_open_circuits(make_store):
+    store = make_store(pool_service('http://pds.invalid', 'least_used', circuit_breaker={'min_calls': 1}))
+    assert selected(store, 's1', 's1', 's1', 's1') == ['alice.test', 'bob.test', 'alice.test', 'bob.test']
+
+    store.get('bsky', 's1').breaker.record(True)  # alice's circuit opens
+    assert selected(store, 's1', 's1') == ['bob.test', 'bob.test']
+
+
+def test_budget_selection_prefers_the_account_with_most_rate_budget(make_store):
+    store = make_store(pool_service('http://pds.invalid', 'budget'))
+    alice, bob = (store.get('bsky') for _ in range(2))
+    reset = str(int(time.time()) + 300)
+    alice.rate_governor.update(200, {'RateLimit-Limit': '3000', 'RateLimit-Remaining': '2900', 'RateLimit-Reset': reset})
+    bob.rate_governor.update(200, {'RateLimit-Limit': '3000', 'RateLimit-Remaining': '10', 'RateLimit-Reset': reset})
+
+    assert selected(store, None, None, 's1') == ['alice.test', 'alice.test', 'alice.test']
+
+
+def test_each_account_authenticates_with_its_own_session(upstream, make_store):
+    tokens = {'alice.test': jwt('alice'), 'bob.test': jwt('bob')}
+
+    def handler(request):
+        if 'createSession' in request.path:
+            identifier = json.loads(request.body)['identifier']
+            return json_response({'accessJwt': tokens[identifier], 'refreshJwt': 'r', 'did': f'did:plc:{identifier[:-5]}', 'handle': identifier})
+        return json_response({'auth': request.headers.get('Authorization')})
+
+    upstream.handler = handler
+    store = make_store(pool_service(upstream.url))
+
+    def timeline(session_id: str) -> str:
+        result = proxy_call('bsky', 'app.bsky.feed.getTimeline', 'GET', {'X-Session-Id': session_id}, None, '', store)
+        return json.loads(read_result_body(result.body, 1024))['auth']
+
+    assert [timeline(s) for s in ('s1', 's2', 's1')] == [f"Bearer {tokens['alice.test']}", f"Bearer {tokens['bob.test']}", f"Bearer {tokens['alice.test']}"]
+    assert len([p for p in upstream.paths() if 'createSession' in p]) == 2
+    assert store.primary('bsky').identifier == 'alice.test'
@@ -0,0 +1,91 @@
+"""Tests for the batch endpoint's request handling (batch.py)."""
+
+import base64
+import threading
+import time
+
+import pytest
+
+from batch import MAX_BATCH_PARALLEL, BatchError, parse_batch, run_batch
+from conftest import echo, json_response
+
+
+def test_batch_requests_are_validated():
+    items, parallel = parse_batch({'requests': [
+        {'service': 'gh', 'path': '/repos/o/r', 'query': {'per_page': 5}},
+        {'service': 'gh', 'path': 'issues', 'method': 'post', 'body': {'title': 't'}},
+    ], 'max_parallel': 1000})
+
+    assert parallel == MAX_BATCH_PARALLEL
+    assert (items[0].path, items[0].query_string, items[0].body) == ('repos/o/r', 'per_page=5', None)
+    assert (items[1].method, items[1].body) == ('POST', b'{"title": "t"}')
+    assert items[1].headers['Content-Type'] == 'application/json'
+
+    for payload in ({}, {'requests': []}, {'requests': [{'path': 'x'}]}, {'requests': [{'service': 'gh', 'path': 'x', 'method': 'TRACE'}]}):
+        with pytest.raises(BatchError):
+            parse_batch(payload)
+
+
+def run(store, requests: list, allowed=('gh',), **options) -> list[dict]:
+    items, parallel = parse_batch({'requests': requests, **options})
+    check_access = lambda service: None if service in allowed else ({'error': 'service not allowed'}, 403)
+    return sorted(run_batch(items, parallel, store, check_access), key=lambda result: result['index'])
+
+
+@pytest.fixture
+def github(upstream, make_store):
+    return make_store({'gh': {'base_url': upstream.url, 'token': 't', 'cache': {'enabled': False}}})
+
+
+def test_results_embed_bodies_by_content_type(upstream, github):
+    def handler(request):
+        if request.path == '/text':
+            return 200, {'Content-Type': 'text/plain'}, b'plain'
+        if request.path == '/binary':
+            return 200, {'Content-Type': 'application/octet-stream'}, b'\x00\xff'
+        return echo(request)
+
+    upstream.handler = handler
+    results = run(github, [
+        {'service': 'gh', 'path': 'json'},
+        {'service': 'gh', 'path': 'text'},
+        {'service': 'gh', 'path': 'binary'},
+    ])
+
+    assert results[0]['body'] == {'path': '/json', 'auth': 'Bearer t'}
+    assert results[1]['body'] == 'plain'
+    assert (results[2]['body'], results[2]['body_encoding']) == (base64.b64encode(b'\x00\xff').decode(), 'base64')
+    assert [result['status'] for result in results] == [200, 200, 200]
+
+
+def test_denied_and_failing_items_do_not_fail_the_batch(upstream, github):
+    upstream.handler = lambda request: json_response({'message': 'Not Found'}, status=404)
+    results = run(github, [
+        {'service': 'gh', 'path': 'missing'},
+        {'service': 'other', 'path': 'anything'},
+    ])
+
+    assert (results[0]['status'], results[0]['body']) == (404, {'message': 'Not Found'})
+    assert results[1] == {'index': 1, 'status': 403, 'error': 'service not allowed'}
+    assert upstream.paths() == ['/missing']
+
+
+def test_items_run_concurrently_up_to_max_parallel(upstream, github):
+    lock = threading.Lock()
+    in_flight = peak = 0
+
+    def handler(request):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.2)
+        with lock:
+            in_flight -= 1
+        return echo(request)
+
+    upstream.handler = handler
+    results = run(github, [{'service': 'gh', 'path': f'items/{i}'} for i in range(6)], max_parallel=3)
+
+    assert [result['body']['path'] for result in results] == [f'/items/{i}' for i in range(6)]
+    assert peak == 3
@@ -0,0 +1,168 @@
+"""Tests for the blob cache (blobcache.py and its use in the proxy engines)."""
+
+import asyncio
+import base64
+import hashlib
+import os
+
+import httpx
+import pytest
+from flask import Flask
+from starlette.applications import Starlette
+from starlette.routing import Route
+
+import async_proxy
+import proxy
+from blobcache import BASE58_ALPHABET, BlobCache, cid_digest
+from conftest import json_response
+from proxy import blob_result, proxy_call, read_result_body, to_flask_response
+
+BLOB = b'\x89PNG not really an image' * 100
+
+
+def cid_v1(data: bytes, codec: int = 0x55) -> str:
+    """CIDv1 (base32) of data; 0x55 is the raw codec."""
+    raw = bytes([0x01, codec, 0x12, 0x20]) + hashlib.sha256(data).digest()
+    return 'b' + base64.b32encode(raw).decode().lower().rstrip('=')
+
+
+def cid_v0(data: bytes) -> str:
+    """Legacy CIDv0 (base58 multihash) of data."""
+    number = int.from_bytes(bytes([0x12, 0x20]) + hashlib.sha256(data).digest(), 'big')
+    encoded = ''
+    while number:
+        number, digit = divmod(number, 58)
+        encoded = BASE58_ALPHABET[digit] + encoded
+    return encoded
+
+
+def store_blob(cache: BlobCache, key: str, data: bytes, content_type: str = 'image/png') -> None:
+    writer = cache.writer(key, content_type)
+    assert b''.join(writer.wrap(iter([data[:10], data[10:]]))) == data
+
+
+def test_cid_digest_reads_v1_and_v0():
+    digest = hashlib.sha256(BLOB).digest()
+    assert cid_digest(cid_v1(BLOB)) == digest
+    assert cid_digest(cid_v1(BLOB, codec=0x71)) == digest
+    assert cid_v0(BLOB).startswith('Qm') and cid_digest(cid_v0(BLOB)) == digest
+    assert cid_digest('bafkrei') is None
+    assert cid_digest('not-a-cid') is None
+
+
+def test_blobs_are_verified_against_their_cid(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=1024 * 1024)
+    good, bad = cid_v1(BLOB), cid_v1(b'something else')
+    store_blob(cache, good, BLOB)
+    store_blob(cache, bad, BLOB)
+
+    assert open(cache.get(good).path, 'rb').read() == BLOB
+    assert cache.get(bad) is None
+    assert sorted(os.listdir(tmp_path)) == [good, f'{good}.meta']
+
+
+def test_abandoned_downloads_leave_nothing_behind(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=1024 * 1024)
+    body = cache.writer(cid_v1(BLOB), 'image/png').wrap(iter([BLOB[:10], BLOB[10:]]))
+    next(body)
+    body.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_least_recently_used_blobs_are_evicted(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=10)
+    store_blob(cache, 'a.thumb.jpeg', b'a' * 4)
+    store_blob(cache, 'b.thumb.jpeg', b'b' * 4)
+    assert cache.get('a.thumb.jpeg') is not None
+
+    store_blob(cache, 'c.thumb.jpeg', b'c' * 4)
+    assert cache.get('b.thumb.jpeg') is None
+    assert not os.path.exists(tmp_path / 'b.thumb.jpeg')
+    assert cache.stats()['bytes'] == 8 and cache.stats()['evictions'] == 1
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=1024 * 1024)
+    store_blob(cache, cid_v1(BLOB), BLOB, 'image/webp')
+    (tmp_path / '.blob-partial').write_bytes(b'left by a crash')
+
+    restarted = BlobCache(str(tmp_path), max_bytes=1024 * 1024)
+    entry = restarted.get(cid_v1(BLOB))
+    assert (entry.size, entry.content_type) == (len(BLOB), 'image/webp')
+    assert not os.path.exists(tmp_path / '.blob-partial')
+
+
+def test_cached_blobs_answer_range_requests_in_both_engines(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=1024 * 1024)
+    store_blob(cache, cid_v1(BLOB), BLOB)
+    entry = cache.get(cid_v1(BLOB))
+
+    app = Flask(__name__)
+    app.add_url_rule('/blob', view_func=lambda: to_flask_response(blob_result(entry)))
+    response = app.test_client().get('/blob', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == BLOB[10:20]
+    assert response.headers['X-Proxy-Cache'] == 'HIT'
+
+    async def asgi_get():
+        starlette = Starlette(routes=[Route('/blob', lambda request: async_proxy.to_starlette_response(blob_result(entry)))])
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=starlette), base_url='http://proxy') as client:
+            return await client.get('/blob', headers={'Range': 'bytes=10-19'})
+
+    response = asyncio.run(asgi_get())
+    assert response.status_code == 206
+    assert response.content == BLOB[10:20]
+
+
+@pytest.fixture
+def blob_cache(tmp_path, monkeypatch) -> BlobCache:
+    """A blob cache in tmp_path used by both engines."""
+    cache = BlobCache(str(tmp_path / 'blobs'), max_bytes=1024 * 1024)
+    monkeypatch.setattr(proxy, 'blob_cache', cache)
+    monkeypatch.setattr(async_proxy, 'blob_cache', cache)
+    return cache
+
+
+def pds(blobs: dict):
+    """Handler for a PDS serving the given {cid: bytes} blobs."""
+    def handler(request):
+        if 'createSession' in request.path:
+            return json_response({'accessJwt': 'x.e30.y', 'refreshJwt': 'r', 'did': 'did:plc:abc', 'handle': 'me.test'})
+        cid = request.path.rsplit('cid=', 1)[-1]
+        return 200, {'Content-Type': 'image/png'}, blobs[cid]
+
+    return handler
+
+
+def bsky_service(url: str) -> dict:
+    return {'bsky': {
+        'base_url': f'{url}/xrpc',
+        'identifier': 'me.test',
+        'app_password': 'app-password',
+        'identity': {'resolve_pds': False},
+    }}
+
+
+def get_blob(store, cid: str):
+    result = proxy_call('bsky', 'com.atproto.sync.getBlob', 'GET', {}, None, f'did=did:plc:abc&cid={cid}', store)
+    return result.headers.get('X-Proxy-Cache'), read_result_body(result.body, 1024 * 1024)
+
+
+def test_repeat_blob_fetches_are_served_from_disk(upstream, make_store, blob_cache):
+    cid = cid_v1(BLOB)
+    upstream.handler = pds({cid: BLOB})
+    store = make_store(bsky_service(upstream.url))
+
+    assert get_blob(store, cid) == ('MISS', BLOB)
+    assert get_blob(store, cid) == ('HIT', BLOB)
+    assert len([p for p in upstream.paths() if 'getBlob' in p]) == 1
+
+
+def test_tampered_blobs_are_not_cached(upstream, make_store, blob_cache):
+    cid = cid_v1(BLOB)
+    upstream.handler = pds({cid: b'tampered'})
+    store = make_store(bsky_service(upstream.url))
+
+    assert get_blob(store, cid) == ('MISS', b'tampered')
+    assert get_blob(store, cid) == ('MISS', b'tampered')
+    assert blob_cache.stats()['blobs'] == 0
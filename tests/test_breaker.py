@@ -0,0 +1,172 @@
+"""Tests for circuit breaker transitions (breaker.py and its use in the proxy engines)."""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import breaker
+from async_proxy import proxy_call_async
+from breaker import CLOSED, HALF_OPEN, OPEN, BreakerConfig, CircuitBreaker, CircuitOpen, is_failure_status
+from conftest import json_response
+from proxy import proxy_call, read_result_body
+
+
+class Clock:
+    """Manually advanced stand-in for time.monotonic()."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(breaker, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def tripped(config: BreakerConfig) -> CircuitBreaker:
+    """A breaker that has just opened."""
+    circuit = CircuitBreaker(config)
+    for _ in range(config.min_calls):
+        circuit.allow()
+        circuit.record(True)
+    assert circuit.state == OPEN
+    return circuit
+
+
+def test_stays_closed_until_min_calls():
+    circuit = CircuitBreaker(BreakerConfig(min_calls=4))
+    for _ in range(3):
+        circuit.allow()
+        circuit.record(True)
+    assert circuit.state == CLOSED
+    assert circuit.stats()['failure_rate'] == 1.0
+
+
+def test_opens_at_the_failure_rate(clock):
+    circuit = CircuitBreaker(BreakerConfig(min_calls=4, failure_rate=0.5, open_seconds=30))
+    for failed in (False, False, True):
+        circuit.record(failed)
+    assert circuit.state == CLOSED
+
+    circuit.record(True)
+    assert circuit.state == OPEN
+    clock.now += 10
+    with pytest.raises(CircuitOpen) as excinfo:
+        circuit.allow()
+    assert excinfo.value.retry_after == pytest.approx(20)
+    assert circuit.stats()['rejected'] == 1
+
+
+def test_opens_on_slow_calls():
+    circuit = CircuitBreaker(BreakerConfig(min_calls=2, slow_call_seconds=1.0, slow_call_rate=1.0))
+    circuit.record(False, duration=1.5)
+    circuit.record(False, duration=2.0)
+    assert circuit.state == OPEN
+
+
+def test_rate_limiting_is_not_an_upstream_failure():
+    assert not is_failure_status(429)
+    assert not is_failure_status(404)
+    assert is_failure_status(500) and is_failure_status(503)
+
+
+def test_half_open_limits_probes_and_closes_after_successes(clock):
+    circuit = tripped(BreakerConfig(min_calls=2, open_seconds=30, half_open_probes=2))
+    clock.now += 30
+
+    circuit.allow()
+    assert circuit.state == HALF_OPEN
+    circuit.allow()
+    with pytest.raises(CircuitOpen):
+        circuit.allow()
+
+    circuit.record(False)
+    assert circuit.state == HALF_OPEN
+    circuit.record(False)
+    assert circuit.state == CLOSED
+    assert circuit.stats()['recent_calls'] == 0
+
+
+def test_failed_probe_reopens(clock):
+    circuit = tripped(BreakerConfig(min_calls=2, open_seconds=30))
+    clock.now += 30
+
+    circuit.allow()
+    circuit.record(True)
+    assert circuit.state == OPEN
+    assert circuit.stats()['times_opened'] == 2
+    with pytest.raises(CircuitOpen):
+        circuit.allow()
+
+
+def test_neutral_outcome_frees_a_probe_slot(clock):
+    circuit = tripped(BreakerConfig(min_calls=2, open_seconds=30, half_open_probes=1))
+    clock.now += 30
+
+    circuit.allow()
+    circuit.record(None)
+    assert circuit.state == HALF_OPEN
+    circuit.allow()
+    circuit.record(False)
+    assert circuit.state == CLOSED
+
+
+def test_disabled_breaker_never_opens():
+    circuit = CircuitBreaker(BreakerConfig(enabled=False, min_calls=1))
+    for _ in range(5):
+        circuit.allow()
+        circuit.record(True)
+    assert circuit.state == CLOSED
+
+
+def test_open_circuit_fails_fast_without_contacting_upstream(upstream, make_store):
+    upstream.handler = lambda request: json_response({'error': 'down'}, status=500)
+    store = make_store({'flaky': {
+        'base_url': upstream.url,
+        'token': 't',
+        'cache': {'enabled': False},
+        'retry': {'max_attempts': 1},
+        'circuit_breaker': {'min_calls': 2, 'open_seconds': 60},
+    }})
+
+    for _ in range(2):
+        result = proxy_call('flaky', 'items', 'GET', {}, None, '', store)
+        read_result_body(result.body, 1024)
+        assert result.status == 500
+
+    result = proxy_call('flaky', 'items', 'GET', {}, None, '', store)
+    assert result.status == 503
+    assert 0 < int(result.headers['Retry-After']) <= 60
+    assert len(upstream.requests) == 2
+    assert store.get('flaky').stats()['circuit']['state'] == OPEN
+
+
+def test_cancelling_during_pacing_frees_the_probe_slot(upstream, make_store, monkeypatch):
+    store = make_store({'flaky': {
+        'base_url': upstream.url,
+        'token': 't',
+        'circuit_breaker': {'min_calls': 1, 'open_seconds': 0.01, 'half_open_probes': 1},
+    }})
+    cred = store.get('flaky')
+    cred.breaker.record(True)
+    time.sleep(0.02)
+    monkeypatch.setattr(cred.rate_governor, 'reserve', lambda path='': 5.0)
+
+    async def main():
+        task = asyncio.create_task(proxy_call_async('flaky', 'items', 'GET', {}, None, '', store))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert cred.breaker.state == HALF_OPEN
+    cred.breaker.allow()
+    assert upstream.requests == []
@@ -0,0 +1,219 @@
+"""Tests for the response cache (cache.py and its use in the proxy engines)."""
+
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from async_proxy import proxy_call_async
+from cache import (
+    CachedResponse,
+    CachePolicy,
+    CacheRule,
+    CacheWriter,
+    ResponseCache,
+    is_cacheable_request,
+    make_cache_key,
+    response_ttl,
+    upstream_ttl,
+)
+from conftest import json_response
+from proxy import proxy_call, read_result_body
+
+
+def entry(body: bytes, ttl: float = 60, etag: str = None) -> CachedResponse:
+    now = time.time()
+    return CachedResponse(status=200, headers={}, body=body, stored_at=now, expires_at=now + ttl, etag=etag)
+
+
+def test_upstream_ttl_follows_cache_control_then_expires():
+    assert upstream_ttl({'Cache-Control': 'public, max-age=60'}) == 60
+    assert upstream_ttl({'Cache-Control': 'max-age=60, s-maxage=10'}) == 10
+    assert upstream_ttl({'Cache-Control': 'private, no-cache, max-age=60'}) == 0
+    assert upstream_ttl({'Expires': formatdate(time.time() + 120, usegmt=True)}) == pytest.approx(120, abs=2)
+    assert upstream_ttl({'Expires': '0'}) == 0
+    assert upstream_ttl({}) is None
+
+
+def test_rules_override_upstream_headers_and_default_ttl_fills_in():
+    policy = CachePolicy(default_ttl=5, rules=[CacheRule(pattern='repos/*/releases', ttl=300)])
+    assert response_ttl(policy, 'repos/x/releases', 200, {'Cache-Control': 'max-age=1'}) == 300
+    assert response_ttl(policy, 'repos/x', 200, {'Cache-Control': 'max-age=1'}) == 1
+    assert response_ttl(policy, 'repos/x', 200, {}) == 5
+    assert response_ttl(policy, 'repos/x', 404, {}) == 0
+    assert response_ttl(CachePolicy(enabled=False), 'repos/x', 200, {'Cache-Control': 'max-age=60'}) == 0
+
+
+def test_cache_key_normalizes_query_order_and_varies_on_accept():
+    key = make_cache_key('svc', 'cred', 'get', '/items/', 'b=2&a=1', {'Accept': 'application/json'})
+    assert key == make_cache_key('svc', 'cred', 'GET', 'items', 'a=1&b=2', {'accept': 'application/json'})
+    assert key != make_cache_key('svc', 'cred', 'GET', 'items', 'a=1&b=2', {'Accept': 'text/html'})
+    assert key != make_cache_key('svc', 'other', 'GET', 'items', 'a=1&b=2', {'Accept': 'application/json'})
+
+
+def test_conditional_and_non_get_requests_bypass_the_cache():
+    assert is_cacheable_request('GET', {'Accept': '*/*'})
+    assert not is_cacheable_request('POST', {})
+    assert not is_cacheable_request('GET', {'If-None-Match': '"x"'})
+    assert not is_cacheable_request('GET', {'Range': 'bytes=0-1'})
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = ResponseCache(max_bytes=10)
+    cache.put(('svc', 'a'), entry(b'aaaa'))
+    cache.put(('svc', 'b'), entry(b'bbbb'))
+    assert cache.get(('svc', 'a')) is not None
+
+    cache.put(('svc', 'c'), entry(b'cccc'))
+    assert cache.get(('svc', 'b')) is None
+    assert cache.get(('svc', 'a')) is not None
+    assert not cache.put(('svc', 'd'), entry(b'd' * 11))
+
+    stats = cache.stats()
+    assert stats['entries'] == 2 and stats['bytes'] == 8 and stats['evictions'] == 1
+
+
+def test_stale_entries_are_kept_only_with_validators():
+    cache = ResponseCache(max_bytes=100)
+    cache.put(('svc', 'plain'), entry(b'x', ttl=-1))
+    cache.put(('svc', 'tagged'), entry(b'x', ttl=-1, etag='"v1"'))
+
+    assert cache.get(('svc', 'plain')) is None
+    assert cache.get(('svc', 'tagged')) is None
+    assert cache.get_stale(('svc', 'plain')) is None
+    assert cache.get_stale(('svc', 'tagged')).conditional_headers() == {'If-None-Match': '"v1"'}
+    assert cache.stats()['entries'] == 1
+
+
+def test_writer_skips_bodies_over_the_entry_limit():
+    cache = ResponseCache(max_bytes=100)
+    small = CacheWriter(cache, ('svc', 'small'), 200, {}, 60, max_entry_bytes=4)
+    assert b''.join(small.wrap(iter([b'ab', b'cd']))) == b'abcd'
+    big = CacheWriter(cache, ('svc', 'big'), 200, {}, 60, max_entry_bytes=4)
+    assert b''.join(big.wrap(iter([b'ab', b'cde']))) == b'abcde'
+
+    assert cache.get(('svc', 'small')).body == b'abcd'
+    assert cache.get(('svc', 'big')) is None
+
+
+def cached_service(url: str, name: str = 'svc', **cache) -> dict:
+    return {name: {'base_url': url, 'token': 't', 'cache': cache}}
+
+
+def fetch(store, query: str = '', service: str = 'svc', headers: dict = None):
+    headers = {'Accept': 'application/json', **(headers or {})}
+    result = proxy_call(service, 'items', 'GET', headers, None, query, store)
+    return result.status, result.headers.get('X-Proxy-Cache'), read_result_body(result.body, 1024)
+
+
+def test_fresh_responses_are_served_from_the_cache(upstream, make_store, response_cache):
+    upstream.handler = lambda request: json_response({'n': len(upstream.requests)}, headers={'Cache-Control': 'max-age=60'})
+    store = make_store(cached_service(upstream.url))
+
+    assert fetch(store, 'a=1&b=2') == (200, 'MISS', b'{"n": 1}')
+    assert fetch(store, 'b=2&a=1') == (200, 'HIT', b'{"n": 1}')
+    assert fetch(store, 'a=2') == (200, 'MISS', b'{"n": 2}')
+    assert len(upstream.requests) == 2
+    assert response_cache.stats()['services']['svc']['hits'] == 1
+
+
+def test_no_store_responses_are_not_cached(upstream, make_store, response_cache):
+    upstream.handler = lambda request: json_response({}, headers={'Cache-Control': 'no-store, max-age=60'})
+    store = make_store(cached_service(upstream.url, default_ttl=60))
+
+    assert fetch(store)[1] == 'MISS'
+    assert fetch(store)[1] == 'MISS'
+    assert len(upstream.requests) == 2
+
+
+def test_default_ttl_applies_without_freshness_headers(upstream, make_store, response_cache):
+    store = make_store(cached_service(upstream.url, default_ttl=60))
+
+    fetch(store)
+    assert fetch(store)[1] == 'HIT'
+    assert len(upstream.requests) == 1
+
+
+def versioned(versions: dict):
+    """Handler serving the current version, answering 304 to a matching If-None-Match."""
+    def handler(request):
+        etag = f'"{versions["current"]}"'
+        if request.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return json_response({'version': versions['current']}, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+    return handler
+
+
+def test_stale_responses_are_revalidated_with_their_etag(upstream, make_store, response_cache):
+    versions = {'current': 'v1'}
+    upstream.handler = versioned(versions)
+    store = make_store(cached_service(upstream.url, revalidate=True))
+
+    assert fetch(store) == (200, 'MISS', b'{"version": "v1"}')
+    assert fetch(store) == (200, 'REVALIDATED', b'{"version": "v1"}')
+    assert upstream.requests[1].headers['If-None-Match'] == '"v1"'
+
+    versions['current'] = 'v2'
+    assert fetch(store) == (200, 'MISS', b'{"version": "v2"}')
+    assert fetch(store) == (200, 'REVALIDATED', b'{"version": "v2"}')
+    assert upstream.requests[3].headers['If-None-Match'] == '"v2"'
+    assert response_cache.stats()['services']['svc']['revalidated'] == 2
+
+
+def test_last_modified_is_sent_as_if_modified_since(upstream, make_store, response_cache):
+    stamp = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    upstream.handler = lambda request: (
+        (304, {}, b'') if request.headers.get('If-Modified-Since') == stamp
+        else json_response({}, headers={'Last-Modified': stamp, 'Cache-Control': 'max-age=0'})
+    )
+    store = make_store(cached_service(upstream.url, revalidate=True))
+
+    fetch(store)
+    assert fetch(store)[1] == 'REVALIDATED'
+
+
+def test_github_revalidates_by_default(upstream, make_store, response_cache):
+    upstream.handler = versioned({'current': 'v1'})
+    store = make_store(cached_service(upstream.url, name='github_api'))
+
+    fetch(store, service='github_api')
+    assert fetch(store, service='github_api')[1] == 'REVALIDATED'
+
+
+def test_without_revalidation_stale_responses_are_refetched(upstream, make_store, response_cache):
+    upstream.handler = versioned({'current': 'v1'})
+    store = make_store(cached_service(upstream.url))
+
+    fetch(store)
+    assert fetch(store)[1] == 'MISS'
+    assert 'If-None-Match' not in upstream.requests[1].headers
+
+
+def test_client_conditional_requests_pass_through(upstream, make_store, response_cache):
+    upstream.handler = versioned({'current': 'v1'})
+    store = make_store(cached_service(upstream.url, revalidate=True))
+
+    fetch(store)
+    status, cache_status, body = fetch(store, headers={'If-None-Match': '"v1"'})
+    assert (status, cache_status, body) == (304, None, b'')
+    assert upstream.requests[1].headers['If-None-Match'] == '"v1"'
+
+
+def test_async_engine_revalidates_the_same_way(upstream, make_store, response_cache):
+    upstream.handler = versioned({'current': 'v1'})
+    store = make_store(cached_service(upstream.url, revalidate=True))
+
+    async def fetch_async():
+        result = await proxy_call_async('svc', 'items', 'GET', {}, None, '', store)
+        if isinstance(result.body, bytes):
+            return result.headers.get('X-Proxy-Cache'), result.body
+        return result.headers.get('X-Proxy-Cache'), b''.join([chunk async for chunk in result.body])
+
+    async def main():
+        first, second = await fetch_async(), await fetch_async()
+        await store.primary('svc').aclose()
+        return first, second
+
+    assert asyncio.run(main()) == (('MISS', b'{"version": "v1"}'), ('REVALIDATED', b'{"version": "v1"}'))
@@ -0,0 +1,225 @@
+"""Tests for request coalescing (coalesce.py and its use in the proxy engines)."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_proxy import proxy_call_async
+from coalesce import AsyncCoalescer, Coalescer, FlightAborted, make_flight_key
+from proxy import async_coalescer, coalescer, proxy_call, read_result_body
+
+CHUNKS = [b'%04d' % i for i in range(50)]
+BODY = b''.join(CHUNKS)
+
+
+def chunks(closed: list):
+    try:
+        yield from CHUNKS
+    finally:
+        closed.append('body')
+
+
+async def achunks(closed: list):
+    try:
+        for chunk in CHUNKS:
+            await asyncio.sleep(0)
+            yield chunk
+    finally:
+        closed.append('body')
+
+
+async def collect(iterator) -> bytes:
+    return b''.join([chunk async for chunk in iterator])
+
+
+def test_flight_key_ignores_tracing_headers():
+    one = make_flight_key('svc', 'cred', 'get', 'https://x/a', {'Accept': 'a', 'X-Request-Id': '1'})
+    two = make_flight_key('svc', 'cred', 'GET', 'https://x/a', {'accept': 'a', 'X-Request-Id': '2'})
+    assert one == two
+    assert one != make_flight_key('svc', 'cred', 'GET', 'https://x/a', {'Accept': 'b'})
+
+
+def test_late_joiner_replays_the_body_from_the_start():
+    c = Coalescer(max_buffer_bytes=1024)
+    flight, reader_id, leader = c.join(('svc', 'late'))
+    assert leader and reader_id is None
+    body = c.lead(('svc', 'late'), flight, 200, {}, 'text/plain', chunks([]))
+    first = [next(body), next(body)]
+
+    joined, reader_id, leader = c.join(('svc', 'late'))
+    assert joined is flight and not leader
+    reader = flight.read(reader_id)
+    follower = []
+    thread = threading.Thread(target=lambda: follower.extend(reader))
+    thread.start()
+
+    assert b''.join(first + list(body)) == BODY
+    thread.join(5)
+    assert b''.join(follower) == BODY
+    assert c.stats()['in_flight'] == 0
+
+
+def test_flight_stops_accepting_joiners_past_the_buffer():
+    c = Coalescer(max_buffer_bytes=10)
+    flight, _, _ = c.join(('svc', 'big'))
+    body = c.lead(('svc', 'big'), flight, 200, {}, 'text/plain', chunks([]))
+    for _ in range(4):
+        next(body)
+
+    _, _, leader = c.join(('svc', 'big'))
+    assert leader
+    assert c.stats()['services']['svc'] == {'upstream': 2, 'coalesced': 0}
+
+
+def test_leader_leaving_hands_the_body_to_followers():
+    c = Coalescer(max_buffer_bytes=10)
+    closed = []
+    flight, _, _ = c.join(('svc', 'handoff'))
+    body = c.lead(('svc', 'handoff'), flight, 200, {}, 'text/plain', chunks(closed), lambda: closed.append('release'))
+    _, reader_id, _ = c.join(('svc', 'handoff'))
+    follower = []
+    thread = threading.Thread(target=lambda: follower.extend(flight.read(reader_id)))
+    thread.start()
+
+    next(body)
+    body.close()
+    thread.join(5)
+    assert b''.join(follower) == BODY
+    assert closed == ['body', 'release']
+
+
+def test_unread_leader_without_followers_releases_the_upstream():
+    c = Coalescer(max_buffer_bytes=10)
+    closed = []
+    flight, _, _ = c.join(('svc', 'unread'))
+    body = c.lead(('svc', 'unread'), flight, 200, {}, 'text/plain', chunks(closed), lambda: closed.append('release'))
+
+    body.close()
+    assert closed == ['release']
+    assert c.stats()['in_flight'] == 0
+
+
+def test_stalled_follower_is_cut_off():
+    c = Coalescer(max_buffer_bytes=10, stall_timeout=0.2)
+    flight, _, _ = c.join(('svc', 'stall'))
+    body = c.lead(('svc', 'stall'), flight, 200, {}, 'text/plain', chunks([]))
+    _, reader_id, _ = c.join(('svc', 'stall'))
+    reader = flight.read(reader_id)
+
+    assert b''.join(body) == BODY
+    with pytest.raises(FlightAborted):
+        list(reader)
+
+
+def test_leader_failure_reaches_followers():
+    c = Coalescer(max_buffer_bytes=10)
+    flight, _, _ = c.join(('svc', 'fail'))
+    c.join(('svc', 'fail'))
+    c.fail(('svc', 'fail'), flight, ConnectionError('upstream down'))
+
+    with pytest.raises(ConnectionError):
+        flight.wait_started()
+    assert c.stats()['in_flight'] == 0
+
+
+def test_async_leader_and_followers_read_concurrently():
+    async def main():
+        c = AsyncCoalescer(max_buffer_bytes=10)
+        flight, _, _ = c.join(('svc', 'async'))
+        body = c.lead(('svc', 'async'), flight, 200, {}, 'text/plain', achunks([]))
+        readers = [flight.read(c.join(('svc', 'async'))[1]) for _ in range(3)]
+        return await asyncio.gather(collect(body), *(collect(r) for r in readers)), c.stats()
+
+    bodies, stats = asyncio.run(main())
+    assert bodies == [BODY] * 4
+    assert stats == {'in_flight': 0, 'services': {'svc': {'upstream': 1, 'coalesced': 3}}}
+
+
+def test_async_leader_leaving_hands_the_body_to_followers():
+    async def main():
+        c = AsyncCoalescer(max_buffer_bytes=10)
+        closed = []
+
+        async def release():
+            closed.append('release')
+
+        flight, _, _ = c.join(('svc', 'handoff'))
+        body = c.lead(('svc', 'handoff'), flight, 200, {}, 'text/plain', achunks(closed), release)
+        reader = flight.read(c.join(('svc', 'handoff'))[1])
+        follower = asyncio.create_task(collect(reader))
+
+        await body.__anext__()
+        await body.aclose()
+        return await asyncio.wait_for(follower, 5), closed
+
+    follower, closed = asyncio.run(main())
+    assert follower == BODY
+    assert closed == ['body', 'release']
+
+
+@pytest.fixture
+def slow_upstream(upstream):
+    """Upstream that holds its response until release is set."""
+    release = threading.Event()
+
+    def handler(request):
+        release.wait(5)
+        return 200, {'Content-Type': 'text/plain'}, iter(CHUNKS)
+
+    upstream.handler = handler
+    upstream.release = release
+    return upstream
+
+
+def coalesced_count(c: Coalescer, service: str) -> int:
+    return c.stats()['services'].get(service, {}).get('coalesced', 0)
+
+
+def test_identical_requests_share_one_upstream_call(slow_upstream, make_store):
+    store = make_store({'shared': {'base_url': slow_upstream.url, 'token': 't', 'cache': {'enabled': False}}})
+    before = coalesced_count(coalescer, 'shared')
+
+    def fetch():
+        result = proxy_call('shared', 'items', 'GET', {}, None, 'page=1', store)
+        return result.status, read_result_body(result.body, len(BODY))
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = [executor.submit(fetch) for _ in range(10)]
+        while coalesced_count(coalescer, 'shared') - before < 9:
+            time.sleep(0.01)
+        slow_upstream.release.set()
+        results = [f.result(timeout=10) for f in futures]
+
+    assert results == [(200, BODY)] * 10
+    assert slow_upstream.paths() == ['/items?page=1']
+
+
+def test_requests_with_a_body_are_not_coalesced(upstream, make_store):
+    store = make_store({'shared': {'base_url': upstream.url, 'token': 't', 'cache': {'enabled': False}}})
+    for _ in range(2):
+        read_result_body(proxy_call('shared', 'items', 'POST', {}, b'{}', '', store).body, 1024)
+    assert len(upstream.requests) == 2
+
+
+def test_async_identical_requests_share_one_upstream_call(slow_upstream, make_store):
+    store = make_store({'shared': {'base_url': slow_upstream.url, 'token': 't', 'cache': {'enabled': False}}})
+    before = coalesced_count(async_coalescer, 'shared')
+
+    async def fetch():
+        result = await proxy_call_async('shared', 'items', 'GET', {}, None, 'page=2', store)
+        return result.status, await collect(result.body)
+
+    async def main():
+        tasks = [asyncio.create_task(fetch()) for _ in range(10)]
+        while coalesced_count(async_coalescer, 'shared') - before < 9:
+            await asyncio.sleep(0.01)
+        slow_upstream.release.set()
+        results = await asyncio.gather(*tasks)
+        await store.primary('shared').aclose()
+        return results
+
+    assert asyncio.run(main()) == [(200, BODY)] * 10
+    assert slow_upstream.paths() == ['/items?page=2']
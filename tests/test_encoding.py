@@ -0,0 +1,94 @@
+"""Tests for compressed passthrough (encoding.py and its use in the proxy engines)."""
+
+import asyncio
+import gzip
+import json
+import zlib
+
+from async_proxy import proxy_call_async
+from encoding import accepts_encoding, adapt_body_for_client, decode_body, parse_accept_encoding
+from proxy import proxy_call, read_result_body
+
+DATA = json.dumps({'items': list(range(200))}).encode()
+GZIPPED = gzip.compress(DATA)
+
+
+def test_accept_encoding_is_parsed_with_q_values():
+    assert parse_accept_encoding('gzip, br;q=0.5, deflate;q=0, Identity') == {'gzip': 1.0, 'br': 0.5, 'deflate': 0.0, 'identity': 1.0}
+    assert accepts_encoding('gzip, br', 'gzip')
+    assert not accepts_encoding('gzip;q=0, br', 'gzip')
+    assert not accepts_encoding('br', 'gzip, br')
+    assert accepts_encoding('*', 'gzip, br')
+    assert not accepts_encoding(None, 'gzip')
+
+
+def test_bodies_decode_by_coding():
+    assert decode_body(GZIPPED, 'gzip') == DATA
+    assert decode_body(zlib.compress(DATA), 'deflate') == DATA
+    assert decode_body(zlib.compress(DATA)[2:-4], 'deflate') == DATA  # Raw deflate
+    assert decode_body(b'not gzip', 'gzip') is None
+    assert decode_body(DATA, 'compress') is None
+
+
+def test_stored_bodies_are_decoded_only_for_clients_that_need_it():
+    headers = {'Content-Encoding': 'gzip', 'Content-Length': str(len(GZIPPED)), 'ETag': '"v1"'}
+    assert adapt_body_for_client(headers, GZIPPED, 'gzip') == (headers, GZIPPED)
+    assert adapt_body_for_client(headers, GZIPPED, 'identity') == ({'ETag': '"v1"'}, DATA)
+
+
+def gzip_upstream(request):
+    return 200, {'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'Cache-Control': 'max-age=60'}, GZIPPED
+
+
+def compressed_service(url: str, **cache) -> dict:
+    return {'svc': {'base_url': url, 'token': 't', 'cache': cache or {'enabled': False}}}
+
+
+def fetch(store, accept_encoding: str):
+    result = proxy_call('svc', 'items', 'GET', {'Accept-Encoding': accept_encoding}, None, '', store)
+    return result.headers, read_result_body(result.body, 1024 * 1024)
+
+
+def test_compressed_bodies_pass_through_to_clients_that_accept_them(upstream, make_store):
+    upstream.handler = gzip_upstream
+    store = make_store(compressed_service(upstream.url))
+
+    headers, body = fetch(store, 'gzip, br')
+    assert body == GZIPPED
+    assert (headers['Content-Encoding'], headers['Content-Length']) == ('gzip', str(len(GZIPPED)))
+    assert upstream.requests[0].headers['Accept-Encoding'] == 'gzip, br'
+
+
+def test_compressed_bodies_are_decoded_for_other_clients(upstream, make_store):
+    upstream.handler = gzip_upstream
+    store = make_store(compressed_service(upstream.url))
+
+    headers, body = fetch(store, 'identity')
+    assert body == DATA
+    assert not {'content-encoding', 'content-length'} & {k.lower() for k in headers}
+
+
+def test_cached_compressed_bodies_suit_each_client(upstream, make_store, response_cache):
+    upstream.handler = gzip_upstream
+    store = make_store(compressed_service(upstream.url, default_ttl=60))
+
+    assert fetch(store, 'gzip')[1] == GZIPPED
+    headers, body = fetch(store, 'identity')
+    assert (headers['X-Proxy-Cache'], body) == ('HIT', DATA)
+    assert fetch(store, 'gzip')[1] == GZIPPED
+    assert len(upstream.requests) == 1
+
+
+def test_async_engine_passes_compressed_bodies_through(upstream, make_store):
+    upstream.handler = gzip_upstream
+    store = make_store(compressed_service(upstream.url))
+
+    async def main():
+        bodies = []
+        for accept_encoding in ('gzip', 'identity'):
+            result = await proxy_call_async('svc', 'items', 'GET', {'Accept-Encoding': accept_encoding}, None, '', store)
+            bodies.append(b''.join([chunk async for chunk in result.body]))
+        await store.primary('svc').aclose()
+        return bodies
+
+    assert asyncio.run(main()) == [GZIPPED, DATA]
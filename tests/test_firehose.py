@@ -0,0 +1,248 @@
+"""Tests for Jetstream fan-out and subscriber filtering (firehose.py)."""
+
+import itertools
+import json
+import socket
+import threading
+import time
+
+import pytest
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, CloseConnection, Request, TextMessage
+
+from firehose import MAX_FILTER_DIDS, EventFilter, FilterError, Firehose, FirehoseFull, JetstreamConfig
+
+_clock = itertools.count(1_700_000_000_000_001)
+
+
+def post(did: str, text: str, collection: str = 'app.bsky.feed.post') -> dict:
+    """Build a Jetstream commit event."""
+    return {
+        'did': did,
+        'time_us': next(_clock),
+        'kind': 'commit',
+        'commit': {'operation': 'create', 'collection': collection, 'rkey': 'r', 'record': {'text': text}},
+    }
+
+
+class JetstreamEmitter:
+    """
+    Local Jetstream stand-in: accepts WebSocket connections with wsproto and
+    sends the events a test emits over the newest one.
+    """
+
+    def __init__(self):
+        self._listener = socket.create_server(('127.0.0.1', 0))
+        self._cond = threading.Condition()
+        self._connections: list[tuple[socket.socket, WSConnection]] = []
+        self.targets: list[str] = []  # Request target of each connection, in order
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self._listener.getsockname()[1]}/subscribe"
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            ws = WSConnection(ConnectionType.SERVER)
+            request = None
+            while request is None:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                ws.receive_data(data)
+                request = next((e for e in ws.events() if isinstance(e, Request)), None)
+            if request is None:
+                sock.close()
+                continue
+            sock.sendall(ws.send(AcceptConnection()))
+            with self._cond:
+                self._connections.append((sock, ws))
+                self.targets.append(request.target)
+                self._cond.notify_all()
+
+    def wait_connections(self, count: int, timeout: float = 5.0) -> None:
+        with self._cond:
+            assert self._cond.wait_for(lambda: len(self._connections) >= count, timeout)
+
+    def emit(self, *events: dict) -> None:
+        with self._cond:
+            sock, ws = self._connections[-1]
+            for event in events:
+                sock.sendall(ws.send(TextMessage(data=json.dumps(event))))
+
+    def hang_up(self) -> None:
+        """Close the newest connection from the server side."""
+        with self._cond:
+            sock, ws = self._connections[-1]
+            sock.sendall(ws.send(CloseConnection(code=1001)))
+            sock.close()
+
+    def close(self) -> None:
+        self._listener.close()
+        with self._cond:
+            for sock, _ in self._connections:
+                sock.close()
+
+
+@pytest.fixture
+def emitter():
+    emitter = JetstreamEmitter()
+    yield emitter
+    emitter.close()
+
+
+@pytest.fixture
+def make_hub(emitter):
+    hubs = []
+
+    def make(**settings) -> Firehose:
+        hub = Firehose(JetstreamConfig(enabled=True, url=emitter.url, **settings), name='test')
+        hubs.append(hub)
+        return hub
+
+    yield make
+    for hub in hubs:
+        hub.stop()
+
+
+def received(subscription, count: int) -> list[dict]:
+    events = []
+    for _ in range(count):
+        event = subscription.get(timeout=5)
+        assert event is not None, f"only {len(events)} of {count} event(s) arrived"
+        events.append(json.loads(event.data))
+    return events
+
+
+def wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.02)
+
+
+# -- EventFilter -----------------------------------------------------------
+
+def test_filter_from_query_merges_repeated_and_comma_separated_values():
+    event_filter = EventFilter.from_query('dids=did:plc:a,did:plc:b&dids=did:plc:c&keywords=rust')
+    assert event_filter.dids == {'did:plc:a', 'did:plc:b', 'did:plc:c'}
+    assert event_filter.describe() == {'collections': [], 'dids': 3, 'keywords': ['rust']}
+
+
+def test_filter_collections_are_fnmatch_patterns():
+    event_filter = EventFilter(collections=['app.bsky.feed.*'])
+    assert event_filter.matches('did:plc:a', 'app.bsky.feed.like', None)
+    assert not event_filter.matches('did:plc:a', 'app.bsky.graph.follow', None)
+    assert not event_filter.matches('did:plc:a', None, None)
+
+
+def test_filter_keywords_match_whole_words_case_insensitively():
+    event_filter = EventFilter(keywords=['rust', 'c++'])
+    assert event_filter.matches(None, None, 'Learning Rust today')
+    assert event_filter.matches(None, None, 'c++ templates')
+    assert not event_filter.matches(None, None, 'trusty old code')
+    assert not event_filter.matches(None, None, None)
+
+
+def test_every_given_filter_must_match():
+    event_filter = EventFilter(dids=['did:plc:a'], keywords=['rust'])
+    assert event_filter.matches('did:plc:a', 'app.bsky.feed.post', 'rust')
+    assert not event_filter.matches('did:plc:b', 'app.bsky.feed.post', 'rust')
+    assert not event_filter.matches('did:plc:a', 'app.bsky.feed.post', 'python')
+
+
+def test_invalid_filters_are_rejected():
+    with pytest.raises(FilterError):
+        EventFilter(dids=['alice.bsky.social'])
+    with pytest.raises(FilterError):
+        EventFilter(dids=[f'did:plc:{i}' for i in range(MAX_FILTER_DIDS + 1)])
+    with pytest.raises(FilterError):
+        EventFilter.from_params({'keywords': [1]})
+
+
+# -- Fan-out ----------------------------------------------------------------
+
+def test_events_fan_out_to_matching_subscribers_only(emitter, make_hub):
+    hub = make_hub()
+    by_did = hub.subscribe(EventFilter(dids=['did:plc:alice']))
+    by_keyword = hub.subscribe(EventFilter(keywords=['rust']))
+    emitter.wait_connections(1)
+
+    emitter.emit(
+        post('did:plc:alice', 'hello'),
+        post('did:plc:bob', 'I like Rust'),
+        post('did:plc:bob', 'nothing to see'),
+        post('did:plc:alice', 'rust and more', collection='app.bsky.feed.like'),
+    )
+
+    assert [e['commit']['record']['text'] for e in received(by_did, 2)] == ['hello', 'rust and more']
+    assert [e['commit']['record']['text'] for e in received(by_keyword, 2)] == ['I like Rust', 'rust and more']
+    assert by_did.get(timeout=0.2) is None
+
+    stats = hub.stats()
+    assert stats['connected'] and stats['connects'] == 1 and stats['events'] == 4
+    assert [s['delivered'] for s in stats['subscribers']] == [2, 2]
+
+
+def test_one_upstream_connection_is_shared(emitter, make_hub):
+    hub = make_hub(wanted_collections=['app.bsky.feed.post'])
+    subscriptions = [hub.subscribe(EventFilter()) for _ in range(3)]
+    emitter.wait_connections(1)
+
+    emitter.emit(post('did:plc:a', 'one'))
+    for subscription in subscriptions:
+        assert received(subscription, 1)[0]['did'] == 'did:plc:a'
+    assert emitter.targets == ['/subscribe?wantedCollections=app.bsky.feed.post']
+
+
+def test_reconnect_resumes_from_the_last_cursor(emitter, make_hub):
+    hub = make_hub()
+    subscription = hub.subscribe(EventFilter())
+    emitter.wait_connections(1)
+
+    event = post('did:plc:a', 'before the drop')
+    emitter.emit(event)
+    received(subscription, 1)
+    emitter.hang_up()
+
+    emitter.wait_connections(2)
+    assert emitter.targets[1] == f"/subscribe?cursor={event['time_us']}"
+    emitter.emit(post('did:plc:a', 'after the drop'))
+    assert received(subscription, 1)[0]['commit']['record']['text'] == 'after the drop'
+    assert hub.stats()['connects'] == 2
+
+
+def test_slow_subscriber_loses_oldest_events(emitter, make_hub):
+    hub = make_hub(queue_size=2)
+    slow = hub.subscribe(EventFilter())
+    emitter.wait_connections(1)
+
+    emitter.emit(*(post('did:plc:a', str(i)) for i in range(5)))
+    wait_for(lambda: hub.stats()['events'] == 5)
+
+    assert [e['commit']['record']['text'] for e in received(slow, 2)] == ['3', '4']
+    assert hub.stats()['subscribers'][0]['dropped'] == 3
+
+
+def test_subscriber_limit(emitter, make_hub):
+    hub = make_hub(max_subscribers=1)
+    hub.subscribe(EventFilter())
+    with pytest.raises(FirehoseFull):
+        hub.subscribe(EventFilter())
+
+
+def test_upstream_closes_after_last_subscriber_leaves(emitter, make_hub):
+    hub = make_hub(idle_timeout=0)
+    subscription = hub.subscribe(EventFilter())
+    emitter.wait_connections(1)
+    wait_for(lambda: hub.stats()['connected'])
+
+    hub.unsubscribe(subscription)
+    wait_for(lambda: not hub.stats()['connected'])
+    assert subscription.closed
+    assert hub.stats()['subscribers'] == []
@@ -0,0 +1,117 @@
+"""Tests for hedged requests (hedge.py and its use in the proxy engines)."""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from async_proxy import proxy_call_async
+from conftest import json_response
+from hedge import HedgeConfig, Hedger
+from proxy import proxy_call, read_result_body
+
+
+def test_only_configured_idempotent_reads_are_hedged():
+    hedger = Hedger(HedgeConfig(enabled=True, paths=['repos/*']))
+    assert hedger.applies('get', 'repos/o/r', None)
+    assert not hedger.applies('GET', 'search/issues', None)
+    assert not hedger.applies('POST', 'repos/o/r', None)
+    assert not hedger.applies('GET', 'repos/o/r', b'body')
+    assert not Hedger().applies('GET', 'repos/o/r', None)
+
+
+def test_delay_follows_the_response_time_percentile():
+    hedger = Hedger(HedgeConfig(enabled=True, initial_delay=1.0, min_samples=10, percentile=90, min_delay=0.05))
+    assert hedger.delay() == 1.0
+    for i in range(10):
+        hedger._record(i / 10)
+    assert hedger.delay() == pytest.approx(0.9)
+
+
+class SlowFirst:
+    """Handler whose first /slow request stalls until released; later ones answer at once."""
+
+    def __init__(self, headers: dict = None):
+        self.headers = headers or {}
+        self.released = threading.Event()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if request.path != '/slow':
+            return json_response({}, headers=self.headers)
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            self.released.wait(5)
+        return json_response({'call': call}, headers=self.headers)
+
+
+def hedged_service(url: str, **config) -> dict:
+    return {'svc': {
+        'base_url': url,
+        'token': 't',
+        'cache': {'enabled': False},
+        'hedge': {'enabled': True, 'initial_delay': 0.1, **config.pop('hedge', {})},
+        **config,
+    }}
+
+
+def slow_call(store) -> dict:
+    result = proxy_call('svc', 'slow', 'GET', {}, None, '', store)
+    return json.loads(read_result_body(result.body, 1024))
+
+
+def test_slow_request_is_answered_by_the_hedge(upstream, make_store):
+    handler = upstream.handler = SlowFirst()
+    store = make_store(hedged_service(upstream.url))
+
+    started = time.monotonic()
+    assert slow_call(store) == {'call': 2}
+    assert time.monotonic() - started < 2
+    handler.released.set()
+    hedging = store.get('svc').stats()['hedging']
+    assert (hedging['hedged'], hedging['hedge_wins']) == (1, 1)
+
+
+def test_hedges_are_limited_by_the_hedge_budget(upstream, make_store):
+    handler = upstream.handler = SlowFirst()
+    store = make_store(hedged_service(upstream.url, hedge={'max_rate': 0}))
+    slow_call(store)
+
+    # The one starting token is spent; the next slow request waits it out
+    handler.calls = 0
+    threading.Timer(0.3, handler.released.set).start()
+    assert slow_call(store) == {'call': 1}
+    assert store.get('svc').stats()['hedging']['hedged'] == 1
+
+
+def test_hedges_need_rate_budget_that_is_free_now(upstream, make_store):
+    reset = str(int(time.time()) + 300)
+    handler = upstream.handler = SlowFirst({'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '1', 'X-RateLimit-Reset': reset})
+    store = make_store(hedged_service(upstream.url, rate_limit={'pace_below': 0}))
+    read_result_body(proxy_call('svc', 'learn', 'GET', {}, None, '', store).body, 1024)
+
+    # The slow request takes the last request of the window, so no hedge goes out
+    threading.Timer(0.3, handler.released.set).start()
+    assert slow_call(store) == {'call': 1}
+    assert handler.calls == 1
+    assert store.get('svc').stats()['hedging']['hedged'] == 0
+
+
+def test_async_engine_cancels_the_losing_request(upstream, make_store):
+    handler = upstream.handler = SlowFirst()
+    store = make_store(hedged_service(upstream.url))
+
+    async def main():
+        result = await proxy_call_async('svc', 'slow', 'GET', {}, None, '', store)
+        body = b''.join([chunk async for chunk in result.body])
+        await store.primary('svc').aclose()
+        return json.loads(body)
+
+    assert asyncio.run(main()) == {'call': 2}
+    handler.released.set()
+    assert store.get('svc').stats()['hedging']['hedge_wins'] == 1
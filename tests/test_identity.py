@@ -0,0 +1,165 @@
+"""Tests for PDS routing of ATProto repo calls (identity.py)."""
+
+import json
+
+from conftest import json_response
+from identity import DidResolver, HandleCache, IdentityConfig, StaticDidResolver, create_resolver, pds_endpoint
+from proxy import proxy_call, read_result_body
+
+ACCOUNT_DID = 'did:plc:abc'
+
+
+def did_doc(pds_url: str) -> dict:
+    return {
+        'id': ACCOUNT_DID,
+        'service': [{'id': '#atproto_pds', 'type': 'AtprotoPersonalDataServer', 'serviceEndpoint': pds_url}],
+    }
+
+
+def entryway_handler(request):
+    if 'createSession' in request.path:
+        return json_response({'accessJwt': 'x.e30.y', 'refreshJwt': 'r', 'did': ACCOUNT_DID, 'handle': 'me.test'})
+    return json_response({'where': 'entryway'})
+
+
+def bsky_config(entryway_url: str, identity: dict) -> dict:
+    return {'bsky': {
+        'base_url': f'{entryway_url}/xrpc',
+        'identifier': 'me.test',
+        'app_password': 'app-password',
+        'cache': {'enabled': False},
+        'identity': identity,
+    }}
+
+
+def call(store, nsid: str) -> dict:
+    result = proxy_call('bsky', nsid, 'GET', {}, None, f'repo={ACCOUNT_DID}', store)
+    return json.loads(read_result_body(result.body, 64 * 1024))
+
+
+def test_create_resolver_uses_static_table_when_did_docs_configured():
+    assert isinstance(create_resolver(IdentityConfig(did_docs={ACCOUNT_DID: {}})), StaticDidResolver)
+    assert type(create_resolver(IdentityConfig())) is DidResolver
+
+
+def test_pds_endpoint_reads_atproto_pds_service():
+    assert pds_endpoint(did_doc('https://pds.example/')) == 'https://pds.example'
+    assert pds_endpoint({'service': [{'id': '#other', 'serviceEndpoint': 'https://x'}]}) is None
+    assert pds_endpoint(None) is None
+
+
+def test_repo_calls_go_to_the_accounts_pds(start_upstream, make_store):
+    entryway, pds = start_upstream(), start_upstream()
+    entryway.handler = entryway_handler
+    pds.handler = lambda request: json_response({'where': 'pds'})
+    store = make_store(bsky_config(entryway.url, {'did_docs': {ACCOUNT_DID: did_doc(pds.url)}}))
+
+    assert call(store, 'com.atproto.repo.listRecords') == {'where': 'pds'}
+    assert call(store, 'app.bsky.feed.getTimeline') == {'where': 'entryway'}
+
+    assert pds.paths() == [f'/xrpc/com.atproto.repo.listRecords?repo={ACCOUNT_DID}']
+    assert pds.requests[0].headers['Authorization'] == 'Bearer x.e30.y'
+    identity = store.get('bsky').stats()['identity']
+    assert identity['pds'] == f'{pds.url}/xrpc'
+    assert identity['failures'] == 0
+
+
+def test_unknown_did_stays_on_the_entryway(start_upstream, make_store):
+    entryway = start_upstream()
+    entryway.handler = entryway_handler
+    store = make_store(bsky_config(entryway.url, {'did_docs': {'did:plc:someone-else': did_doc('http://127.0.0.1:9')}}))
+
+    assert call(store, 'com.atproto.repo.listRecords') == {'where': 'entryway'}
+    assert store.get('bsky').pds_url() is None
+
+
+def test_resolve_pds_off_keeps_repo_calls_on_the_entryway(start_upstream, make_store):
+    entryway, pds = start_upstream(), start_upstream()
+    entryway.handler = entryway_handler
+    store = make_store(bsky_config(entryway.url, {
+        'resolve_pds': False,
+        'did_docs': {ACCOUNT_DID: did_doc(pds.url)},
+    }))
+
+    assert call(store, 'com.atproto.repo.listRecords') == {'where': 'entryway'}
+    assert pds.requests == []
+
+
+
+def test_other_accounts_repos_stay_on_the_entryway(start_upstream, make_store):
+    entryway, pds = start_upstream(), start_upstream()
+    entryway.handler = entryway_handler
+    pds.handler = lambda request: json_response({'where': 'pds'})
+    store = make_store(bsky_config(entryway.url, {'did_docs': {ACCOUNT_DID: did_doc(pds.url)}}))
+
+    def where(nsid: str, query: str, method: str = 'GET', body: bytes = None) -> str:
+        result = proxy_call('bsky', nsid, method, {'Content-Type': 'application/json'}, body, query, store)
+        return json.loads(read_result_body(result.body, 64 * 1024))['where']
+
+    assert where('com.atproto.repo.listRecords', 'repo=did:plc:someoneelse') == 'entryway'
+    assert where('com.atproto.sync.getBlob', 'did=did:plc:someoneelse&cid=x') == 'entryway'
+    assert where('com.atproto.repo.createRecord', '', 'POST', b'{"repo": "did:plc:someoneelse"}') == 'entryway'
+    assert where('com.atproto.sync.listRepos', '') == 'entryway'
+
+    assert where('com.atproto.repo.listRecords', 'repo=me.test') == 'pds'
+    assert where('com.atproto.sync.getBlob', f'did={ACCOUNT_DID}&cid=x') == 'pds'
+    assert where('com.atproto.repo.createRecord', '', 'POST', json.dumps({'repo': ACCOUNT_DID}).encode()) == 'pds'
+    assert where('app.bsky.actor.getPreferences', '') == 'pds'
+    routing = store.get('bsky').stats()['routing']
+    assert (routing['pds'], routing['entryway']) == (4, 4)
+
+
+# -- Handle cache -----------------------------------------------------------
+
+def poisoned_thread() -> dict:
+    """A thread whose post record carries a forged did/handle pair."""
+    forged = {'did': 'did:plc:evil', 'handle': 'jay.bsky.team'}
+    return {'thread': {'post': {
+        'uri': 'at://did:plc:author/app.bsky.feed.post/1',
+        'author': {'did': 'did:plc:author', 'handle': 'author.test'},
+        'record': {'text': 'hi', 'extra': forged},
+        'embed': {'record': {'author': forged, 'value': {'extra': forged}}},
+    }}}
+
+
+def test_handles_are_learned_from_actor_views_only():
+    cache = HandleCache()
+    cache.learn_response('app.bsky.feed.getPostThread', '', json.dumps(poisoned_thread()).encode())
+
+    assert cache.get('author.test') == 'did:plc:author'
+    assert cache.get('jay.bsky.team') is None
+    assert cache.rewrite_query('actor=jay.bsky.team') == 'actor=jay.bsky.team'
+
+
+def test_profile_and_follower_views_are_learned():
+    cache = HandleCache()
+    cache.learn_response('app.bsky.actor.getProfile', 'actor=a.test', b'{"did": "did:plc:a", "handle": "a.test"}')
+    cache.learn_response('app.bsky.graph.getFollowers', '', json.dumps({
+        'subject': {'did': 'did:plc:b', 'handle': 'b.test'},
+        'followers': [{'did': 'did:plc:c', 'handle': 'C.test'}],
+    }).encode())
+    cache.learn_response('app.bsky.feed.getTimeline', '', b'{"did": "did:plc:d", "handle": "d.test"}')
+
+    assert [cache.get(h) for h in ('a.test', 'b.test', 'c.test', 'd.test')] == [
+        'did:plc:a', 'did:plc:b', 'did:plc:c', None
+    ]
+    assert cache.rewrite_query('actor=c.test&limit=5') == 'actor=did%3Aplc%3Ac&limit=5'
+
+
+def test_forged_pairs_in_proxied_posts_do_not_redirect_lookups(start_upstream, make_store):
+    entryway = start_upstream()
+
+    def handler(request):
+        if 'getPostThread' in request.path:
+            return json_response(poisoned_thread())
+        if 'resolveHandle' in request.path:
+            return json_response({'did': 'did:plc:jay'})
+        return entryway_handler(request)
+
+    entryway.handler = handler
+    store = make_store(bsky_config(entryway.url, {}))
+
+    read_result_body(proxy_call('bsky', 'app.bsky.feed.getPostThread', 'GET', {}, None, 'uri=x', store).body, 64 * 1024)
+    result = proxy_call('bsky', 'com.atproto.identity.resolveHandle', 'GET', {}, None, 'handle=jay.bsky.team', store)
+    assert json.loads(read_result_body(result.body, 64 * 1024)) == {'did': 'did:plc:jay'}
+    assert entryway.paths()[-1] == '/xrpc/com.atproto.identity.resolveHandle?handle=jay.bsky.team'
@@ -0,0 +1,152 @@
+"""Tests for server-side pagination aggregation (pagination.py)."""
+
+import json
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from conftest import json_response
+from pagination import PaginationError, PaginationRequest, paginated_call, split_pagination
+from proxy import read_result_body
+
+
+def test_control_parameters_are_split_from_the_upstream_query():
+    pagination, query = split_pagination('state=open&_paginate=all&_max_items=5&_format=ndjson')
+    assert pagination == PaginationRequest(max_items=5, format='ndjson')
+    assert query == 'state=open'
+    assert split_pagination('state=open&_max_items=5') == (None, 'state=open&_max_items=5')
+    with pytest.raises(PaginationError):
+        split_pagination('_paginate=all&_max_pages=0')
+    with pytest.raises(PaginationError):
+        split_pagination('_paginate=all&_format=xml')
+
+
+def linked_pages(upstream, pages: dict, fail: set = frozenset()):
+    """
+    Handler serving a Link-paginated list.
+
+    pages maps each path to (items, next path or None); GitHub moves to a
+    different path after the first page.
+    """
+    def handler(request):
+        if request.path in fail:
+            return json_response({'message': 'boom'}, status=500)
+        items, next_path = pages[request.path]
+        headers = {'Link': f'<{upstream.url}{next_path}>; rel="next"'} if next_path else {}
+        return json_response(items, headers=headers)
+
+    return handler
+
+
+ISSUES = {
+    '/repos/o/r/issues?state=open': ([1, 2], '/repositories/42/issues?state=open&page=2'),
+    '/repositories/42/issues?state=open&page=2': ([3, 4], '/repositories/42/issues?state=open&page=3'),
+    '/repositories/42/issues?state=open&page=3': ([5], None),
+}
+
+
+def paginate(store, service: str, path: str, query: str, **settings):
+    result = paginated_call(service, path, {}, query, PaginationRequest(**settings), store)
+    return result, read_result_body(result.body, 1024 * 1024)
+
+
+@pytest.fixture
+def github(upstream, make_store):
+    upstream.handler = linked_pages(upstream, ISSUES)
+    return make_store({'gh': {'base_url': upstream.url, 'token': 't', 'cache': {'enabled': False}}})
+
+
+def test_next_links_are_followed_across_paths(upstream, github):
+    result, body = paginate(github, 'gh', 'repos/o/r/issues', 'state=open')
+    assert result.content_type == 'application/json'
+    assert json.loads(body) == [1, 2, 3, 4, 5]
+    assert upstream.paths() == list(ISSUES)
+
+
+def test_max_items_stops_fetching_early(upstream, github):
+    _, body = paginate(github, 'gh', 'repos/o/r/issues', 'state=open', max_items=3)
+    assert json.loads(body) == [1, 2, 3]
+    assert len(upstream.requests) == 2
+
+
+def test_max_pages_limits_the_pages_fetched(upstream, github):
+    _, body = paginate(github, 'gh', 'repos/o/r/issues', 'state=open', max_pages=2, format='ndjson')
+    assert [json.loads(line) for line in body.splitlines()] == [1, 2, 3, 4]
+    assert len(upstream.requests) == 2
+
+
+def test_links_outside_the_service_are_not_followed(upstream, make_store):
+    upstream.handler = lambda request: json_response([1], headers={'Link': '<https://elsewhere.example/issues?page=2>; rel="next"'})
+    store = make_store({'gh': {'base_url': upstream.url, 'token': 't'}})
+
+    _, body = paginate(store, 'gh', 'issues', '')
+    assert json.loads(body) == [1]
+    assert len(upstream.requests) == 1
+
+
+def test_a_failed_later_page_is_marked_in_band(upstream, github):
+    upstream.handler = linked_pages(upstream, ISSUES, fail={'/repositories/42/issues?state=open&page=2'})
+
+    result, body = paginate(github, 'gh', 'repos/o/r/issues', 'state=open')
+    assert result.status == 200
+    assert json.loads(body) == [1, 2, {'error': 'pagination stopped: upstream returned 500'}]
+
+
+def test_a_failed_first_page_is_returned_unchanged(upstream, github):
+    upstream.handler = lambda request: json_response({'message': 'Not Found'}, status=404)
+
+    result, body = paginate(github, 'gh', 'repos/o/r/issues', 'state=open')
+    assert (result.status, json.loads(body)) == (404, {'message': 'Not Found'})
+
+
+def feed(pages: dict):
+    """
+    Handler for a PDS serving getAuthorFeed pages keyed by cursor.
+
+    pages maps each cursor ('' for the first page) to (posts, next cursor).
+    """
+    def handler(request):
+        if 'createSession' in request.path:
+            return json_response({'accessJwt': 'x.e30.y', 'refreshJwt': 'r', 'did': 'did:plc:abc', 'handle': 'me.test'})
+        cursor = request.path.split('cursor=', 1)[1] if 'cursor=' in request.path else ''
+        posts, next_cursor = pages[cursor]
+        data = {'feed': posts}
+        if next_cursor:
+            data['cursor'] = next_cursor
+        return json_response(data)
+
+    return handler
+
+
+@pytest.fixture
+def bsky(make_store, upstream):
+    return make_store({'bsky': {
+        'base_url': f'{upstream.url}/xrpc',
+        'identifier': 'me.test',
+        'app_password': 'app-password',
+        'identity': {'resolve_pds': False},
+        'cache': {'enabled': False},
+    }})
+
+
+def feed_cursors(upstream) -> list[str]:
+    """Cursor sent with each getAuthorFeed call, '' for none."""
+    return [dict(parse_qsl(urlsplit(p).query)).get('cursor', '') for p in upstream.paths() if 'getAuthorFeed' in p]
+
+
+def test_atproto_cursors_are_walked_into_ndjson(upstream, bsky):
+    upstream.handler = feed({'': (['a', 'b'], 'c2'), 'c2': (['c'], 'c3'), 'c3': ([], None)})
+
+    result, body = paginate(bsky, 'bsky', 'app.bsky.feed.getAuthorFeed', 'actor=me.test&limit=2')
+    assert result.content_type == 'application/x-ndjson'
+    assert [json.loads(line) for line in body.splitlines()] == ['a', 'b', 'c']
+    assert feed_cursors(upstream) == ['', 'c2', 'c3']
+    assert all('limit=2' in p for p in upstream.paths() if 'getAuthorFeed' in p)
+
+
+def test_a_repeated_cursor_ends_pagination(upstream, bsky):
+    upstream.handler = feed({'': (['a'], 'c2'), 'c2': (['b'], 'c2')})
+
+    _, body = paginate(bsky, 'bsky', 'app.bsky.feed.getAuthorFeed', 'actor=me.test', format='json')
+    assert json.loads(body) == ['a', 'b']
+    assert feed_cursors(upstream) == ['', 'c2']
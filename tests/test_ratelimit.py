@@ -0,0 +1,168 @@
+"""Tests for the upstream rate governor (ratelimit.py and its use in the proxy)."""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from conftest import json_response
+from proxy import proxy_call, read_result_body
+from ratelimit import RateBudgetExhausted, RateGovernor, RateLimitConfig
+
+
+class Clock:
+    """Manually advanced stand-in for time.time()."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(time=clock))
+    return clock
+
+
+def budget(limit: int, remaining: int, reset_in: float, resource: str = None) -> dict:
+    """GitHub-style rate limit headers."""
+    headers = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset_in)}
+    if resource:
+        headers['X-RateLimit-Resource'] = resource
+    return headers
+
+
+def test_requests_pass_until_a_limit_is_learned(clock):
+    governor = RateGovernor()
+    assert [governor.reserve('repos/o/r') for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_low_budget_is_spread_over_the_window(clock):
+    governor = RateGovernor(RateLimitConfig(pace_below=0.1))
+    governor.update(200, budget(100, 5, 10))
+
+    assert governor.reserve() == 0.0
+    assert governor.reserve() == pytest.approx(2.0)
+    assert governor.reserve() == pytest.approx(4.5)
+    assert governor.stats()['remaining'] == 2
+
+
+def test_exhausted_budget_waits_for_the_reset_or_is_refused(clock):
+    governor = RateGovernor(RateLimitConfig(max_wait=30))
+    governor.update(200, budget(60, 0, 20))
+    assert governor.reserve() == pytest.approx(20)
+
+    strict = RateGovernor(RateLimitConfig(max_wait=5))
+    strict.update(200, budget(60, 0, 20))
+    with pytest.raises(RateBudgetExhausted) as excinfo:
+        strict.reserve()
+    assert excinfo.value.retry_after == pytest.approx(20)
+    assert strict.stats()['rejected'] == 1
+
+
+def test_budget_refills_when_the_window_rolls_over(clock):
+    governor = RateGovernor()
+    governor.update(200, budget(60, 0, 20))
+    clock.now += 21
+
+    assert governor.reserve() == 0.0
+    assert governor.stats()['remaining'] == 59
+
+
+def test_retry_after_blocks_until_it_passes(clock):
+    governor = RateGovernor()
+    governor.update(429, {'Retry-After': '15'})
+    assert governor.reserve() == pytest.approx(15)
+    clock.now += 15
+    assert governor.reserve() == 0.0
+
+
+def test_plain_403_is_not_a_rate_limit(clock):
+    governor = RateGovernor()
+    governor.update(403, budget(60, 10, 20))
+    assert governor.reserve() == 0.0
+    assert governor.stats()['blocked_for'] == 0
+
+
+def test_each_resource_has_its_own_budget(clock):
+    governor = RateGovernor(RateLimitConfig(max_wait=5))
+    governor.update(200, budget(30, 0, 60, resource='search'), 'search/issues')
+    governor.update(200, budget(5000, 4000, 3600, resource='core'), 'repos/o/r')
+
+    with pytest.raises(RateBudgetExhausted):
+        governor.reserve('search/issues')
+    assert governor.reserve('repos/o/r') == 0.0
+    resources = governor.stats()['resources']
+    assert resources['search']['remaining'] == 0 and resources['core']['remaining'] == 3999
+
+
+def test_optional_requests_only_take_budget_that_is_free_now(clock):
+    governor = RateGovernor()
+    governor.update(200, budget(100, 5, 10))
+    assert governor.try_reserve()
+    assert not governor.try_reserve()
+    assert governor.stats()['remaining'] == 4
+
+
+def limited_service(url: str, **rate_limit) -> dict:
+    return {'svc': {
+        'base_url': url,
+        'token': 't',
+        'cache': {'enabled': False},
+        'retry': {'max_attempts': 1},
+        'rate_limit': rate_limit,
+    }}
+
+
+def call(store, path: str):
+    result = proxy_call('svc', path, 'GET', {}, None, '', store)
+    read_result_body(result.body, 1024)
+    return result
+
+
+def test_spent_resource_is_answered_locally_without_holding_others(upstream, make_store):
+    reset = str(int(time.time()) + 120)
+
+    def handler(request):
+        if request.path.startswith('/search/'):
+            return json_response({}, headers=budget(30, 0, reset, resource='search'))
+        return json_response({}, headers=budget(5000, 4999, reset, resource='core'))
+
+    upstream.handler = handler
+    store = make_store(limited_service(upstream.url))
+    call(store, 'search/issues')
+    call(store, 'repos/o/r')
+
+    refused = call(store, 'search/issues')
+    assert refused.status == 429
+    assert 110 <= int(refused.headers['Retry-After']) <= 120
+    assert call(store, 'repos/o/r').status == 200
+    assert upstream.paths() == ['/search/issues', '/repos/o/r', '/repos/o/r']
+    assert store.get('svc').stats()['rate_limit']['rejected'] == 1
+
+
+def test_upstream_retry_after_holds_the_next_request(upstream, make_store):
+    responses = [json_response({}, status=429, headers={'Retry-After': '1'}), json_response({})]
+    upstream.handler = lambda request: responses.pop(0)
+    store = make_store(limited_service(upstream.url))
+
+    assert call(store, 'items').status == 429
+    started = time.monotonic()
+    assert call(store, 'items').status == 200
+    assert time.monotonic() - started >= 0.9
+    assert store.get('svc').stats()['rate_limit']['delayed'] == 1
+
+
+def test_retry_after_beyond_max_wait_is_refused_locally(upstream, make_store):
+    upstream.handler = lambda request: json_response({}, status=429, headers={'Retry-After': '30'})
+    store = make_store(limited_service(upstream.url, max_wait=1))
+
+    call(store, 'items')
+    refused = call(store, 'items')
+    assert refused.status == 429
+    assert refused.headers['Retry-After'] == '30'
+    assert len(upstream.requests) == 1
@@ -0,0 +1,141 @@
+"""Tests for retry policies and deadlines (retry.py and its use in the proxy engines)."""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from async_proxy import proxy_call_async
+from conftest import json_response
+from proxy import proxy_call, read_result_body
+from retry import RetryPolicy, retry_after_seconds
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    assert retry_after_seconds({'retry-after': ' 3 '}) == 3.0
+    assert retry_after_seconds({'Retry-After': '-1'}) == 0.0
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert retry_after_seconds({'Retry-After': date}) == pytest.approx(30, abs=2)
+    assert retry_after_seconds({'Retry-After': 'soon'}) is None
+    assert retry_after_seconds({}) is None
+
+
+def test_policy_from_config():
+    policy = RetryPolicy.from_config({'max_attempts': 0, 'methods': ['get'], 'statuses': ['500']})
+    assert policy.max_attempts == 1
+    assert policy.methods == {'GET'} and policy.statuses == {500}
+    assert RetryPolicy.from_config(None) == RetryPolicy()
+
+
+def test_only_idempotent_methods_are_retried():
+    policy = RetryPolicy()
+    assert policy.allows('get') and policy.allows('DELETE')
+    assert not policy.allows('POST')
+    assert not RetryPolicy(max_attempts=1).allows('GET')
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(max_attempts=10, backoff_base=1.0, backoff_max=4.0)
+    deadline = time.monotonic() + 60
+    assert all(0 <= policy.next_delay(1, deadline) <= 1.0 for _ in range(50))
+    assert all(0 <= policy.next_delay(6, deadline) <= 4.0 for _ in range(50))
+    assert policy.next_delay(10, deadline) is None
+
+
+def test_retry_after_is_honoured_within_the_deadline():
+    policy = RetryPolicy()
+    assert policy.next_delay(1, time.monotonic() + 60, retry_after=2.0) == 2.0
+    assert policy.next_delay(1, time.monotonic() + 1, retry_after=2.0) is None
+
+
+def flaky(failures: int, status: int = 503, headers: dict = None):
+    """Handler that fails the first failures requests, then succeeds."""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) <= failures:
+            return json_response({'error': 'busy'}, status=status, headers=headers)
+        return json_response({'ok': True})
+
+    return handler
+
+
+def retrying_service(url: str, **retry) -> dict:
+    return {'svc': {
+        'base_url': url,
+        'token': 't',
+        'cache': {'enabled': False},
+        'retry': {'backoff_base': 0.01, **retry},
+    }}
+
+
+def test_retryable_status_is_retried(upstream, make_store):
+    upstream.handler = flaky(2)
+    store = make_store(retrying_service(upstream.url))
+
+    result = proxy_call('svc', 'items', 'GET', {}, None, '', store)
+    assert result.status == 200
+    assert read_result_body(result.body, 1024) == b'{"ok": true}'
+    assert len(upstream.requests) == 3
+
+
+def test_gives_up_after_max_attempts(upstream, make_store):
+    upstream.handler = flaky(5)
+    store = make_store(retrying_service(upstream.url, max_attempts=2))
+
+    result = proxy_call('svc', 'items', 'GET', {}, None, '', store)
+    assert result.status == 503
+    assert len(upstream.requests) == 2
+
+
+def test_non_idempotent_requests_are_not_retried(upstream, make_store):
+    upstream.handler = flaky(1)
+    store = make_store(retrying_service(upstream.url))
+
+    result = proxy_call('svc', 'items', 'POST', {}, b'{}', '', store)
+    assert result.status == 503
+    assert len(upstream.requests) == 1
+
+
+def test_retry_after_past_the_deadline_is_not_waited_out(upstream, make_store):
+    upstream.handler = flaky(1, headers={'Retry-After': '30'})
+    store = make_store(retrying_service(upstream.url, deadline=5))
+
+    started = time.monotonic()
+    result = proxy_call('svc', 'items', 'GET', {}, None, '', store)
+    assert result.status == 503
+    assert time.monotonic() - started < 2
+    assert len(upstream.requests) == 1
+
+
+def test_attempt_timeout_is_bounded_by_the_deadline(upstream, make_store):
+    hang = threading.Event()
+    upstream.handler = lambda request: (hang.wait(5), json_response({}))[1]
+    store = make_store(retrying_service(upstream.url, deadline=0.5))
+
+    started = time.monotonic()
+    try:
+        result = proxy_call('svc', 'items', 'GET', {}, None, '', store)
+    finally:
+        hang.set()
+    assert result.status == 504
+    assert time.monotonic() - started < 2
+    assert len(upstream.requests) == 1
+
+
+def test_async_engine_retries_the_same_way(upstream, make_store):
+    upstream.handler = flaky(2)
+    store = make_store(retrying_service(upstream.url))
+
+    async def main():
+        result = await proxy_call_async('svc', 'items', 'GET', {}, None, '', store)
+        body = b''.join([chunk async for chunk in result.body])
+        await store.primary('svc').aclose()
+        return result.status, body
+
+    assert asyncio.run(main()) == (200, b'{"ok": true}')
+    assert len(upstream.requests) == 3
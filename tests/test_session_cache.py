@@ -0,0 +1,117 @@
+"""Tests for persisted ATProto sessions (session_cache.py and credentials._renew)."""
+
+import time
+
+import pytest
+
+from conftest import json_response, jwt
+from session_cache import SessionCache
+
+
+def session_fields(access_jwt: str, expires_in: float = 7200) -> dict:
+    return {
+        'access_jwt': access_jwt,
+        'refresh_jwt': 'refresh',
+        'did': 'did:plc:abc',
+        'handle': 'me.test',
+        'expires_at': time.time() + expires_in,
+    }
+
+
+def test_sessions_round_trip_encrypted(tmp_path):
+    path = str(tmp_path / 'sessions')
+    cache = SessionCache(path, 'secret')
+    fields = session_fields(jwt('first'))
+    cache.save('cred', fields)
+
+    assert SessionCache(path, 'secret').load('cred') == fields
+    assert b'first' not in open(path, 'rb').read()
+    assert SessionCache(path, 'other secret').load('cred') is None
+
+    cache.save('cred', None)
+    assert cache.load('cred') is None
+
+
+class Pds:
+    """Handler for a PDS whose session endpoints can be made to fail."""
+
+    def __init__(self, access_jwt: str):
+        self.access_jwt = access_jwt
+        self.refresh_status = 200
+        self.create_status = 200
+
+    def __call__(self, request):
+        data = {'accessJwt': self.access_jwt, 'refreshJwt': 'refresh', 'did': 'did:plc:abc', 'handle': 'me.test'}
+        if 'refreshSession' in request.path:
+            if self.refresh_status == 400:
+                return json_response({'error': 'ExpiredToken'}, status=400)
+            return json_response(data, status=self.refresh_status)
+        if 'createSession' in request.path:
+            return json_response(data, status=self.create_status)
+        return json_response({})
+
+
+@pytest.fixture
+def persisted(tmp_path, monkeypatch) -> SessionCache:
+    """Session persistence as configured through the environment."""
+    path = str(tmp_path / 'sessions')
+    monkeypatch.setenv('PROXY_SESSION_CACHE', path)
+    monkeypatch.setenv('PROXY_SESSION_CACHE_KEY', 'secret')
+    return SessionCache(path, 'secret')
+
+
+def bsky_service(url: str) -> dict:
+    return {'bsky': {
+        'base_url': f'{url}/xrpc',
+        'identifier': 'me.test',
+        'app_password': 'app-password',
+        'identity': {'resolve_pds': False},
+    }}
+
+
+def session_calls(upstream) -> list[str]:
+    return [p.rsplit('.', 1)[-1] for p in upstream.paths() if 'Session' in p]
+
+
+def test_restart_reuses_the_persisted_session(upstream, make_store, persisted):
+    token = jwt('first')
+    upstream.handler = Pds(token)
+    first = make_store(bsky_service(upstream.url)).get('bsky')
+    restarted = make_store(bsky_service(upstream.url)).get('bsky')
+
+    assert first._get_atproto_token() == token
+    assert restarted._get_atproto_token() == token
+    assert session_calls(upstream) == ['createSession']
+
+
+def test_newer_persisted_session_is_adopted_instead_of_refreshing(upstream, make_store, persisted):
+    token, other = jwt('first'), jwt('other')
+    upstream.handler = Pds(token)
+    cred = make_store(bsky_service(upstream.url)).get('bsky')
+    cred._get_atproto_token()
+
+    # Another process renewed the session after ours was rejected
+    persisted.save(cred.credential_id, session_fields(other, expires_in=9000))
+    assert cred.reauthenticate(token) == other
+    assert session_calls(upstream) == ['createSession']
+
+
+def test_transient_refresh_failure_keeps_the_stored_session(upstream, make_store, persisted):
+    token = jwt('first', expires_in=120)
+    pds = upstream.handler = Pds(token)
+    cred = make_store(bsky_service(upstream.url)).get('bsky')
+    cred._get_atproto_token()
+
+    pds.refresh_status = pds.create_status = 502
+    assert not cred.renew_atproto_session()
+    assert persisted.load(cred.credential_id)['access_jwt'] == token
+
+
+def test_rejected_refresh_token_drops_the_stored_session(upstream, make_store, persisted):
+    pds = upstream.handler = Pds(jwt('first', expires_in=120))
+    cred = make_store(bsky_service(upstream.url)).get('bsky')
+    cred._get_atproto_token()
+
+    pds.refresh_status, pds.create_status = 400, 401
+    assert not cred.renew_atproto_session()
+    assert persisted.load(cred.credential_id) is None
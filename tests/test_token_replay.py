@@ -0,0 +1,124 @@
+"""Tests for replaying ATProto requests after a token error (proxy.py checks_token/renews_token)."""
+
+import asyncio
+import json
+
+import pytest
+
+from async_proxy import proxy_call_async
+from conftest import json_response, jwt
+from proxy import TOKEN_ERROR_MAX_BYTES, peek_body, proxy_call, read_result_body
+
+FIRST, RENEWED = jwt('first'), jwt('renewed')
+
+
+def session(access_jwt: str) -> dict:
+    return {'accessJwt': access_jwt, 'refreshJwt': 'refresh', 'did': 'did:plc:abc', 'handle': 'me.test'}
+
+
+def chunked(body: bytes, size: int = 8192):
+    """Send body without Content-Length."""
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def pds(rejected: set, error_body: bytes = b'{"error": "ExpiredToken", "message": "Token has expired"}', stream: bool = False):
+    """Handler for a PDS that answers 400 with error_body to the tokens in rejected."""
+    def handler(request):
+        if 'createSession' in request.path:
+            return json_response(session(FIRST))
+        if 'refreshSession' in request.path:
+            return json_response(session(RENEWED))
+        if request.headers['Authorization'].removeprefix('Bearer ') in rejected:
+            return 400, {'Content-Type': 'application/json'}, chunked(error_body) if stream else error_body
+        return json_response({'feed': []})
+
+    return handler
+
+
+def bsky_service(url: str) -> dict:
+    return {'bsky': {
+        'base_url': f'{url}/xrpc',
+        'identifier': 'me.test',
+        'app_password': 'app-password',
+        'cache': {'enabled': False},
+        'identity': {'resolve_pds': False},
+    }}
+
+
+def timeline(store):
+    result = proxy_call('bsky', 'app.bsky.feed.getTimeline', 'GET', {}, None, '', store)
+    return result.status, read_result_body(result.body, 1024 * 1024)
+
+
+def calls(upstream) -> list[str]:
+    return [p.rsplit('/', 1)[-1].split('?')[0] for p in upstream.paths()]
+
+
+def test_peek_reads_one_chunk_past_the_limit_and_keeps_the_body():
+    consumed = []
+
+    def chunks():
+        for i in range(10):
+            consumed.append(i)
+            yield b'%d' % i * 4
+
+    read, body = peek_body(chunks(), 10)
+    assert read == b'000011112222' and consumed == [0, 1, 2]
+    assert b''.join(body) == b''.join(b'%d' % i * 4 for i in range(10))
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['content-length', 'chunked'])
+def test_token_error_renews_the_session_and_replays_once(upstream, make_store, stream):
+    upstream.handler = pds({FIRST}, stream=stream)
+    store = make_store(bsky_service(upstream.url))
+
+    assert timeline(store) == (200, b'{"feed": []}')
+    assert calls(upstream) == [
+        'com.atproto.server.createSession',
+        'app.bsky.feed.getTimeline',
+        'com.atproto.server.refreshSession',
+        'app.bsky.feed.getTimeline',
+    ]
+    assert upstream.requests[-1].headers['Authorization'] == f'Bearer {RENEWED}'
+
+
+def test_replay_happens_at_most_once(upstream, make_store):
+    error = b'{"error": "InvalidToken"}'
+    upstream.handler = pds({FIRST, RENEWED}, error_body=error)
+    store = make_store(bsky_service(upstream.url))
+
+    assert timeline(store) == (400, error)
+    assert calls(upstream).count('app.bsky.feed.getTimeline') == 2
+
+
+def test_other_errors_pass_through_without_renewal(upstream, make_store):
+    error = b'{"error": "InvalidRequest", "message": "bad cursor"}'
+    upstream.handler = pds({FIRST}, error_body=error)
+    store = make_store(bsky_service(upstream.url))
+
+    assert timeline(store) == (400, error)
+    assert 'com.atproto.server.refreshSession' not in calls(upstream)
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['content-length', 'chunked'])
+def test_large_error_bodies_pass_through_unchanged(upstream, make_store, stream):
+    error = json.dumps({'error': 'ExpiredToken', 'message': 'x' * (2 * TOKEN_ERROR_MAX_BYTES)}).encode()
+    upstream.handler = pds({FIRST}, error_body=error, stream=stream)
+    store = make_store(bsky_service(upstream.url))
+
+    assert timeline(store) == (400, error)
+    assert 'com.atproto.server.refreshSession' not in calls(upstream)
+
+
+def test_async_engine_replays_the_same_way(upstream, make_store):
+    upstream.handler = pds({FIRST}, stream=True)
+    store = make_store(bsky_service(upstream.url))
+
+    async def main():
+        result = await proxy_call_async('bsky', 'app.bsky.feed.getTimeline', 'GET', {}, None, '', store)
+        body = b''.join([chunk async for chunk in result.body])
+        await store.primary('bsky').aclose()
+        return result.status, body
+
+    assert asyncio.run(main()) == (200, b'{"feed": []}')
+    assert calls(upstream).count('app.bsky.feed.getTimeline') == 2
@@ -0,0 +1,84 @@
+"""Tests for streamed request bodies and the upload size limit (proxy.py and async_proxy.py)."""
+
+import asyncio
+import io
+import json
+
+from async_proxy import AsyncStreamingBody, proxy_call_async
+from breaker import CLOSED
+from conftest import json_response
+from proxy import BODY_CHUNK_SIZE, StreamingBody, proxy_call, read_result_body
+
+LIMIT = 3 * BODY_CHUNK_SIZE
+
+
+def upload_service(url: str) -> dict:
+    return {'svc': {'base_url': url, 'token': 't', 'circuit_breaker': {'min_calls': 1}}}
+
+
+def upload(store, body) -> tuple[int, dict]:
+    result = proxy_call('svc', 'upload', 'POST', {}, body, '', store)
+    return result.status, json.loads(read_result_body(result.body, 1024))
+
+
+def test_declared_oversized_body_is_refused_before_sending(upstream, make_store):
+    store = make_store(upload_service(upstream.url))
+    body = StreamingBody(io.BytesIO(b''), LIMIT + 1, max_bytes=LIMIT)
+
+    assert upload(store, body) == (413, {'error': 'request body too large', 'max_bytes': LIMIT})
+    assert upstream.requests == []
+
+
+def test_bodies_within_the_limit_are_streamed_through(upstream, make_store):
+    upstream.handler = lambda request: json_response({'size': len(request.body), 'chunked': request.headers.get('Transfer-Encoding')})
+    store = make_store(upload_service(upstream.url))
+    data = b'x' * LIMIT
+
+    assert upload(store, StreamingBody(io.BytesIO(data), None, max_bytes=LIMIT)) == (200, {'size': LIMIT, 'chunked': 'chunked'})
+    assert upload(store, StreamingBody(io.BytesIO(data), LIMIT, max_bytes=LIMIT)) == (200, {'size': LIMIT, 'chunked': None})
+
+
+def test_undeclared_oversized_body_is_aborted_while_streaming(upstream, make_store):
+    store = make_store(upload_service(upstream.url))
+    body = StreamingBody(io.BytesIO(b'x' * (LIMIT + 1)), None, max_bytes=LIMIT)
+
+    assert upload(store, body) == (413, {'error': 'request body too large', 'max_bytes': LIMIT})
+    assert body.bytes_read == LIMIT + 1
+    # The client's oversized upload says nothing about the upstream's health
+    assert store.get('svc').breaker.state == CLOSED
+
+
+def test_understated_content_length_is_caught_when_buffering_for_replay(upstream, make_store):
+    upstream.handler = lambda request: json_response({'accessJwt': 'x.e30.y', 'refreshJwt': 'r', 'did': 'did:plc:abc', 'handle': 'me.test'})
+    store = make_store({'bsky': {
+        'base_url': f'{upstream.url}/xrpc',
+        'identifier': 'me.test',
+        'app_password': 'app-password',
+        'identity': {'resolve_pds': False},
+    }})
+    body = StreamingBody(io.BytesIO(b'x' * (LIMIT + 1)), 10, max_bytes=LIMIT)
+
+    result = proxy_call('bsky', 'com.atproto.repo.uploadBlob', 'POST', {}, body, '', store)
+    assert result.status == 413
+    assert not [p for p in upstream.paths() if 'uploadBlob' in p]
+
+
+def test_async_engine_enforces_the_same_limit(upstream, make_store):
+    store = make_store(upload_service(upstream.url))
+
+    async def chunks(count: int):
+        for _ in range(count):
+            yield b'x' * BODY_CHUNK_SIZE
+
+    async def main():
+        results = []
+        for count in (3, 4):
+            result = await proxy_call_async('svc', 'upload', 'POST', {}, AsyncStreamingBody(chunks(count), None, max_bytes=LIMIT), '', store)
+            if not isinstance(result.body, bytes):
+                [chunk async for chunk in result.body]
+            results.append(result.status)
+        await store.primary('svc').aclose()
+        return results
+
+    assert asyncio.run(main()) == [200, 413]
+    assert store.get('svc').breaker.state == CLOSED